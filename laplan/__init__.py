@@ -1,10 +1,21 @@
 """
 Tools for working with City of Los Angeles planning and zoning data.
 """
+import importlib
+
+from . import cache
 from . import census
+from . import parcels
 from . import pcts
 from . import zoning
 
 __version__ = "0.1.0"
 
-__all__ = ["census", "pcts", "zoning"]
+__all__ = ["cache", "census", "parcels", "pcts", "spatial", "zoning"]
+
+
+def __getattr__(name):
+    # spatial needs geopandas, so it is only imported once it is used.
+    if name == "spatial":
+        return importlib.import_module(f"{__name__}.spatial")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
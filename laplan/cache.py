@@ -0,0 +1,6 @@
+"""
+Where laplan keeps local copies of data between runs.
+"""
+import os
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "laplan")
@@ -0,0 +1,343 @@
+"""
+A memory-mapped store of parcel attributes.
+"""
+import json
+import os
+import shutil
+
+import fsspec
+import numpy
+import pandas
+
+from .cache import CACHE_DIR
+
+# The parcel attributes in the store written by A6_create_crosswalks.
+# x and y are the centroid in laplan.spatial.CANONICAL_CRS, and uuid is
+# the group of parcels which share a centroid, from A3_store_parcel_work.
+PARCEL_COLUMNS = ["AIN", "x", "y", "GEOID", "TOC_Tier", "zone_class", "uuid"]
+
+META_FILE = "meta.json"
+
+
+def missing_value(dtype):
+    """
+    The value a ParcelStore stores for missing values of a numpy dtype.
+    """
+    return {"f": numpy.nan, "b": False}.get(dtype.kind, -1)
+
+
+def ain_array(ains):
+    """
+    AINs, given as ints or strings, as an int64 array,
+    with -1 for any which aren't numbers.
+    """
+    ains = numpy.asarray(ains)
+    try:
+        return ains.astype("int64")
+    except (TypeError, ValueError):
+        ains = pandas.to_numeric(pandas.Series(ains), errors="coerce")
+        return ains.fillna(-1).to_numpy().astype("int64")
+
+
+# -------------------------------------------------------------------------------------#
+# Parcel store
+# -------------------------------------------------------------------------------------#
+
+
+class ParcelStore:
+    """
+    Parcel attributes, stored as one fixed-width numpy array per column
+    in a directory, sorted by AIN. Opening a store memory-maps the arrays,
+    so it is instant, and processes which open the same store share
+    the memory, rather than each loading their own copy.
+
+    String columns are dictionary-encoded: the array holds integer codes
+    into the sorted distinct values, with -1 for missing values.
+    Missing values of integer columns are stored as -1.
+
+    Example
+    =======
+
+    store = laplan.parcels.ParcelStore(path)
+    rows = store.positions(pcts.AIN)
+    tiers = store.get("TOC_Tier", rows)
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        self.path = path
+        self.columns = meta["columns"]
+        self.categories = {
+            name: numpy.array(values, dtype=object)
+            for name, values in meta["categories"].items()
+        }
+        self.arrays = {
+            name: numpy.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in self.columns
+        }
+
+    def __len__(self):
+        return len(self.arrays["AIN"])
+
+    @classmethod
+    def write(cls, df, path):
+        """
+        Write a DataFrame of parcel attributes with unique AINs to a store,
+        replacing any store already at path, and open it.
+        """
+        df = df.assign(AIN=ain_array(df.AIN)).sort_values("AIN")
+        if (df.AIN < 0).any() or df.AIN.duplicated().any():
+            raise ValueError("The AINs of a ParcelStore must be unique numbers")
+
+        # Write the new store next to the old one, and then swap them, so that
+        # processes which have the old one open keep reading the old files.
+        tmp = f"{path}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        categories = {}
+        for name in df.columns:
+            values = df[name]
+            if pandas.api.types.is_numeric_dtype(values.dtype):
+                if pandas.api.types.is_extension_array_dtype(values.dtype):
+                    # Nullable integers and booleans.
+                    values = values.to_numpy(
+                        dtype=values.dtype.numpy_dtype,
+                        na_value=missing_value(values.dtype),
+                    )
+                else:
+                    values = values.to_numpy()
+            else:
+                codes, uniques = pandas.factorize(values.astype("object"), sort=True)
+                categories[name] = [str(u) for u in uniques]
+                values = codes.astype("int16" if len(uniques) < 2 ** 15 else "int32")
+            numpy.save(
+                os.path.join(tmp, f"{name}.npy"), numpy.ascontiguousarray(values)
+            )
+        with open(os.path.join(tmp, META_FILE), "w") as f:
+            json.dump({"columns": list(df.columns), "categories": categories}, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+        return cls(path)
+
+    def positions(self, ains):
+        """
+        The row of each AIN in the store, or -1 for AINs which aren't in it.
+
+        Parameters
+        ==========
+
+        ains: array-like of ints or strings
+        """
+        ains = ain_array(ains)
+        stored = self.arrays["AIN"]
+        if not len(stored):
+            return numpy.full(len(ains), -1)
+        pos = numpy.searchsorted(stored, ains).clip(max=len(stored) - 1)
+        return numpy.where(stored[pos] == ains, pos, -1)
+
+    def get(self, name, rows=None):
+        """
+        The values of a column, for the given rows, or all of them.
+        String columns are returned as a pandas.Categorical.
+        Rows of -1, from positions of AINs which aren't in the store,
+        get missing values, as stored for the type of the column.
+        """
+        if rows is None:
+            values = self.arrays[name]
+        else:
+            rows = numpy.asarray(rows)
+            values = self.arrays[name][rows]
+            values = numpy.where(rows < 0, missing_value(values.dtype), values)
+        if name in self.categories:
+            return pandas.Categorical.from_codes(values, self.categories[name])
+        return values
+
+    def to_frame(self, columns=None, ains=None):
+        """
+        The store as a DataFrame, optionally only for some columns or
+        parcels. AINs which aren't in the store are left out.
+        """
+        rows = None
+        if ains is not None:
+            rows = self.positions(ains)
+            rows = rows[rows >= 0]
+        return pandas.DataFrame(
+            {name: self.get(name, rows) for name in columns or self.columns}
+        )
+
+
+def cached_store(url, cache_dir=CACHE_DIR, refresh=False):
+    """
+    Open a ParcelStore, first downloading it from url (such as an S3
+    prefix) into the local cache, if it isn't already there. Memory-mapping
+    needs a local copy.
+    """
+    path = os.path.join(cache_dir, os.path.basename(url.rstrip("/")))
+    if refresh or not os.path.exists(path):
+        tmp = f"{path}.download"
+        shutil.rmtree(tmp, ignore_errors=True)
+        fs, _, (remote,) = fsspec.core.get_fs_token_paths(url)
+        fs.get(remote, tmp, recursive=True)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+    return ParcelStore(path)
+
+
+# -------------------------------------------------------------------------------------#
+# Parcel history
+# -------------------------------------------------------------------------------------#
+
+# The assessor roll history written by A2_import_assessor_parcels is split
+# into this many files, by a hash of the AIN, so that the history of a set
+# of parcels can be read without reading all of it.
+HISTORY_PARTITIONS = 64
+
+
+def ain_partition(ains, partitions=HISTORY_PARTITIONS):
+    """
+    The history partition of each AIN.
+    """
+    return (pandas.util.hash_array(ain_array(ains)) % partitions).astype("int64")
+
+
+def encode_history(df, key="AIN", year="RollYear"):
+    """
+    Run-length encode the yearly rows of each parcel. Consecutive years
+    in which a parcel has the same attributes are stored as a single row,
+    with the first year of the run in the year column, and the last in
+    Last{year}. Years missing from the middle of a run count as part of it.
+
+    Parameters
+    ==========
+
+    df: pandas.DataFrame
+        A row per parcel and year, such as the county assessor roll.
+
+    key: str
+        The parcel id column.
+
+    year: str
+        The year column.
+    """
+    df = df.sort_values([key, year], kind="mergesort").reset_index(drop=True)
+    prev = df.shift()
+    same = df[key].eq(prev[key])
+    for c in df.columns.drop([key, year]):
+        same &= df[c].eq(prev[c]) | (df[c].isna() & prev[c].isna())
+    run = (~same).cumsum()
+    return (
+        df[~same]
+        .assign(**{f"Last{year}": df.groupby(run)[year].max().values})
+        .reset_index(drop=True)
+    )
+
+
+def read_history(path, ains=None, columns=None):
+    """
+    Read the assessor roll history written by A2_import_assessor_parcels,
+    optionally only the partitions which hold the given AINs.
+    """
+    if ains is None:
+        return pandas.read_parquet(path, columns=columns)
+    ains = ain_array(ains)
+    parts = numpy.unique(ain_partition(ains))
+    history = pandas.concat(
+        [
+            pandas.read_parquet(f"{path}/part_{p}.parquet", columns=columns)
+            for p in parts
+        ],
+        ignore_index=True,
+    )
+    return history[history.AIN.isin(ains)].reset_index(drop=True)
+
+
+def as_of(history, ains, years, year="RollYear"):
+    """
+    The attributes of each parcel as of a year, from a run-length encoded
+    history, such as the assessor roll in the year a case was filed.
+    Parcels which weren't on the roll in that year, or have a missing year
+    (e.g. a case without a filing date), get null attributes.
+
+    Parameters
+    ==========
+
+    history: pandas.DataFrame
+        The history from encode_history or read_history.
+
+    ains: array-like of ints or strings
+        The AINs of the parcels.
+
+    years: int or array-like of ints
+        The year to look up for each parcel. May contain nulls.
+
+    Returns
+    =======
+    A DataFrame of the AINs, years (as nullable integers) and attributes,
+    in the same order as ains.
+    """
+    ains = ain_array(ains)
+    if numpy.ndim(years) == 0:
+        years = pandas.Series(years, index=range(len(ains)), dtype="float64")
+    years = pandas.Series(years).astype("float64").to_numpy()
+    known = numpy.flatnonzero(~numpy.isnan(years))
+    query = pandas.DataFrame(
+        {"AIN": ains[known], "year": years[known].astype(history[year].dtype)},
+        index=known,
+    )
+    history = history.assign(AIN=ain_array(history.AIN))
+    joined = pandas.merge_asof(
+        query.reset_index().sort_values("year", kind="mergesort"),
+        history.sort_values(year, kind="mergesort"),
+        left_on="year",
+        right_on=year,
+        by="AIN",
+    )
+    attributes = history.columns.drop(["AIN", year, f"Last{year}"])
+    off_roll = ~(joined.year <= joined[f"Last{year}"])
+    joined.loc[off_roll, attributes] = None
+    return pandas.concat(
+        [
+            pandas.DataFrame(
+                {"AIN": ains, "year": pandas.Series(years).astype("Int64")}
+            ),
+            joined.set_index("index")[attributes].reindex(range(len(ains))),
+        ],
+        axis=1,
+    )
+
+
+# -------------------------------------------------------------------------------------#
+# Parcel centroids
+# -------------------------------------------------------------------------------------#
+
+# Centroids are compared at 7 decimal places (about 1 cm). This needs the
+# float64 coordinates of the centroids file: float32 only resolves
+# about half a meter at LA's latitude and longitude.
+COORD_SCALE = 10 ** 7
+
+
+def centroid_groups(lon, lat, scale=COORD_SCALE):
+    """
+    Number the parcels by their centroid, so that parcels with the same
+    centroid, e.g. the condos of one building, get the same id.
+
+    Parameters
+    ==================
+    lon, lat: arrays of float64 centroid coordinates.
+    scale: the centroids are rounded to 1 / scale degrees.
+
+    Returns
+    =======
+    Three arrays: the rounded longitude and latitude of each parcel,
+    and its group id. The ids follow the order of the rounded coordinates,
+    so they are the same on every run.
+    """
+    # Quantize the points to integers, so duplicates are compared exactly,
+    # and pack each pair into a single int64 key.
+    x = numpy.round(numpy.asarray(lon, dtype="float64") * scale).astype("int64")
+    y = numpy.round(numpy.asarray(lat, dtype="float64") * scale).astype("int64")
+    key = (x << 32) + (y + 2 ** 31)
+    uuid, _ = pandas.factorize(key, sort=True)
+    return x / scale, y / scale, uuid
@@ -5,8 +5,11 @@ import dataclasses
 import re
 import typing
 
+import numpy
 import pandas
 
+from .parcels import ain_array
+
 GENERAL_PCTS_RE = re.compile("([A-Z]+)-([0-9X]{4})-([0-9]+)((?:-[A-Z0-9]+)*)$")
 MISSING_YEAR_RE = re.compile("([A-Z]+)-([0-9]+)((?:-[A-Z0-9]+)*)$")
 
@@ -266,6 +269,486 @@ class PCTSCaseNumber:
             self.suffix = groups[2].strip("-").split("-")
 
 
+def _parse_case_numbers(case_numbers):
+    """
+    Parse a series of PCTS case numbers, returning a series of prefixes
+    and a DataFrame with a column for each position of the suffixes.
+    Case numbers which fail to parse have a null prefix.
+    """
+    cols = case_numbers.str.extract(GENERAL_PCTS_RE)
+
+    all_prefixes = cols[0]
+    all_suffixes = cols[3].str[1:]
+
+    # Parse additional prefixes and suffixes that did not pass the first regex
+    # to fill NaN values based on indices.  Suffixes at position 2 instead of 3.
+    failed_general_parse = all_prefixes.isna()
+    additional_cols = case_numbers[failed_general_parse].str.extract(MISSING_YEAR_RE)
+
+    additional_prefixes = additional_cols[0]
+    additional_suffixes = additional_cols[2].str[1:]
+
+    all_prefixes.loc[additional_prefixes.index] = additional_prefixes.values
+    all_suffixes.loc[additional_suffixes.index] = additional_suffixes.values
+    return all_prefixes, all_suffixes.str.split("-", expand=True)
+
+
+def _date_range(start_date=None, end_date=None):
+    """
+    Resolve the date range used to subset PCTS, which defaults to
+    2010-01-01 through the present day.
+    """
+    start_date = (
+        pandas.to_datetime(start_date)
+        if start_date
+        else pandas.to_datetime("2010-01-01")
+    )
+    end_date = pandas.to_datetime(end_date) if end_date else pandas.Timestamp.now()
+    return start_date, end_date
+
+
+def load_pcts(path, start_date=None, end_date=None, columns=None):
+    """
+    Load a date range of the PCTS dataset partitioned by FILE_YEAR,
+    which is written by A5_create_pcts_master. The date range is pushed
+    down to the parquet reader, so only the filing years and row groups
+    which overlap it are read. The result can be passed to subset_pcts.
+
+    Parameters
+    ==========
+    path: str
+        The path (or URL) of the partitioned PCTS dataset.
+
+    start_date: time-like
+        Optional start date cutoff. Defaults to 2010-01-01, like subset_pcts.
+
+    end_date: time-like
+        Optional end-date cutoff. Defaults to the present day.
+
+    columns: iterable of strings
+        Optional list of columns to read. If not given, all columns are read.
+    """
+    start_date, end_date = _date_range(start_date, end_date)
+    filters = [
+        ("FILE_YEAR", ">=", start_date.year),
+        ("FILE_YEAR", "<=", end_date.year),
+        ("FILE_DATE", ">=", start_date),
+        ("FILE_DATE", "<=", end_date),
+    ]
+    pcts = pandas.read_parquet(
+        path,
+        engine="pyarrow",
+        columns=list(columns) if columns is not None else None,
+        filters=filters,
+    )
+    return pcts.drop(columns=["FILE_YEAR"], errors="ignore")
+
+
+def _postings(rows, values):
+    """
+    The sorted row ids of each distinct value.
+    """
+    df = pandas.DataFrame({"row": rows, "value": values}).dropna().drop_duplicates()
+    codes, uniques = pandas.factorize(df.value, sort=True)
+    order = numpy.lexsort((df.row.to_numpy(), codes))
+    row_ids = df.row.to_numpy()[order].astype("int32")
+    bounds = numpy.searchsorted(codes[order], numpy.arange(len(uniques) + 1))
+    return {u: row_ids[bounds[i] : bounds[i + 1]] for i, u in enumerate(uniques)}
+
+
+def _union(postings, keys):
+    arrays = [postings[k] for k in keys if k in postings]
+    if not arrays:
+        return numpy.empty(0, dtype="int32")
+    return numpy.unique(numpy.concatenate(arrays))
+
+
+@dataclasses.dataclass
+class PCTSIndex:
+    """
+    An index of the rows of a PCTS extract by prefix, suffix and file date,
+    which selects the rows matching a subset_pcts query without scanning
+    the whole extract. Prefixes and suffixes are parsed from the case
+    numbers once, when the index is built.
+
+    A5_create_pcts_master writes the index of the master PCTS file
+    next to it, as pcts_index.npz. Its row ids are the positions of
+    the rows in that file.
+
+    Example
+    =======
+
+    index = PCTSIndex.load("pcts_index.npz")
+    rows = index.query(
+        start_date="2015-01-01", end_date="2019-12-31", suffix_list=["ZC", "GPA"]
+    )
+    subset = pcts.iloc[rows]
+    """
+
+    nrows: int
+    prefixes: typing.Dict[str, numpy.ndarray]
+    suffixes: typing.Dict[str, numpy.ndarray]
+    # The file dates, sorted, and the row of each one. Rows without
+    # a file date are left out, since they never match a date range.
+    file_dates: numpy.ndarray
+    date_rows: numpy.ndarray
+
+    @classmethod
+    def build(cls, pcts):
+        """
+        Index a PCTS extract, which needs the CASE_NUMBER and FILE_DATE columns.
+        """
+        rows = numpy.arange(len(pcts), dtype="int32")
+        prefixes, suffixes = _parse_case_numbers(
+            pcts.CASE_NUMBER.reset_index(drop=True)
+        )
+        suffixes = suffixes.stack()
+
+        file_dates = pcts.FILE_DATE.to_numpy(dtype="datetime64[ns]")
+        dated = ~numpy.isnat(file_dates)
+        order = numpy.argsort(file_dates[dated], kind="mergesort")
+
+        return cls(
+            nrows=len(pcts),
+            prefixes=_postings(rows, prefixes),
+            suffixes=_postings(
+                suffixes.index.get_level_values(0).to_numpy(), suffixes.to_numpy()
+            ),
+            file_dates=file_dates[dated][order],
+            date_rows=rows[dated][order],
+        )
+
+    def query(self, start_date=None, end_date=None, prefix_list=None, suffix_list=None):
+        """
+        The sorted row ids filed within the date range, with one of the
+        prefixes and one of the suffixes, if given. The dates and lists work
+        as in subset_pcts.
+        """
+        start_date, end_date = _date_range(start_date, end_date)
+        lo = numpy.searchsorted(self.file_dates, start_date.to_datetime64(), "left")
+        hi = numpy.searchsorted(self.file_dates, end_date.to_datetime64(), "right")
+        rows = numpy.sort(self.date_rows[lo:hi])
+        if prefix_list is not None:
+            rows = numpy.intersect1d(
+                rows, _union(self.prefixes, prefix_list), assume_unique=True
+            )
+        if suffix_list is not None:
+            rows = numpy.intersect1d(
+                rows, _union(self.suffixes, suffix_list), assume_unique=True
+            )
+        return rows.astype("int32")
+
+    def save(self, f):
+        """
+        Save the index to a file or path, as an uncompressed .npz.
+        """
+        numpy.savez(
+            f,
+            nrows=self.nrows,
+            file_dates=self.file_dates,
+            date_rows=self.date_rows,
+            **{f"prefix_{k}": v for k, v in self.prefixes.items()},
+            **{f"suffix_{k}": v for k, v in self.suffixes.items()},
+        )
+
+    @classmethod
+    def load(cls, f):
+        """
+        Load an index saved with PCTSIndex.save from a file or path.
+        """
+        with numpy.load(f) as arrays:
+            arrays = dict(arrays)
+        return cls(
+            nrows=int(arrays.pop("nrows")),
+            file_dates=arrays.pop("file_dates"),
+            date_rows=arrays.pop("date_rows"),
+            prefixes={
+                k[len("prefix_") :]: v
+                for k, v in arrays.items()
+                if k.startswith("prefix_")
+            },
+            suffixes={
+                k[len("suffix_") :]: v
+                for k, v in arrays.items()
+                if k.startswith("suffix_")
+            },
+        )
+
+
+@dataclasses.dataclass
+class ParcelCaseIndex:
+    """
+    An index from parcels (AINs) to the rows of a PCTS extract which
+    touch them, in compressed sparse row form: the rows of ains[i]
+    are rows[offsets[i]:offsets[i + 1]]. Building it takes a single sort,
+    and looking up parcels a binary search of the sorted AINs.
+
+    Example
+    =======
+
+    pcts = laplan.pcts.load_pcts(path)
+    index = laplan.pcts.ParcelCaseIndex.build(pcts)
+    parcel_idx, rows = index.cases_for_parcels(parcels.AIN)
+    cases = pcts.iloc[rows].assign(AIN=parcels.AIN.values[parcel_idx])
+    """
+
+    nrows: int
+    # Sorted, distinct AINs.
+    ains: numpy.ndarray
+    offsets: numpy.ndarray
+    # The row ids of each AIN, sorted.
+    rows: numpy.ndarray
+
+    @classmethod
+    def build(cls, pcts):
+        """
+        Index a PCTS extract by its AIN column.
+        """
+        ains = ain_array(pcts.AIN)
+        order = numpy.argsort(ains, kind="mergesort")
+        order = order[ains[order] >= 0]
+        ains = ains[order]
+        distinct, starts = numpy.unique(ains, return_index=True)
+        return cls(
+            nrows=len(pcts),
+            ains=distinct,
+            offsets=numpy.append(starts, len(ains)).astype("int64"),
+            rows=order.astype("int32"),
+        )
+
+    def cases_for_parcels(self, ains):
+        """
+        Look up the PCTS rows of many parcels at once, returning
+        the positions in ains and the row ids of each match. Parcels
+        with several cases match several times, and those with none
+        don't match at all.
+
+        Parameters
+        ==========
+
+        ains: array-like of ints or strings
+            The AINs of the parcels.
+        """
+        ains = ain_array(ains)
+        if not len(self.ains):
+            return numpy.empty(0, dtype="int64"), numpy.empty(0, dtype="int32")
+        pos = numpy.searchsorted(self.ains, ains).clip(max=len(self.ains) - 1)
+        found = self.ains[pos] == ains
+        counts = numpy.where(found, self.offsets[pos + 1] - self.offsets[pos], 0)
+
+        parcel_idx = numpy.repeat(numpy.arange(len(ains)), counts)
+        # The position of each match within the rows of its parcel.
+        within = numpy.arange(len(parcel_idx)) - numpy.repeat(
+            numpy.cumsum(counts) - counts, counts
+        )
+        rows = self.rows[numpy.repeat(self.offsets[pos], counts) + within]
+        return parcel_idx, rows
+
+
+# Words of project descriptions, after lower-casing.
+TOKEN_RE = re.compile("[a-z0-9]+")
+
+# Numbers from one to ninety-nine, spelled out, and their values.
+_ONES = "one two three four five six seven eight nine".split()
+_TEENS = (
+    "ten eleven twelve thirteen fourteen fifteen sixteen seventeen eighteen nineteen"
+)
+_TENS = "twenty thirty forty fifty sixty seventy eighty ninety".split()
+SPELLED_NUMBERS = {
+    **{w: i + 1 for i, w in enumerate(_ONES)},
+    **{w: i + 10 for i, w in enumerate(_TEENS.split())},
+    **{w: 10 * (i + 2) for i, w in enumerate(_TENS)},
+    **{
+        f"{t} {o}": 10 * (i + 2) + j + 1
+        for i, t in enumerate(_TENS)
+        for j, o in enumerate(_ONES)
+    },
+}
+_SPELLED_RE = (
+    rf"(?:{'|'.join(_TENS)})(?:[\s-](?:{'|'.join(_ONES)}))?"
+    rf"|{_TEENS.replace(' ', '|')}|{'|'.join(_ONES)}"
+)
+
+# A count of (dwelling) units, such as "12 units", "5-unit", "(N) 24 new
+# residential units", "1,200 units" or "twenty-four units". At most two
+# words may come between the number and "unit". For a range, such as
+# "10-12 units", only the upper bound is matched.
+UNITS_RE = re.compile(
+    rf"(?<![\d,.])(\d[\d,]*|\b(?:{_SPELLED_RE})\b)"
+    r"(?:[\s-]+[a-z()]+){0,2}?[\s-]+units?\b",
+    re.IGNORECASE,
+)
+
+
+def _tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def extract_units(descriptions):
+    """
+    Extract the number of units from a series of project descriptions,
+    given in digits or spelled out. If a description gives several, or
+    a range, the largest is taken. Descriptions without a unit count
+    are null.
+
+    Parameters
+    ==========
+
+    descriptions: pandas.Series
+        Project descriptions, such as the PROJECT_DESCRIPTION column of PCTS.
+    """
+    matches = descriptions.str.extractall(UNITS_RE)[0]
+    counts = pandas.to_numeric(matches.str.replace(",", ""), errors="coerce")
+    spelled = matches.str.lower().str.replace("-", " ").map(SPELLED_NUMBERS)
+    counts = counts.fillna(spelled).groupby(level=0).max()
+    return counts.reindex(descriptions.index).astype("Int64")
+
+
+@dataclasses.dataclass
+class DescriptionIndex:
+    """
+    A positional inverted index of the words in PCTS project descriptions.
+    Each word maps to the rows it appears in, and its position in them,
+    so rows can be searched by words and phrases without scanning all of
+    the descriptions. Words are lower-cased, and anything other than letters
+    and digits separates them.
+
+    A5_create_pcts_master writes the index of the master PCTS file next to it,
+    as pcts_description_index.npz. Like PCTSIndex, its row ids are the
+    positions of the rows in that file, so the results of the two
+    can be combined with numpy.intersect1d.
+
+    Example
+    =======
+
+    index = DescriptionIndex.load("pcts_description_index.npz")
+    rows = index.search(
+        any_of=["adu", "accessory dwelling unit"], none_of=["demolition"]
+    )
+    subset = pcts.iloc[rows]
+    """
+
+    nrows: int
+    # Sorted, distinct words.
+    vocabulary: numpy.ndarray
+    offsets: numpy.ndarray
+    # The rows and positions of each word, sorted.
+    rows: numpy.ndarray
+    positions: numpy.ndarray
+
+    @classmethod
+    def build(cls, descriptions):
+        """
+        Index a series of project descriptions, such as the
+        PROJECT_DESCRIPTION column of PCTS.
+        """
+        words = (
+            descriptions.reset_index(drop=True)
+            .fillna("")
+            .str.lower()
+            .str.findall(TOKEN_RE)
+            .explode()
+            .dropna()
+        )
+        rows = words.index.to_numpy()
+        positions = words.groupby(level=0).cumcount().to_numpy()
+        codes, vocabulary = pandas.factorize(words, sort=True)
+        order = numpy.lexsort((positions, rows, codes))
+        return cls(
+            nrows=len(descriptions),
+            vocabulary=numpy.asarray(vocabulary, dtype=object),
+            offsets=numpy.searchsorted(
+                codes[order], numpy.arange(len(vocabulary) + 1)
+            ).astype("int64"),
+            rows=rows[order].astype("int32"),
+            positions=positions[order].astype("int32"),
+        )
+
+    def _postings(self, word):
+        i = numpy.searchsorted(self.vocabulary, word)
+        if i == len(self.vocabulary) or self.vocabulary[i] != word:
+            return numpy.empty(0, dtype="int32"), numpy.empty(0, dtype="int32")
+        s = slice(self.offsets[i], self.offsets[i + 1])
+        return self.rows[s], self.positions[s]
+
+    def phrase(self, text):
+        """
+        The sorted row ids whose descriptions contain the words of text,
+        one after another. A single word matches wherever it appears.
+        """
+        words = _tokenize(text)
+        if not words:
+            return numpy.empty(0, dtype="int32")
+        if len(words) == 1:
+            return numpy.unique(self._postings(words[0])[0])
+
+        # Match the start position of the phrase in each row,
+        # by shifting the positions of each word back by its offset.
+        matches = None
+        for offset, word in enumerate(words):
+            rows, positions = self._postings(word)
+            start = positions >= offset
+            keys = (rows[start].astype("int64") << 32) + (positions[start] - offset)
+            matches = (
+                numpy.unique(keys)
+                if matches is None
+                else numpy.intersect1d(matches, keys)
+            )
+            if not len(matches):
+                break
+        return numpy.unique(matches >> 32).astype("int32")
+
+    def search(self, all_of=(), any_of=(), none_of=()):
+        """
+        The sorted row ids whose descriptions contain all of the words or
+        phrases in all_of, at least one of those in any_of (if given), and
+        none of those in none_of.
+        """
+        rows = numpy.arange(self.nrows, dtype="int32")
+        for text in all_of:
+            rows = numpy.intersect1d(rows, self.phrase(text), assume_unique=True)
+        if any_of:
+            rows = numpy.intersect1d(
+                rows,
+                numpy.unique(numpy.concatenate([self.phrase(t) for t in any_of])),
+                assume_unique=True,
+            )
+        for text in none_of:
+            rows = numpy.setdiff1d(rows, self.phrase(text), assume_unique=True)
+        return rows.astype("int32")
+
+    def save(self, f):
+        """
+        Save the index to a file or path, as an uncompressed .npz.
+        """
+        numpy.savez(
+            f,
+            nrows=self.nrows,
+            # Words never contain spaces, so they are stored in a single string.
+            vocabulary=numpy.array(" ".join(self.vocabulary)),
+            offsets=self.offsets,
+            rows=self.rows,
+            positions=self.positions,
+        )
+
+    @classmethod
+    def load(cls, f):
+        """
+        Load an index saved with DescriptionIndex.save from a file or path.
+        """
+        with numpy.load(f) as arrays:
+            vocabulary = str(arrays["vocabulary"])
+            return cls(
+                nrows=int(arrays["nrows"]),
+                vocabulary=numpy.array(
+                    vocabulary.split(" ") if vocabulary else [], dtype=object
+                ),
+                offsets=arrays["offsets"],
+                rows=arrays["rows"],
+                positions=arrays["positions"],
+            )
+
+
 # Subset PCTS given a start date and a list of prefixes or suffixes
 def subset_pcts(
     pcts,
@@ -275,6 +758,7 @@ def subset_pcts(
     suffix_list=None,
     get_dummies=False,
     verbose=False,
+    index=None,
 ):
     """
     Download an subset a PCTS extract for analysis. This is intended to
@@ -302,14 +786,21 @@ def subset_pcts(
 
     verbose: bool
         Whether to ouptut information about subsetting as it happens.
+
+    index: PCTSIndex
+        Optional index of pcts. If given, the rows matching the date range,
+        prefixes and suffixes are looked up in the index, and only those
+        rows are parsed.
     """
+    if index is not None:
+        if index.nrows != len(pcts):
+            raise ValueError("The PCTSIndex was not built from this PCTS extract")
+        pcts = pcts.iloc[
+            index.query(start_date, end_date, prefix_list or None, suffix_list or None)
+        ]
+
     # Subset PCTS by start / end date
-    start_date = (
-        pandas.to_datetime(start_date)
-        if start_date
-        else pandas.to_datetime("2010-01-01")
-    )
-    end_date = pandas.to_datetime(end_date) if end_date else pandas.Timestamp.now()
+    start_date, end_date = _date_range(start_date, end_date)
 
     pcts = (
         pcts[
@@ -324,23 +815,7 @@ def subset_pcts(
 
     if verbose:
         print("Parsing PCTS case numbers")
-    # Parse CASE_NBR
-    cols = pcts.CASE_NUMBER.str.extract(GENERAL_PCTS_RE)
-    
-    all_prefixes = cols[0]
-    all_suffixes = cols[3].str[1:]
-    
-    # Parse additional prefixes and suffixes that did not pass the first regex
-    # to fill NaN values based on indices.  Suffixes at position 2 instead of 3.
-    failed_general_parse = all_prefixes.isna()
-    additional_cols = pcts[failed_general_parse].CASE_NUMBER.str.extract(MISSING_YEAR_RE)
-    
-    additional_prefixes = additional_cols[0]
-    additional_suffixes = additional_cols[2].str[1:]
-
-    all_prefixes.at[additional_prefixes.index] = additional_prefixes.values
-    all_suffixes.at[additional_suffixes.index] = additional_suffixes.values
-    all_suffixes = all_suffixes.str.split("-", expand=True)
+    all_prefixes, all_suffixes = _parse_case_numbers(pcts.CASE_NUMBER)
 
     if verbose:
         print(f"{len(all_prefixes[all_prefixes.isna()])} cases failed to parse.")
@@ -462,3 +937,230 @@ def drop_child_cases(pcts, keep_child_entitlements=True):
         return pcts_agg[pcts_agg.PARENT_CASE_ID.isna()]
     else:
         return pcts[pcts.PARENT_CASE_ID.isna()]
+
+
+# Columns of the entitlement cube, see build_entitlement_cube.
+CUBE_COLUMNS = [
+    "CASE_ID",
+    "PARENT_CASE_ID",
+    "GEOID",
+    "year",
+    "FILE_DATE",
+    "prefix",
+    "n_parcels",
+    "suffix",
+    "own_suffix",
+]
+
+
+def build_entitlement_cube(pcts):
+    """
+    Build the entitlement cube of a master PCTS extract. The cube has a row
+    for each entitlement (suffix) of each case, along with the tract, year,
+    filing date, prefix, and number of parcels of the case. Cases without
+    a suffix get a single row with a null suffix. entitlement_counts turns
+    the cube into counts of entitlements per tract and year.
+
+    The cube is kept at the grain of cases, rather than summed to tracts,
+    so that the big-case threshold and the rolling up of child cases into
+    their parents can still be applied at query time. Since each case is
+    independent of the others, the cube of new or changed cases can be
+    merged into an existing one with update_entitlement_cube.
+
+    Parameters
+    ==========
+
+    pcts: pandas.DataFrame
+        A master PCTS extract, as loaded with load_pcts.
+    """
+    pcts = pcts.drop_duplicates().reset_index(drop=True)
+    prefixes, suffixes = _parse_case_numbers(pcts.CASE_NUMBER)
+    parsed = prefixes.notna()
+    pcts = pcts[parsed].assign(prefix=prefixes[parsed])
+    suffixes = suffixes[parsed]
+
+    cases = (
+        pcts.sort_values(["CASE_ID", "AIN"])
+        .groupby("CASE_ID")
+        .agg(
+            PARENT_CASE_ID=("PARENT_CASE_ID", "first"),
+            GEOID=("GEOID", "first"),
+            year=("CASE_YEAR_NUMBER", "first"),
+            FILE_DATE=("FILE_DATE", "first"),
+            prefix=("prefix", "first"),
+            n_parcels=("AIN", "size"),
+        )
+        .reset_index()
+    )
+
+    # The suffixes of each case. Some suffixes appear in the prefix position
+    # due to (presumably) data entry errors. Like subset_pcts, count them as
+    # entitlements, but not when matching cases against a list of suffixes.
+    own = suffixes.stack().reset_index(level=1, drop=True)
+    bad_prefix = cases.prefix.isin(VALID_PCTS_SUFFIX)
+    entitlements = (
+        pandas.concat(
+            [
+                pandas.DataFrame(
+                    {
+                        "CASE_ID": pcts.CASE_ID.loc[own.index].values,
+                        "suffix": own.values,
+                        "own_suffix": True,
+                    }
+                ),
+                pandas.DataFrame(
+                    {
+                        "CASE_ID": cases.CASE_ID[bad_prefix].values,
+                        "suffix": cases.prefix[bad_prefix].values,
+                        "own_suffix": False,
+                    }
+                ),
+            ],
+            ignore_index=True,
+        )
+        .sort_values("own_suffix", ascending=False, kind="mergesort")
+        .drop_duplicates(subset=["CASE_ID", "suffix"])
+    )
+
+    cube = pandas.merge(cases, entitlements, on="CASE_ID", how="left")
+    return _cube_dtypes(cube.assign(own_suffix=cube.own_suffix.fillna(False)))
+
+
+def _cube_dtypes(cube):
+    return (
+        cube[CUBE_COLUMNS]
+        .astype(
+            {
+                "CASE_ID": "Int64",
+                "PARENT_CASE_ID": "Int64",
+                "year": "Int64",
+                "n_parcels": "int64",
+                "own_suffix": "bool",
+            }
+        )
+        .sort_values(["FILE_DATE", "CASE_ID"], kind="mergesort")
+        .reset_index(drop=True)
+    )
+
+
+def update_entitlement_cube(cube, pcts, case_ids):
+    """
+    Merge the rebuilt cases of an incremental PCTS refresh into
+    an entitlement cube.
+
+    Parameters
+    ==========
+
+    cube: pandas.DataFrame
+        The entitlement cube, as returned by build_entitlement_cube.
+
+    pcts: pandas.DataFrame
+        The rebuilt master PCTS data for the changed cases.
+
+    case_ids: list of ints
+        All of the changed cases, including deleted ones.
+    """
+    return _cube_dtypes(
+        pandas.concat(
+            [cube[~cube.CASE_ID.isin(case_ids)], build_entitlement_cube(pcts)],
+            ignore_index=True,
+        )
+    )
+
+
+def entitlement_counts(
+    cube,
+    start_date=None,
+    end_date=None,
+    prefix_list=None,
+    suffix_list=None,
+    big_case_threshold=20,
+    aggregate_years=False,
+    return_big_cases=False,
+):
+    """
+    Count the cases with each entitlement per census tract and year,
+    from an entitlement cube. This gives the same counts as subsetting PCTS
+    with subset_pcts, rolling child cases into their parents with
+    drop_child_cases, and counting the parent cases with each suffix.
+
+    Parameters
+    ==========
+
+    cube: pandas.DataFrame
+        The entitlement cube, as returned by build_entitlement_cube.
+
+    start_date: time-like
+        Optional start date cutoff. Defaults to 2010-01-01, like subset_pcts.
+
+    end_date: time-like
+        Optional end-date cutoff. Defaults to the present day.
+
+    prefix_list: iterable of strings
+        A list of prefixes to use. If not given, all prefixes are used.
+
+    suffix_list: iterable of strings
+        A list of suffixes to count. If not given, all suffixes are counted.
+
+    big_case_threshold: int
+        Cases which touch more than this many parcels are left out.
+        If None, all cases are counted.
+
+    aggregate_years: bool
+        Whether to count the cases of all years together, rather than
+        per tract and year.
+
+    return_big_cases: bool
+        Whether to also return the IDs of the cases which were left out
+        for touching too many parcels.
+    """
+    start_date, end_date = _date_range(start_date, end_date)
+    rows = cube[(cube.FILE_DATE >= start_date) & (cube.FILE_DATE <= end_date)]
+    if prefix_list is not None:
+        rows = rows[rows.prefix.isin(prefix_list)]
+    if suffix_list is not None:
+        # Keep the cases with one of the suffixes, and only count those.
+        matched = rows.own_suffix & rows.suffix.isin(suffix_list)
+        rows = rows[rows.CASE_ID.isin(rows.CASE_ID[matched])]
+        rows = rows[rows.suffix.isin(suffix_list)]
+
+    cases = rows[rows.PARENT_CASE_ID.isna()].drop_duplicates(subset="CASE_ID")
+    big_cases = cases.CASE_ID.iloc[:0]
+    if big_case_threshold is not None:
+        big = cases.n_parcels > big_case_threshold
+        big_cases = cases.CASE_ID[big]
+        cases = cases[~big]
+    keys = ["GEOID"] if aggregate_years else ["GEOID", "year"]
+    cases = cases.dropna(subset=keys)
+
+    # Roll the entitlements of child cases into their parents.
+    entitlements = (
+        pandas.DataFrame(
+            {
+                "CASE_ID": rows.PARENT_CASE_ID.fillna(rows.CASE_ID),
+                "suffix": rows.suffix,
+            }
+        )
+        .dropna()
+        .drop_duplicates()
+        .merge(cases[["CASE_ID"] + keys], on="CASE_ID")
+    )
+    columns = sorted(VALID_PCTS_SUFFIX) if suffix_list is None else list(suffix_list)
+    counts = (
+        entitlements.groupby(keys + ["suffix"])
+        .size()
+        .unstack("suffix")
+        .reindex(
+            index=cases.groupby(keys).size().index, columns=columns, fill_value=0
+        )
+        .fillna(0)
+        .astype("int64")
+    )
+    counts.columns.name = None
+    if not aggregate_years:
+        counts = counts.reset_index(level="year")
+        counts = counts.assign(year=counts.year.astype("int64"))
+
+    if return_big_cases:
+        return counts, big_cases.to_numpy()
+    return counts
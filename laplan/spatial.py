@@ -0,0 +1,445 @@
+"""
+Utilities for spatially joining parcels and other points to polygons.
+"""
+import concurrent.futures
+import os
+
+import geopandas
+import numpy
+import pyproj
+import shapely
+import shapely.geometry
+
+from .cache import CACHE_DIR
+
+# Points are sent to the polygon index in chunks of this size.
+CHUNK = 250_000
+# The CRS that parcel centroids and polygon layers are joined in,
+# NAD83 / California zone 5 (ftUS).
+CANONICAL_CRS = "EPSG:2229"
+
+# -------------------------------------------------------------------------------------#
+# Spatial ordering
+# -------------------------------------------------------------------------------------#
+
+
+def _spread_bits(v):
+    """
+    Spread the lower 32 bits of each value so that there is a zero bit
+    between each of them, for interleaving.
+    """
+    v = v & numpy.uint64(0x00000000FFFFFFFF)
+    v = (v | (v << numpy.uint64(16))) & numpy.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << numpy.uint64(8))) & numpy.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << numpy.uint64(4))) & numpy.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << numpy.uint64(2))) & numpy.uint64(0x3333333333333333)
+    v = (v | (v << numpy.uint64(1))) & numpy.uint64(0x5555555555555555)
+    return v
+
+
+def morton_order(x, y, bits=16):
+    """
+    Get the order of points along a Morton (Z-order) curve,
+    which is the same ordering as a geohash. Points that are near
+    each other in the order are near each other in space.
+
+    Parameters
+    ==================
+    x: array of x coordinates.
+    y: array of y coordinates.
+    bits: int
+        The number of bits to quantize each coordinate to (up to 32).
+
+    Returns
+    =======
+    An integer array that sorts the points.
+    """
+    x = numpy.asarray(x, dtype="float64")
+    y = numpy.asarray(y, dtype="float64")
+    scale = float(2 ** bits - 1)
+
+    def quantize(v):
+        lo, hi = numpy.nanmin(v), numpy.nanmax(v)
+        span = (hi - lo) or 1.0
+        q = numpy.nan_to_num((v - lo) / span * scale)
+        return q.astype("uint64")
+
+    code = _spread_bits(quantize(x)) | (_spread_bits(quantize(y)) << numpy.uint64(1))
+    return numpy.argsort(code, kind="mergesort")
+
+
+# -------------------------------------------------------------------------------------#
+# Point in polygon
+# -------------------------------------------------------------------------------------#
+
+# The polygons being queried in a worker process, with their index built.
+_POLYGONS = None
+
+
+def _init_worker(polygons):
+    global _POLYGONS
+    _POLYGONS = polygons
+    # Build the index once per process, rather than once per chunk.
+    _POLYGONS.sindex
+
+
+def _squares(x, y, half_width):
+    """
+    Squares centered on each point.
+    """
+    if hasattr(shapely, "box"):
+        # shapely>=2 builds them all at once
+        return shapely.box(
+            x - half_width, y - half_width, x + half_width, y + half_width
+        )
+    return geopandas.points_from_xy(x, y).buffer(half_width, cap_style=3)
+
+
+def _query_chunk(point_idx, x, y, predicate, tolerance=None, polygons=None):
+    """
+    Find the polygons containing a chunk of points.
+    Returns matching arrays of point indices and polygon indices.
+    """
+    polygons = _POLYGONS if polygons is None else polygons
+    if tolerance:
+        points = _squares(x, y, tolerance)
+    else:
+        points = geopandas.points_from_xy(x, y)
+    left, right = polygons.sindex.query_bulk(points, predicate=predicate)
+    return point_idx[left], right
+
+
+def points_in_polygons(
+    x, y, polygons, predicate="within", tolerance=None, chunksize=CHUNK, workers=None
+):
+    """
+    Find the polygons that contain each point.
+
+    The polygon index is built once. The points are sorted along a
+    Morton curve and processed in spatially compact chunks,
+    in parallel across processes.
+
+    Parameters
+    ==================
+    x: array of x coordinates.
+    y: array of y coordinates, in the same CRS as the polygons.
+    polygons: geopandas.GeoSeries or GeoDataFrame
+    predicate: str
+        The spatial predicate between the point and the polygon.
+        "within" leaves out points on the polygon boundary,
+        "intersects" includes them.
+    tolerance: float
+        If given, each point is tested as a square reaching this far
+        from the point, in the units of the CRS. With "within", a point
+        only matches polygons it is at least this far inside of.
+    chunksize: int
+        The number of points in each chunk.
+    workers: int
+        The number of processes to use. Defaults to the number of CPUs.
+        With one worker, or a single chunk, the points are processed
+        in this process.
+
+    Returns
+    =======
+    Two integer arrays of the same length, the position of each point and
+    the position of the polygon that contains it. They are sorted by
+    point, then by polygon. Points outside of every polygon do not appear,
+    and points in more than one polygon appear more than once.
+    """
+    if isinstance(polygons, geopandas.GeoDataFrame):
+        polygons = polygons.geometry
+    x = numpy.asarray(x, dtype="float64")
+    y = numpy.asarray(y, dtype="float64")
+
+    valid = numpy.flatnonzero(numpy.isfinite(x) & numpy.isfinite(y))
+    order = valid[morton_order(x[valid], y[valid])]
+    chunks = [order[i : i + chunksize] for i in range(0, len(order), chunksize)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) <= 1:
+        results = [
+            _query_chunk(c, x[c], y[c], predicate, tolerance, polygons) for c in chunks
+        ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(polygons,)
+        ) as executor:
+            futures = [
+                executor.submit(_query_chunk, c, x[c], y[c], predicate, tolerance)
+                for c in chunks
+            ]
+            results = [f.result() for f in futures]
+
+    if not results:
+        return numpy.array([], dtype="int64"), numpy.array([], dtype="int64")
+    point_idx = numpy.concatenate([r[0] for r in results]).astype("int64")
+    polygon_idx = numpy.concatenate([r[1] for r in results]).astype("int64")
+    sort = numpy.lexsort((polygon_idx, point_idx))
+    return point_idx[sort], polygon_idx[sort]
+
+
+def first_polygon(point_idx, polygon_idx, n):
+    """
+    Reduce the matches from points_in_polygons to a single polygon per point.
+
+    Parameters
+    ==================
+    point_idx, polygon_idx: arrays returned from points_in_polygons.
+    n: int
+        The total number of points.
+
+    Returns
+    =======
+    An integer array of length n with the position of the first polygon
+    containing each point, or -1 if there is none.
+    """
+    out = numpy.full(n, -1, dtype="int64")
+    first = numpy.ones(len(point_idx), dtype=bool)
+    first[1:] = point_idx[1:] != point_idx[:-1]
+    out[point_idx[first]] = polygon_idx[first]
+    return out
+
+
+def join_index(point_idx, polygon_idx, n, how="inner"):
+    """
+    Turn the matches from points_in_polygons into the row positions of a join,
+    like geopandas.sjoin.
+
+    Parameters
+    ==================
+    point_idx, polygon_idx: arrays returned from points_in_polygons.
+    n: int
+        The total number of points.
+    how: str
+        "inner" keeps only the matched points. "left" also keeps the points
+        outside of every polygon, with a polygon position of -1.
+
+    Returns
+    =======
+    Two integer arrays, the point row and the polygon row of each joined row,
+    sorted by point.
+    """
+    if how == "inner":
+        return point_idx, polygon_idx
+    if how != "left":
+        raise ValueError(f"how must be 'inner' or 'left', not {how!r}")
+    unmatched = numpy.setdiff1d(numpy.arange(n), point_idx, assume_unique=False)
+    rows = numpy.concatenate([point_idx, unmatched])
+    polys = numpy.concatenate([polygon_idx, numpy.full(len(unmatched), -1)])
+    sort = numpy.argsort(rows, kind="mergesort")
+    return rows[sort], polys[sort].astype("int64")
+
+
+# -------------------------------------------------------------------------------------#
+# Projected points
+# -------------------------------------------------------------------------------------#
+
+
+def project_points(x, y, from_crs="EPSG:4326", to_crs=CANONICAL_CRS):
+    """
+    Project point coordinates, e.g. parcel centroids, into the canonical CRS.
+
+    Parameters
+    ==================
+    x: array of x coordinates (longitude).
+    y: array of y coordinates (latitude).
+    from_crs: the CRS of the coordinates.
+    to_crs: the CRS to project to. Defaults to CANONICAL_CRS.
+
+    Returns
+    =======
+    An (n, 2) float64 array of the projected x and y coordinates.
+    Missing coordinates stay NaN.
+    """
+    transformer = pyproj.Transformer.from_crs(from_crs, to_crs, always_xy=True)
+    px, py = transformer.transform(
+        numpy.asarray(x, dtype="float64"), numpy.asarray(y, dtype="float64")
+    )
+    coords = numpy.column_stack([px, py])
+    coords[~numpy.isfinite(coords)] = numpy.nan
+    return coords
+
+
+def save_points(f, coords):
+    """
+    Save an (n, 2) coordinate array from project_points, so that it
+    only needs to be projected once. f is a path or an open binary file.
+    """
+    numpy.save(f, numpy.ascontiguousarray(coords, dtype="float64"))
+
+
+def load_points(f, mmap_mode=None):
+    """
+    Load a coordinate array saved with save_points.
+    Pass mmap_mode="r" to memory-map a local file instead of reading it.
+    """
+    return numpy.load(f, mmap_mode=mmap_mode)
+
+
+# -------------------------------------------------------------------------------------#
+# Polygon layers
+# -------------------------------------------------------------------------------------#
+
+# The registered polygon layers, with their spatial indexes built.
+_LAYERS = {}
+
+
+def register_layer(name, polygons, crs=CANONICAL_CRS):
+    """
+    Register a polygon layer for point lookups. The layer is projected
+    and its spatial index is built once, and reused by every lookup.
+    Registering a layer again with the same name replaces it.
+
+    Parameters
+    ==================
+    name: str
+    polygons: geopandas.GeoDataFrame or GeoSeries
+    crs: the CRS to project the layer to. Defaults to CANONICAL_CRS.
+        Pass None to keep the CRS of the layer.
+
+    Returns
+    =======
+    The registered layer, with a fresh RangeIndex. The polygon positions
+    returned by lookup are rows of this layer.
+    """
+    layer = polygons.reset_index(drop=True)
+    if crs is not None and layer.crs is not None:
+        layer = layer.to_crs(crs)
+    layer.sindex
+    _LAYERS[name] = layer
+    return layer
+
+
+def get_layer(name):
+    """
+    Get a registered polygon layer.
+    """
+    try:
+        return _LAYERS[name]
+    except KeyError:
+        raise KeyError(f"No polygon layer registered as {name!r}") from None
+
+
+def lookup(
+    name, coords, predicate="within", tolerance=None, chunksize=CHUNK, workers=None
+):
+    """
+    Find the polygons of a registered layer that contain each point.
+
+    Parameters
+    ==================
+    name: str
+        The name of a registered layer.
+    coords: (n, 2) array
+        Point coordinates in the CRS of the layer, e.g. from project_points.
+    predicate, tolerance, chunksize, workers: passed to points_in_polygons.
+
+    Returns
+    =======
+    Two integer arrays, the parcel (point) positions and the polygon positions,
+    as returned by points_in_polygons.
+    """
+    coords = numpy.asarray(coords)
+    return points_in_polygons(
+        coords[:, 0],
+        coords[:, 1],
+        get_layer(name),
+        predicate=predicate,
+        tolerance=tolerance,
+        chunksize=chunksize,
+        workers=workers,
+    )
+
+
+# -------------------------------------------------------------------------------------#
+# Cached polygon layers
+# -------------------------------------------------------------------------------------#
+
+
+def _polygonal(geom):
+    """
+    Keep only the polygon parts of a geometry, dropping the lines and points
+    that an intersection can leave along shared edges.
+    """
+    if geom.geom_type in ("Polygon", "MultiPolygon"):
+        return geom
+    if geom.geom_type == "GeometryCollection":
+        parts = [g for g in geom.geoms if g.geom_type in ("Polygon", "MultiPolygon")]
+        polygons = [p for g in parts for p in getattr(g, "geoms", [g])]
+        if polygons:
+            return shapely.geometry.MultiPolygon(polygons)
+    return None
+
+
+def tile_polygons(polygons, tile_size):
+    """
+    Cut polygons along a square grid, so that each piece is small.
+    A spatial index over the pieces has tighter bounding boxes,
+    so a point lookup has fewer, simpler candidates to test.
+
+    Parameters
+    ==================
+    polygons: geopandas.GeoDataFrame
+        The polygons to cut, in a projected CRS.
+    tile_size: float
+        The width of the grid tiles, in the units of the CRS.
+
+    Returns
+    =======
+    geopandas.GeoDataFrame with a row for each piece,
+    and the other columns of the polygon it was cut from.
+    """
+    polygons = polygons.reset_index(drop=True)
+    xmin, ymin, xmax, ymax = polygons.total_bounds
+    xs = numpy.arange(numpy.floor(xmin / tile_size) * tile_size, xmax, tile_size)
+    ys = numpy.arange(numpy.floor(ymin / tile_size) * tile_size, ymax, tile_size)
+    tiles = geopandas.GeoSeries(
+        [
+            shapely.geometry.box(x, y, x + tile_size, y + tile_size)
+            for x in xs
+            for y in ys
+        ],
+        crs=polygons.crs,
+    )
+
+    polygon_idx, tile_idx = tiles.sindex.query_bulk(
+        polygons.geometry, predicate="intersects"
+    )
+    pieces = polygons.iloc[polygon_idx].reset_index(drop=True)
+    cut = pieces.geometry.intersection(tiles.iloc[tile_idx].reset_index(drop=True))
+    pieces = pieces.set_geometry(
+        geopandas.GeoSeries([_polygonal(g) for g in cut], crs=polygons.crs)
+    )
+    keep = pieces.geometry.notna() & ~pieces.geometry.is_empty
+    return pieces[keep].reset_index(drop=True)
+
+
+def cached_polygons(name, loader, cache_dir=CACHE_DIR, refresh=False):
+    """
+    Load a polygon layer, caching it as a local geoparquet file,
+    so that it does not need to be downloaded and prepared on every run.
+
+    Parameters
+    ==================
+    name: str
+        The name of the layer in the cache.
+    loader: callable
+        A function with no arguments that returns the layer as a GeoDataFrame.
+        It is only called when the layer is not already cached.
+    cache_dir: str
+        The directory to keep the cache in.
+    refresh: bool
+        Whether to call the loader even if the layer is cached.
+
+    Returns
+    =======
+    geopandas.GeoDataFrame
+    """
+    path = os.path.join(cache_dir, f"{name}.parquet")
+    if os.path.exists(path) and not refresh:
+        return geopandas.read_parquet(path)
+
+    gdf = loader().reset_index(drop=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    gdf.to_parquet(path)
+    return gdf
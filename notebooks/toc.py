@@ -3,13 +3,18 @@ Utility functions for analyzing Transit Oriented Communities (TOC)
 entitlements, following Measure JJJ.
 """
 import datetime
+import hashlib
 import os
+import re
 import typing
 
 import fsspec
 import geopandas
+import laplan
+import numpy
 import pandas
 import partridge
+import scipy.spatial
 import shapely
 
 
@@ -163,6 +168,23 @@ def toc_bus_lines(
         The cutoff headway, above which a line won't be considered TOC.
     """
     df = bus_peak_frequencies(gtfs_path, **kwargs)
+    return toc_lines_from_frequencies(df, cutoff)
+
+
+def toc_lines_from_frequencies(
+    df: geopandas.GeoDataFrame, cutoff: float = 15.0
+) -> geopandas.GeoDataFrame:
+    """
+    Get the lines qualifying for TOC from the peak frequencies
+    computed by bus_peak_frequencies.
+
+    Parameters
+    ==========
+    df: geopandas.GeoDataFrame
+        The peak frequencies from bus_peak_frequencies.
+    cutoff: float
+        The cutoff headway, above which a line won't be considered TOC.
+    """
     # Find all the high frequency routes with frequency under a given cutoff.
     # TOC is 15 minutes, here we relax it a bit.
     high_frequency_routes = df[
@@ -190,6 +212,22 @@ def toc_bus_lines(
     return gdf
 
 
+def route_headways(df: geopandas.GeoDataFrame) -> pandas.Series:
+    """
+    The smallest cutoff at which each route qualifies for TOC in
+    toc_lines_from_frequencies, i.e., the worst AM or PM peak headway
+    over both of its directions. Routes that never qualify get infinity.
+
+    Parameters
+    ==========
+    df: geopandas.GeoDataFrame
+        The peak frequencies from bus_peak_frequencies.
+    """
+    worst = df[["am_peak_frequency", "pm_peak_frequency"]].max(axis=1, skipna=False)
+    worst = worst.fillna(numpy.inf).groupby(level="route_id")
+    return worst.max().where(worst.size() == 2, numpy.inf)
+
+
 def bus_intersections(lines: geopandas.GeoDataFrame) -> geopandas.GeoDataFrame:
     """
     Calculate intersecting bus lines.
@@ -407,14 +445,14 @@ def compute_toc_tiers_from_metrolink_stations(
     ].rename(columns={"ext_id": "station_id", "Name": "name"})
 
 
-def compute_toc_tiers_from_metro_rail(
-    stations: geopandas.GeoDataFrame,
-    toc_buses: geopandas.GeoDataFrame,
-    clip: geopandas.GeoDataFrame,
-    cushion: float = DEFAULT_CUSHION,
+def metro_rail_station_intersections(
+    stations: geopandas.GeoDataFrame, toc_buses: geopandas.GeoDataFrame,
 ) -> geopandas.GeoDataFrame:
     """
-    Compute TOC tiers for metro rail stations.
+    Find the routes intersecting each Metro Rail station, whether other rail
+    lines or rapid TOC bus lines. A station may appear once per intersecting
+    route, and stations without one have a null "intersecting_route".
+    The result is projected into feet.
 
     Parameters
     ==========
@@ -423,8 +461,6 @@ def compute_toc_tiers_from_metro_rail(
         The stations list for Metro Rail.
     toc_buses: geopandas.GeoDataFrame
         The list of bus lines that satisfies TOC.
-    clip: geopandas.GeoDataFrame
-        Clip the resulting geodataframe by this (probably the City of LA).
     """
     # Project into feet for the purpose of drawing buffers.
     stations_feet = stations.to_crs(f"EPSG:{SOCAL_FEET}")
@@ -516,6 +552,30 @@ def compute_toc_tiers_from_metro_rail(
         ]
     ]
 
+    return stations
+
+
+def compute_toc_tiers_from_metro_rail(
+    stations: geopandas.GeoDataFrame,
+    toc_buses: geopandas.GeoDataFrame,
+    clip: geopandas.GeoDataFrame,
+    cushion: float = DEFAULT_CUSHION,
+) -> geopandas.GeoDataFrame:
+    """
+    Compute TOC tiers for metro rail stations.
+
+    Parameters
+    ==========
+
+    stations: geopandas.GeoDataFrame
+        The stations list for Metro Rail.
+    toc_buses: geopandas.GeoDataFrame
+        The list of bus lines that satisfies TOC.
+    clip: geopandas.GeoDataFrame
+        Clip the resulting geodataframe by this (probably the City of LA).
+    """
+    stations = metro_rail_station_intersections(stations, toc_buses)
+
     # Determine tier 3 and tier 4 TOC zones.
     def assign_tiers_to_rail_stations(row):
         tier_2 = shapely.geometry.GeometryCollection()
@@ -549,6 +609,523 @@ def compute_toc_tiers_from_metro_rail(
     ]
 
 
+# The distances, in feet before the cushion, within which each class of TOC
+# site confers each tier. These follow the buffers drawn in the
+# compute_toc_tiers_* functions above, and should be kept in sync with them.
+TOC_TIER_DISTANCES = {
+    "bus_rapid_rapid": {3: 1500.0, 2: 2640.0},
+    "bus_rapid": {3: 750.0, 2: 1500.0, 1: 2640.0},
+    "bus": {2: 750.0, 1: 2640.0},
+    "metrolink": {3: 750.0, 2: 1500.0, 1: 2640.0},
+    "metro_intersection": {4: 750.0, 3: 2640.0},
+    "metro": {3: 2640.0},
+}
+MAX_TIER_DISTANCE = max(max(t.values()) for t in TOC_TIER_DISTANCES.values())
+
+
+def _point_sites(gdf, site_class, mode):
+    """
+    Explode a projected GeoDataFrame of point-like geometries into one row per
+    point, keeping the index of the source row in a "site" column.
+    """
+    rows = []
+    points = []
+    for i, geom in enumerate(gdf.geometry):
+        parts = getattr(geom, "geoms", [geom]) if geom is not None else []
+        for part in parts:
+            if part.geom_type == "Point" and not part.is_empty:
+                rows.append(i)
+                points.append(part)
+    rows = numpy.asarray(rows, dtype="int64")
+    return geopandas.GeoDataFrame(
+        {
+            "site": gdf.index.values[rows],
+            "site_class": numpy.asarray(site_class)[rows],
+            "mode": mode,
+        },
+        geometry=points,
+        crs=f"EPSG:{SOCAL_FEET}",
+    )
+
+
+def bus_intersection_sites(
+    intersections: geopandas.GeoDataFrame,
+) -> geopandas.GeoDataFrame:
+    """
+    The points of the bus intersections from bus_intersections, projected
+    into feet, classed by how many of the two lines are rapid buses.
+    """
+    intersections = intersections.to_crs(f"EPSG:{SOCAL_FEET}")
+    n_rapid = intersections.apply(
+        lambda x: int(is_rapid_bus(x.agency_a, x.route_name_a))
+        + int(is_rapid_bus(x.agency_b, x.route_name_b)),
+        axis=1,
+    )
+    site_class = numpy.array(["bus", "bus_rapid", "bus_rapid_rapid"])[
+        n_rapid.to_numpy(dtype="int64")
+    ]
+    return _point_sites(intersections, site_class, "bus")
+
+
+def metrolink_sites(stations: geopandas.GeoDataFrame) -> geopandas.GeoDataFrame:
+    """
+    The Metrolink stations, projected into feet.
+    """
+    stations = stations.to_crs(f"EPSG:{SOCAL_FEET}")
+    return _point_sites(stations, ["metrolink"] * len(stations), "metrolink")
+
+
+def metro_rail_sites(
+    stations: geopandas.GeoDataFrame, toc_buses: geopandas.GeoDataFrame,
+) -> geopandas.GeoDataFrame:
+    """
+    The Metro Rail stations, projected into feet, classed by whether
+    another rail line or a rapid TOC bus line intersects them.
+    """
+    stations = metro_rail_station_intersections(stations, toc_buses)
+    intersecting = stations.intersecting_route.notna().groupby(level=0).any()
+    stations = stations[~stations.index.duplicated()]
+    site_class = numpy.where(
+        intersecting.reindex(stations.index).to_numpy(dtype=bool),
+        "metro_intersection",
+        "metro",
+    )
+    return _point_sites(stations, site_class, "metro")
+
+
+class TOCDistances:
+    """
+    KD-trees over the TOC sites of each class, for finding the distance from
+    points, e.g. parcel centroids, to the nearest site of each class. This
+    gives the same tiers as joining with the buffers from the
+    compute_toc_tiers_* functions, without drawing buffers or doing any
+    spatial joins, up to the resolution of the buffer polygons.
+
+    Parameters
+    ==========
+    sites: geopandas.GeoDataFrame
+        Concatenated results from bus_intersection_sites, metrolink_sites,
+        and metro_rail_sites. Clipping the sites is not needed when looking up
+        points within the clip, as the sites it would drop are too far
+        away from them to confer any tier.
+    """
+
+    def __init__(self, sites: geopandas.GeoDataFrame):
+        sites = sites.to_crs(f"EPSG:{SOCAL_FEET}")
+        self.sites = sites
+        self.trees = {}
+        self.site_rows = {}
+        for site_class in TOC_TIER_DISTANCES:
+            rows = numpy.flatnonzero(sites.site_class.to_numpy() == site_class)
+            if len(rows):
+                coords = numpy.column_stack(
+                    [sites.geometry.x.values[rows], sites.geometry.y.values[rows]]
+                )
+                self.trees[site_class] = scipy.spatial.cKDTree(coords)
+                self.site_rows[site_class] = rows
+
+    def nearest(
+        self,
+        coords: numpy.ndarray,
+        max_distance: float = numpy.inf,
+        return_sites: bool = False,
+        workers: int = -1,
+    ):
+        """
+        The distance, in feet, from each point to the nearest site of each class.
+
+        Parameters
+        ==========
+        coords: numpy.ndarray
+            An (n, 2) array of points in EPSG:2229, e.g. from
+            laplan.spatial.project_points or the x and y of a ParcelStore.
+        max_distance: float
+            Sites further away than this are not looked for, which speeds up
+            the query. Their distance is reported as infinite.
+        return_sites: bool
+            Whether to also return the row in self.sites of each nearest site,
+            or -1 where there is none.
+        workers: int
+            The number of threads to query with, or -1 for all of the cores.
+
+        Returns
+        =======
+        A DataFrame with a row per point and a column per site class,
+        and, if return_sites, a DataFrame of the nearest sites of the same shape.
+        """
+        coords = numpy.asarray(coords, dtype="float64")
+        valid = numpy.isfinite(coords).all(axis=1)
+        distances = {}
+        nearest_sites = {}
+        for site_class in TOC_TIER_DISTANCES:
+            d = numpy.full(len(coords), numpy.inf)
+            s = numpy.full(len(coords), -1, dtype="int64")
+            if site_class in self.trees:
+                d[valid], i = self.trees[site_class].query(
+                    coords[valid],
+                    distance_upper_bound=max_distance,
+                    workers=workers,
+                )
+                rows = self.site_rows[site_class]
+                found = i < len(rows)
+                s[numpy.flatnonzero(valid)[found]] = rows[i[found]]
+            distances[site_class] = d
+            nearest_sites[site_class] = s
+        distances = pandas.DataFrame(distances)
+        if return_sites:
+            return distances, pandas.DataFrame(nearest_sites)
+        return distances
+
+    @staticmethod
+    def tiers(
+        distances: pandas.DataFrame, cushion: float = DEFAULT_CUSHION
+    ) -> numpy.ndarray:
+        """
+        The highest TOC tier of each point, or 0 for none, given the distances
+        from TOCDistances.nearest.
+        """
+        return _tier_matrix(distances, [cushion])[:, 0]
+
+    def tier_of(
+        self, coords: numpy.ndarray, cushion: float = DEFAULT_CUSHION
+    ) -> numpy.ndarray:
+        """
+        The highest TOC tier of each point in an (n, 2) array in EPSG:2229,
+        or 0 for none.
+        """
+        return self.tiers(self.nearest(coords, MAX_TIER_DISTANCE * cushion), cushion)
+
+
+def _tier_matrix(distances, cushions):
+    """
+    The highest TOC tier of each point (rows) for each cushion (columns),
+    given the distances from TOCDistances.nearest.
+    """
+    cushions = numpy.asarray(cushions, dtype="float64")
+    tier = numpy.zeros((len(distances), len(cushions)), dtype="int8")
+    for site_class, thresholds in TOC_TIER_DISTANCES.items():
+        if site_class not in distances:
+            continue
+        d = distances[site_class].to_numpy()[:, None]
+        for t, threshold in thresholds.items():
+            numpy.maximum(tier, numpy.where(d <= threshold * cushions, t, 0), out=tier)
+    return tier
+
+
+def toc_sweep_sites(
+    frequencies: geopandas.GeoDataFrame,
+    metrolink_stations: geopandas.GeoDataFrame,
+    metro_stations: geopandas.GeoDataFrame,
+    max_cutoff: float,
+) -> geopandas.GeoDataFrame:
+    """
+    The TOC sites for every headway cutoff up to max_cutoff, for use with
+    toc_tier_sweep. Each site has a "headway" column with the smallest cutoff
+    at which it exists: bus intersections need both lines to qualify,
+    and a Metro Rail station is also a "metro_intersection" site from the
+    cutoff at which a rapid bus line near it qualifies.
+
+    Parameters
+    ==========
+    frequencies: geopandas.GeoDataFrame
+        The peak frequencies from bus_peak_frequencies.
+    metrolink_stations: geopandas.GeoDataFrame
+        The Metrolink stations data frame.
+    metro_stations: geopandas.GeoDataFrame
+        The stations list for Metro Rail.
+    max_cutoff: float
+        The largest cutoff headway to be swept.
+    """
+    headways = route_headways(frequencies)
+    lines = toc_lines_from_frequencies(frequencies, max_cutoff)
+
+    intersections = bus_intersections(lines)
+    bus = bus_intersection_sites(intersections)
+    bus["headway"] = numpy.maximum(
+        headways.reindex(intersections.route_a.loc[bus.site]).to_numpy(),
+        headways.reindex(intersections.route_b.loc[bus.site]).to_numpy(),
+    )
+
+    metrolink = metrolink_sites(metrolink_stations).assign(headway=0.0)
+
+    # Rail lines always intersect a station, rapid bus lines from their headway.
+    stations = metro_rail_station_intersections(metro_stations, lines)
+    by_bus = stations.intersecting_route_agency.notna()
+    intersection_headway = pandas.Series(
+        numpy.where(
+            by_bus,
+            headways.reindex(stations.intersecting_route.where(by_bus)).to_numpy(),
+            numpy.where(stations.intersecting_route.notna(), 0.0, numpy.inf),
+        ),
+        index=stations.index,
+    ).groupby(level=0).min()
+    stations = stations[~stations.index.duplicated()]
+    metro = _point_sites(stations, ["metro"] * len(stations), "metro").assign(
+        headway=0.0
+    )
+    metro_intersection = _point_sites(
+        stations, ["metro_intersection"] * len(stations), "metro"
+    ).assign(headway=intersection_headway.reindex(stations.index).to_numpy())
+
+    sites = pandas.concat(
+        [bus, metrolink, metro, metro_intersection], ignore_index=True, sort=False
+    )
+    return sites[sites.headway <= max_cutoff].reset_index(drop=True)
+
+
+def toc_tier_sweep(
+    sites: geopandas.GeoDataFrame,
+    coords: numpy.ndarray,
+    cushions: typing.Sequence[float],
+    cutoffs: typing.Sequence[float],
+    entitlements: typing.Optional[numpy.ndarray] = None,
+    workers: int = -1,
+) -> pandas.DataFrame:
+    """
+    Count parcels and entitlements by TOC tier for a grid of cushions and
+    cutoff headways. The distances to the sites are found once per cutoff,
+    using all of the cores, and the tiers for every cushion are
+    then assigned from them at once.
+
+    Parameters
+    ==========
+    sites: geopandas.GeoDataFrame
+        The sites from toc_sweep_sites.
+    coords: numpy.ndarray
+        An (n, 2) array of parcel centroids in EPSG:2229.
+    cushions: list of floats
+        The factors by which to increase the tier distances.
+    cutoffs: list of floats
+        The cutoff headways, above which a line won't be considered TOC.
+    entitlements: numpy.ndarray
+        The number of entitlements of each parcel, e.g. counted from
+        laplan.pcts.ParcelCaseIndex.cases_for_parcels. Defaults to zeros.
+    workers: int
+        The number of threads to query with, or -1 for all of the cores.
+
+    Returns
+    =======
+    A DataFrame with the columns cushion, cutoff, tier (0 for none),
+    parcels, and entitlements, with a row per setting and tier.
+    """
+    cushions = numpy.asarray(cushions, dtype="float64")
+    if entitlements is None:
+        entitlements = numpy.zeros(len(coords))
+    entitlements = numpy.asarray(entitlements, dtype="float64")
+    max_distance = MAX_TIER_DISTANCE * cushions.max()
+
+    results = []
+    for cutoff in cutoffs:
+        distances = TOCDistances(sites[sites.headway <= cutoff]).nearest(
+            coords, max_distance, workers=workers
+        )
+        tiers = _tier_matrix(distances, cushions)
+        for j, cushion in enumerate(cushions):
+            results.append(
+                pandas.DataFrame(
+                    {
+                        "cushion": cushion,
+                        "cutoff": cutoff,
+                        "tier": numpy.arange(5),
+                        "parcels": numpy.bincount(tiers[:, j], minlength=5),
+                        "entitlements": numpy.bincount(
+                            tiers[:, j], weights=entitlements, minlength=5
+                        ),
+                    }
+                )
+            )
+    return pandas.concat(results, ignore_index=True)
+
+
+def toc_tier_coverage(
+    toc_tiers: geopandas.GeoDataFrame, tile_size: float = 2640.0,
+) -> typing.Tuple[geopandas.GeoDataFrame, pandas.DataFrame]:
+    """
+    Overlay the TOC tiers into a coverage of the highest tier, in which the
+    polygons of the tier levels don't overlap. A point then falls in exactly
+    one polygon, with its effective tier, rather than in every buffer around it.
+    The polygons are cut into square tiles, so that a spatial index over them
+    has tight bounding boxes.
+
+    Parameters
+    ==========
+    toc_tiers: geopandas.GeoDataFrame
+        The TOC tiers for bus, Metrolink, and Metro Rail lines.
+        Concatenated results from compute_toc_tiers_from_bus_intersections,
+        compute_toc_tiers_from_metrolink_stations, and
+        compute_toc_tiers_from_metro_rail.
+    tile_size: float
+        The width of the tiles, in feet.
+
+    Returns
+    =======
+    The coverage, a GeoDataFrame in EPSG:2229 with "tier" and "polygon"
+    columns, with a row per tile of each polygon of each tier level.
+    The contributors, a DataFrame with a row per polygon and the row of
+    toc_tiers (in a "site" column, by position) whose buffer for that tier
+    overlaps it, along with its "mode".
+    """
+    toc_tiers = toc_tiers.reset_index(drop=True)
+    covered = shapely.geometry.GeometryCollection()
+    levels = []
+    contributors = []
+    n_polygons = 0
+    for tier in (4, 3, 2, 1):
+        buffers = geopandas.GeoSeries(
+            toc_tiers[f"tier_{tier}"], crs=f"EPSG:{WGS84}"
+        ).to_crs(f"EPSG:{SOCAL_FEET}")
+        buffers = buffers[buffers.notna() & ~buffers.is_empty]
+        if not len(buffers):
+            continue
+
+        # The part of this tier that is not in a higher one.
+        union = buffers.unary_union
+        level = union.difference(covered)
+        covered = covered.union(union)
+        polygons = geopandas.GeoSeries(
+            [
+                p
+                for g in getattr(level, "geoms", [level])
+                for p in getattr(g, "geoms", [g])
+                if p.geom_type == "Polygon" and not p.is_empty
+            ],
+            crs=f"EPSG:{SOCAL_FEET}",
+        )
+        if not len(polygons):
+            continue
+        polygon_ids = numpy.arange(n_polygons, n_polygons + len(polygons))
+        n_polygons += len(polygons)
+        levels.append(
+            geopandas.GeoDataFrame(
+                {"tier": tier, "polygon": polygon_ids},
+                geometry=polygons.values,
+                crs=f"EPSG:{SOCAL_FEET}",
+            )
+        )
+
+        # The sites whose buffers overlap each polygon, not just touch it.
+        buffer_idx, polygon_idx = polygons.sindex.query_bulk(
+            buffers, predicate="intersects"
+        )
+        touching = buffers.iloc[buffer_idx].reset_index(drop=True).touches(
+            polygons.iloc[polygon_idx].reset_index(drop=True)
+        )
+        sites = buffers.index.values[buffer_idx[~touching.values]]
+        contributors.append(
+            pandas.DataFrame(
+                {
+                    "polygon": polygon_ids[polygon_idx[~touching.values]],
+                    "tier": tier,
+                    "site": sites,
+                    "mode": toc_tiers["mode"].values[sites],
+                }
+            )
+        )
+
+    if not levels:
+        empty = geopandas.GeoDataFrame(
+            {"tier": [], "polygon": []}, geometry=[], crs=f"EPSG:{SOCAL_FEET}"
+        )
+        return empty, pandas.DataFrame(columns=["polygon", "tier", "site", "mode"])
+    coverage = laplan.spatial.tile_polygons(
+        pandas.concat(levels, ignore_index=True), tile_size
+    )
+    contributors = (
+        pandas.concat(contributors, ignore_index=True)
+        .sort_values(["polygon", "site"])
+        .reset_index(drop=True)
+    )
+    return coverage, contributors
+
+
+def cached_toc_tier_coverage(
+    toc_tiers: geopandas.GeoDataFrame,
+    name: str = "toc_tier_coverage",
+    tile_size: float = 2640.0,
+    refresh: bool = False,
+) -> typing.Tuple[geopandas.GeoDataFrame, pandas.DataFrame]:
+    """
+    Build the coverage and contributors from toc_tier_coverage, caching them
+    locally as geoparquet and parquet files, and register the coverage
+    with laplan.spatial under the given name, for use with coverage_tiers.
+    The cache is keyed by the contents of toc_tiers and tile_size, so it is
+    rebuilt when they change, and older entries for the name are removed.
+    Pass refresh=True to rebuild it anyway.
+    """
+    cache_name = f"{name}_{_toc_tier_coverage_key(toc_tiers, tile_size)}"
+    contributors_path = os.path.join(
+        laplan.spatial.CACHE_DIR, f"{cache_name}_contributors.parquet"
+    )
+    if not os.path.exists(contributors_path):
+        refresh = True
+
+    def make_coverage():
+        coverage, contributors = toc_tier_coverage(toc_tiers, tile_size)
+        os.makedirs(laplan.spatial.CACHE_DIR, exist_ok=True)
+        contributors.to_parquet(contributors_path, index=False)
+        return coverage
+
+    coverage = laplan.spatial.cached_polygons(
+        cache_name,
+        make_coverage,
+        cache_dir=laplan.spatial.CACHE_DIR,
+        refresh=refresh,
+    )
+    _remove_stale_toc_tier_coverage(name, cache_name)
+    coverage = laplan.spatial.register_layer(name, coverage)
+    return coverage, pandas.read_parquet(contributors_path)
+
+
+def _toc_tier_coverage_key(toc_tiers, tile_size):
+    # The coverage depends on the tier buffers, in order, and the
+    # contributors also on the mode of each site.
+    h = hashlib.md5(repr(float(tile_size)).encode("utf-8"))
+    for tier in (1, 2, 3, 4):
+        h.update(
+            "\n".join(
+                getattr(g, "wkb_hex", "") for g in toc_tiers[f"tier_{tier}"]
+            ).encode("utf-8")
+        )
+        h.update(b";")
+    if "mode" in toc_tiers.columns:
+        h.update("\n".join(map(str, toc_tiers["mode"])).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _remove_stale_toc_tier_coverage(name, cache_name):
+    if not os.path.isdir(laplan.spatial.CACHE_DIR):
+        return
+    entry = re.compile(re.escape(name) + r"_([0-9a-f]{32})(_contributors)?\.parquet")
+    for f in os.listdir(laplan.spatial.CACHE_DIR):
+        match = entry.fullmatch(f)
+        if match and f"{name}_{match.group(1)}" != cache_name:
+            os.remove(os.path.join(laplan.spatial.CACHE_DIR, f))
+
+
+def coverage_tiers(
+    coords: numpy.ndarray, name: str = "toc_tier_coverage"
+) -> numpy.ndarray:
+    """
+    The highest TOC tier of each point, or 0 for none, from a coverage
+    registered by cached_toc_tier_coverage.
+
+    Parameters
+    ==========
+    coords: numpy.ndarray
+        An (n, 2) array of points in EPSG:2229, e.g. parcel centroids.
+    name: str
+        The name the coverage was registered under.
+    """
+    coverage = laplan.spatial.get_layer(name)
+    point_idx, polygon_idx = laplan.spatial.lookup(
+        name, coords, predicate="intersects"
+    )
+    # A point on the edge between two polygons gets the higher tier.
+    tier = numpy.zeros(len(coords), dtype="int8")
+    numpy.maximum.at(tier, point_idx, coverage.tier.values[polygon_idx].astype("int8"))
+    return tier
+
+
 def join_with_toc_tiers(
     gdf: geopandas.GeoDataFrame,
     toc_tiers: geopandas.GeoDataFrame,
@@ -570,8 +1147,6 @@ def join_with_toc_tiers(
     """
     assert tier >= 1 and tier <= 4
     current = gdf
-    # trigger a spatial index build on the current df
-    current.sindex
     colname = f"tier_{tier}"
     for other in [toc_tiers]:
         other = other.set_geometry(colname).drop(columns=["geometry"])
@@ -579,7 +1154,29 @@ def join_with_toc_tiers(
             # This branch is a workaround for a geopandas bug joining on an
             # empty geometry column, cf. GH 1315
             current = pandas.merge(current, other, how="left", left_on="geometry", right_on="tier_4")
+        elif len(current) and (current.geom_type == "Point").all():
+            # Points, e.g. parcel centroids, go through the prepared
+            # point-in-polygon lookup, in the CRS of the tiers.
+            other = laplan.spatial.register_layer(colname, other, crs=None)
+            points = current.geometry
+            if points.crs != other.crs:
+                if points.crs is None or other.crs is None:
+                    raise ValueError(
+                        f"Cannot join points in CRS {points.crs} "
+                        f"with TOC tiers in CRS {other.crs}"
+                    )
+                points = points.to_crs(other.crs)
+            coords = numpy.column_stack([points.x, points.y])
+            point_idx, tier_idx = laplan.spatial.lookup(colname, coords, workers=1)
+            rows, tier_idx = laplan.spatial.join_index(
+                point_idx, tier_idx, len(current), how="left"
+            )
+            matched = other.drop(columns=[colname]).reindex(tier_idx)
+            matched.index = current.index[rows]
+            current = pandas.concat([current.iloc[rows], matched], axis=1)
         else:
+            # trigger a spatial index build on the current df
+            current.sindex
             current = geopandas.sjoin(current, other, how="left", op="within").drop(
                 columns=["index_right"]
             )
@@ -1,15 +1,24 @@
 # Utils for notebooks folder
 import boto3
+import collections
+import concurrent.futures
 import dataclasses
+import fsspec
+import functools
 import geopandas as gpd
+import hashlib
 import intake
+import json
 import numpy as np
 import os
 import pandas as pd
 import re
 import shapely
 import shutil
+import tempfile
+import time
 import typing
+import zipfile
 
 from shapely.geometry import Point
 
@@ -131,9 +140,58 @@ def make_gdf(df, x_col, y_col, initial_CRS="EPSG:4326", projected_CRS="EPSG:2229
     return gdf
 
 
+# Shapefile components (.shp and .dbf) can't be larger than 2GB
+SHAPEFILE_MAX_BYTES = 2 ** 31
+
+
+def estimate_shapefile_bytes(df):
+    """
+    Estimate the size of the largest component (.shp or .dbf)
+    of a GeoDataFrame written as a shapefile.
+    """
+    if hasattr(shapely, "get_num_coordinates"):
+        # shapely>=2 counts the points of all the geometries at once.
+        # Each point takes 16 bytes, and each record a header of about 60.
+        n_points = shapely.get_num_coordinates(np.asarray(df.geometry.array)).sum()
+        shp_bytes = 16 * int(n_points) + 60 * len(df)
+    else:
+        shp_bytes = df.geometry.apply(
+            lambda g: len(g.wkb) if g is not None else 0
+        ).sum()
+    row_bytes = 1
+    for c in df.columns.drop(df.geometry.name):
+        if df[c].dtype == object:
+            # Text fields are as wide as the longest value, up to 254 characters
+            row_bytes += min(df[c].astype(str).str.len().max() or 1, 254)
+        else:
+            row_bytes += 24
+    return max(shp_bytes, row_bytes * len(df))
+
+
+def write_zipped_shapefile(df, path, compresslevel=6):
+    """
+    Write a GeoDataFrame as a shapefile, and stream its
+    components into a zip file. Returns the size of the zip file.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        df.to_file(driver="ESRI Shapefile", filename=os.path.join(tmpdir, f"{name}.shp"))
+        with zipfile.ZipFile(
+            path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel
+        ) as z:
+            for component in sorted(os.listdir(tmpdir)):
+                with open(os.path.join(tmpdir, component), "rb") as src, z.open(
+                    component, "w", force_zip64=True
+                ) as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+    return os.path.getsize(path)
+
+
 # Make zipped shapefile
 # Remember: shapefiles can only take 10-char column names
-def make_zipped_shapefile(df, path):
+def make_zipped_shapefile(
+    df, path, compresslevel=6, max_part_bytes=SHAPEFILE_MAX_BYTES, workers=None
+):
     """
     Make a zipped shapefile and save locally
 
@@ -144,24 +202,42 @@ def make_zipped_shapefile(df, path):
     path: str, local path to where the zipped shapefile is saved.
             Ex: "folder_name/census_tracts" 
                 "folder_name/census_tracts.zip"
+    compresslevel: int, zip compression level, from 0 (fastest) to 9 (smallest).
+    max_part_bytes: int, if the shapefile would be larger than this,
+            it is split into parts, each saved as its own zipped shapefile,
+            "folder_name/census_tracts_1.zip", "folder_name/census_tracts_2.zip", ...
+            Defaults to the 2GB shapefile limit.
+    workers: int, number of parts to write at the same time.
+
+    Returns
+    =======
+
+    The list of paths of the zipped shapefiles.
     """
+    start = time.time()
     # Grab first element of path (can input filename.zip or filename)
     dirname = os.path.splitext(path)[0]
     print(f"Path name: {path}")
-    print(f"Dirname (1st element of path): {dirname}")
-    # Make sure there's no folder with the same name
-    shutil.rmtree(dirname, ignore_errors=True)
-    # Make folder
-    os.mkdir(dirname)
-    shapefile_name = f"{os.path.basename(dirname)}.shp"
-    print(f"Shapefile name: {shapefile_name}")
-    # Export shapefile into its own folder with the same name
-    df.to_file(driver="ESRI Shapefile", filename=f"{dirname}/{shapefile_name}")
-    print(f"Shapefile component parts folder: {dirname}/{shapefile_name}")
-    # Zip it up
-    shutil.make_archive(dirname, "zip", dirname)
-    # Remove the unzipped folder
-    shutil.rmtree(dirname, ignore_errors=True)
+
+    # Leave some headroom, since the size is an estimate
+    n_parts = int(np.ceil(estimate_shapefile_bytes(df) / (0.9 * max_part_bytes))) or 1
+    if n_parts == 1:
+        paths = [f"{dirname}.zip"]
+        parts = [df]
+    else:
+        paths = [f"{dirname}_{i + 1}.zip" for i in range(n_parts)]
+        bounds = np.linspace(0, len(df), n_parts + 1).astype(int)
+        parts = [df.iloc[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    print(f"Shapefile parts: {n_parts}")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        sizes = list(executor.map(
+            lambda args: write_zipped_shapefile(*args, compresslevel=compresslevel),
+            zip(parts, paths),
+        ))
+
+    print(f"Wrote {sum(sizes):,} bytes in {time.time() - start:.1f}s")
+    return paths
 
 
 # Upload S3 geoparquet
@@ -314,7 +390,162 @@ def parcels_join_toc_tiers(gdf, toc_tiers):
     return df
 
 
+# Results of entitlements_per_tract are memoized. The most recently used
+# ones are held in memory, and all of them are spilled to local parquet files,
+# the least recently used of which are evicted past a total size.
+ENTITLEMENTS_CACHE_DIR = os.path.join(laplan.spatial.CACHE_DIR, "entitlements_per_tract")
+ENTITLEMENTS_CACHE_SIZE = 16
+ENTITLEMENTS_CACHE_BYTES = 2**30
+# The catalog entries the results are computed from. A new version of
+# any of them invalidates the cached results. The big cases are read from
+# pcts_dataset, which A5_create_pcts_master only rewrites along with the cube.
+ENTITLEMENTS_SOURCES = ["pcts_entitlement_cube", "census_analysis_table"]
+# Seconds for which the versions of the sources are reused before they are
+# checked again, so that repeated calls don't each go back to S3.
+ENTITLEMENTS_VERSIONS_TTL = 60
+_entitlements_cache = collections.OrderedDict()
+_entitlements_versions = None
+_entitlements_versions_checked = 0.0
+
+
+@functools.lru_cache(maxsize=None)
+def open_catalog():
+    return intake.open_catalog("../catalogs/catalog.yml")
+
+
+def dataset_versions(cat, entries):
+    """
+    A version tag for the data of each catalog entry (its ETag on S3),
+    which changes whenever the data is rewritten.
+    """
+    def version(entry):
+        fs, _, paths = fsspec.core.get_fs_token_paths(cat[entry].urlpath)
+        fs.invalidate_cache(paths[0])
+        return str(fs.ukey(paths[0]))
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        return dict(zip(entries, executor.map(version, entries)))
+
+
+def _entitlements_cache_key(versions, **kwargs):
+    # Dates are normalized, so that equivalent spellings share an entry.
+    key = {
+        k: str(pd.to_datetime(v)) if k.endswith("_date") and v else v
+        for k, v in kwargs.items()
+    }
+    # The order of prefixes doesn't matter, while suffixes are the output columns.
+    if key.get("prefix_list") is not None:
+        key["prefix_list"] = sorted(key["prefix_list"])
+    key["versions"] = versions
+    return hashlib.md5(
+        json.dumps(key, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _read_cached_entitlements(key, nframes):
+    paths = [os.path.join(ENTITLEMENTS_CACHE_DIR, f"{key}_{i}.parquet") for i in range(nframes)]
+    # An entry missing any of its files is a miss, and gets rewritten.
+    if not all(os.path.exists(p) for p in paths):
+        return None
+    for p in paths:
+        # Mark the files as recently used.
+        os.utime(p)
+    return tuple(pd.read_parquet(p) for p in paths)
+
+
+def _write_cached_entitlements(key, frames):
+    os.makedirs(ENTITLEMENTS_CACHE_DIR, exist_ok=True)
+    for i, df in enumerate(frames):
+        df.to_parquet(os.path.join(ENTITLEMENTS_CACHE_DIR, f"{key}_{i}.parquet"))
+
+    # Evict the least recently used entries past the size limit. All of the
+    # files of an entry are evicted together, so none are left orphaned.
+    entries = collections.defaultdict(list)
+    for f in os.listdir(ENTITLEMENTS_CACHE_DIR):
+        entries[f.rsplit("_", 1)[0]].append(os.path.join(ENTITLEMENTS_CACHE_DIR, f))
+    total = 0
+    for paths in sorted(
+        entries.values(),
+        key=lambda paths: max(os.path.getmtime(p) for p in paths),
+        reverse=True,
+    ):
+        total += sum(os.path.getsize(p) for p in paths)
+        if total > ENTITLEMENTS_CACHE_BYTES:
+            for p in paths:
+                os.remove(p)
+
+
 def entitlements_per_tract(
+    big_case_threshold=20,
+    return_big_cases=False,
+    aggregate_years=False,
+    use_cache=True,
+    refresh=False,
+    **kwargs,
+):
+    """
+    Compute entitlements per census tract from PCTS, see
+    compute_entitlements_per_tract.
+
+    Results are memoized on the arguments and the versions of the source
+    datasets, so rewriting the entitlement cube or the census table
+    invalidates them. The versions are looked up again once they are
+    ENTITLEMENTS_VERSIONS_TTL seconds old, so repeated calls don't each
+    go back to S3. Set refresh to True to look them up right away.
+    Set use_cache to False to always recompute.
+    """
+    # Sets of prefixes or suffixes are sorted, so that the output is reproducible.
+    kwargs = {
+        k: sorted(v) if isinstance(v, (set, frozenset)) else v
+        for k, v in kwargs.items()
+    }
+    args = dict(
+        big_case_threshold=big_case_threshold,
+        return_big_cases=return_big_cases,
+        aggregate_years=aggregate_years,
+        **kwargs,
+    )
+    if not use_cache:
+        return compute_entitlements_per_tract(**args)
+
+    global _entitlements_versions, _entitlements_versions_checked
+    now = time.monotonic()
+    if (
+        _entitlements_versions is None
+        or refresh
+        or now - _entitlements_versions_checked > ENTITLEMENTS_VERSIONS_TTL
+    ):
+        _entitlements_versions = dataset_versions(open_catalog(), ENTITLEMENTS_SOURCES)
+        _entitlements_versions_checked = now
+    key = _entitlements_cache_key(
+        _entitlements_versions,
+        big_case_threshold=big_case_threshold,
+        return_big_cases=bool(return_big_cases),
+        aggregate_years=bool(aggregate_years),
+        **{
+            k: kwargs.get(k)
+            for k in ["start_date", "end_date", "prefix_list", "suffix_list"]
+        },
+    )
+
+    frames = _entitlements_cache.get(key)
+    if frames is None:
+        frames = _read_cached_entitlements(key, 2 if return_big_cases else 1)
+    if frames is None:
+        result = compute_entitlements_per_tract(**args)
+        frames = result if return_big_cases else (result,)
+        _write_cached_entitlements(key, frames)
+    _entitlements_cache[key] = frames
+    _entitlements_cache.move_to_end(key)
+    while len(_entitlements_cache) > ENTITLEMENTS_CACHE_SIZE:
+        _entitlements_cache.popitem(last=False)
+
+    # Return copies, so that callers can't modify the cached results.
+    frames = tuple(df.copy() for df in frames)
+    return frames if return_big_cases else frames[0]
+
+
+def compute_entitlements_per_tract(
     big_case_threshold=20,
     return_big_cases=False,
     aggregate_years=False,
@@ -323,65 +554,40 @@ def entitlements_per_tract(
     """
     Compute entitlements per census tract from PCTS
     
-    kwargs are passed to laplan.pcts.subset_pcts
+    The counts are sliced from the entitlement cube written by
+    A5_create_pcts_master, see laplan.pcts.entitlement_counts.
+    kwargs are the start_date, end_date, prefix_list, and suffix_list
+    of laplan.pcts.subset_pcts.
     """
-    cat = intake.open_catalog("../catalogs/catalog.yml")
+    cat = open_catalog()
 
-    kwargs["get_dummies"] = True
     verbose = kwargs.get("verbose", False)
-    suffix_list = kwargs.get("suffix_list", laplan.pcts.VALID_PCTS_SUFFIX)
+    suffix_list = kwargs.get("suffix_list")
     
     if verbose:
-        print("Loading PCTS")
-    # PCTS
-    pcts = cat.pcts.read()
-    pcts = laplan.pcts.subset_pcts(pcts, **kwargs)
-    pcts = laplan.pcts.drop_child_cases(pcts, keep_child_entitlements=True)
+        print("Loading PCTS entitlement cube")
+    cube = cat.pcts_entitlement_cube.read()
     
     if verbose:
         print("Loading census analysis table")
     # ACS data for income, race, commute, tenure
     census = cat.census_analysis_table.read()
     
-    if big_case_threshold is not None:
-        if verbose:
-            print(f"Removing cases touching more than {big_case_threshold} parcels")
-        #  Clean AIN data and get rid of outliers
-        case_counts = pcts.CASE_NUMBER.value_counts()
-        big_cases = pcts[pcts.CASE_NUMBER.isin(case_counts[case_counts > big_case_threshold].index)]
-
-        pcts = pcts[~pcts.CASE_NUMBER.isin(big_cases.CASE_NUMBER)]
-    
     if verbose:
         print("Aggregating entitlements to tract")
     # Count # of cases for each census tract, to see which kinds of entitlements
-    # are being applied for in which types of census tract:
-    if not aggregate_years:
-        entitlement_counts = (pcts
-            [["GEOID", "CASE_NUMBER", "CASE_YEAR_NUMBER"] + suffix_list]
-            .astype({c: "int64" for c in suffix_list})
-            .groupby("CASE_NUMBER").agg({
-                **{s: "max" for s in suffix_list},
-                "CASE_YEAR_NUMBER": "first",
-                "GEOID": "first",
-            })
-            .groupby(["GEOID", "CASE_YEAR_NUMBER"])
-            .sum()
-        ).reset_index(level=1).rename(columns={"CASE_YEAR_NUMBER": "year"})
-        entitlement_counts = entitlement_counts.assign(
-            year=entitlement_counts.year.astype("int64")
-        )
-    else:
-        entitlement_counts = (pcts
-            [["GEOID", "CASE_NUMBER"] + suffix_list]
-            .astype({c: "int64" for c in suffix_list})
-            .groupby("CASE_NUMBER").agg({
-                **{s: "max" for s in suffix_list},
-                "GEOID": "first",
-            })
-            .groupby(["GEOID"])
-            .sum()
-        )
+    # are being applied for in which types of census tract. Cases touching more
+    # than big_case_threshold parcels are left out.
+    entitlement_counts, big_case_ids = laplan.pcts.entitlement_counts(
+        cube,
+        start_date=kwargs.get("start_date"),
+        end_date=kwargs.get("end_date"),
+        prefix_list=kwargs.get("prefix_list"),
+        suffix_list=suffix_list,
+        big_case_threshold=big_case_threshold,
+        aggregate_years=aggregate_years,
+        return_big_cases=True,
+    )
 
     if verbose:
         print("Joining entitlements to census data")
@@ -393,10 +599,17 @@ def entitlements_per_tract(
         how="left", 
         validate="1:m"
     ).sort_values(["GEOID", "year"] if not aggregate_years else ["GEOID"]).astype(
-        {c: "Int64" for c in suffix_list}
+        {c: "Int64" for c in entitlement_counts.columns if c != "year"}
     ).set_index("GEOID")
     
     if return_big_cases:
-        return joined, big_cases
+        # Only read the rows of PCTS for the big cases themselves.
+        pcts = laplan.pcts.load_pcts(
+            cat.pcts_dataset.urlpath,
+            start_date=kwargs.get("start_date"),
+            end_date=kwargs.get("end_date"),
+        )
+        big_cases = pcts[pcts.CASE_ID.isin(big_case_ids)].drop_duplicates()
+        return joined, big_cases.sort_values(["CASE_ID", "AIN"])
     else:
         return joined
\ No newline at end of file
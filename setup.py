@@ -14,5 +14,5 @@ setup(
     license="Apache-2.0 license",
     include_package_data=True,
     package_dir={"laplan": "laplan"},
-    install_requires=["pandas"],
+    install_requires=["fsspec", "geopandas", "numpy", "pandas", "pyproj"],
 )
@@ -5,17 +5,46 @@ as well as a SQLite database for easier analysis.
 This requires the Microsoft Access ODBC driver to be installed:
 https://www.microsoft.com/en-us/download/details.aspx?id=13255
 
-It also requires pyodbc, sqlalchemy, and sqlalchemy_access
+It also requires pyodbc, sqlalchemy, and sqlalchemy_access, though only
+sqlalchemy is needed to copy between two SQL databases.
 """
 
+import argparse
+import concurrent.futures
 import csv
+import datetime
+import hashlib
 import io
 import os
-import sys
+import tempfile
+import time
 import urllib
 
 import sqlalchemy
-import sqlalchemy_access
+
+try:
+    import sqlalchemy_access
+except ImportError:
+    # Only needed to read an MS Access backup.
+    sqlalchemy_access = None
+
+# Number of rows to pull from the source DB at a time. Larger batches are
+# somewhat faster, but the peak memory of the copy scales with this number
+# rather than with the size of the table.
+BATCH_SIZE = 50_000
+
+# The large PCTS tables, which can be refreshed incrementally,
+# and their primary keys.
+INCREMENTAL_TABLES = {
+    "tCASE": "CASE_ID",
+    "tAPLC": "APLC_ID",
+    "tLOC": "LOC_ID",
+    "tLA_PROP": "PROP_ID",
+}
+
+# The application ID links cases, applications, and locations. It is recorded
+# with each change so that A5 can work out which cases need to be rebuilt.
+APPLICATION_KEY = "APLC_ID"
 
 
 def ms_access_connect(fname):
@@ -31,15 +60,27 @@ def ms_access_connect(fname):
     return engine
 
 
+def source_connect(source):
+    """
+    Connect to the source DB. This is usually the path to an MS Access
+    backup, but a sqlalchemy style connection string is also accepted,
+    which is handy for copying between two SQL databases.
+    """
+    if "://" in source:
+        return sqlalchemy.create_engine(source)
+    return ms_access_connect(source)
+
+
 def copy_column(c, supports_datetime=True):
     """
     Copy column structure from the source db to the destination.
     This also tweaks some types so that the Access DB flavor of
     database conforms with standard SQL.
     """
-    if isinstance(c.type, sqlalchemy_access.base.LONGCHAR):
+    access = sqlalchemy_access.base if sqlalchemy_access is not None else None
+    if access is not None and isinstance(c.type, access.LONGCHAR):
         return sqlalchemy.Column(c.name, sqlalchemy.String)
-    elif isinstance(c.type, sqlalchemy_access.base.YESNO):
+    elif access is not None and isinstance(c.type, access.YESNO):
         return sqlalchemy.Column(c.name, sqlalchemy.Boolean)
     elif isinstance(c.type, sqlalchemy.DATETIME) and not supports_datetime:
         return sqlalchemy.Column(c.name, sqlalchemy.TIMESTAMP)
@@ -47,6 +88,680 @@ def copy_column(c, supports_datetime=True):
         return c.copy()
 
 
+def constrained_table(table, meta, supports_datetime=True):
+    """
+    Copy the full definition of a source table, with its keys, to meta.
+    The foreign keys are deferrable, so that a table which others reference
+    can be reloaded within a single transaction.
+    """
+    to_table = sqlalchemy.Table(
+        table.name, meta, *[copy_column(c, supports_datetime) for c in table.columns]
+    )
+    # Reflected foreign keys belong to the table rather than its columns,
+    # so they aren't copied with them.
+    for fk in table.foreign_key_constraints:
+        referred = fk.referred_table.name
+        if meta.schema:
+            referred = f"{meta.schema}.{referred}"
+        to_table.append_constraint(
+            sqlalchemy.ForeignKeyConstraint(
+                [e.parent.name for e in fk.elements],
+                [f"{referred}.{e.column.name}" for e in fk.elements],
+                deferrable=True,
+                initially="DEFERRED",
+            )
+        )
+    return to_table
+
+
+def bare_column(c):
+    """
+    Copy a column without its primary key, index, or foreign key settings,
+    so that the table can be bulk loaded before any of those are built.
+    """
+    return sqlalchemy.Column(c.name, c.type)
+
+
+def get_table(meta, name):
+    """
+    Look up a table by name in a MetaData, accounting for its schema.
+    """
+    return meta.tables[f"{meta.schema}.{name}" if meta.schema else name]
+
+
+def table_dependencies(meta):
+    """
+    Build the dependency graph of the tables in a (reflected) MetaData,
+    mapping each table name to the set of table names it references
+    through foreign keys. Self-references are ignored.
+    """
+    return {
+        table.name: {fk.column.table.name for fk in table.foreign_keys} - {table.name}
+        for table in meta.sorted_tables
+    }
+
+
+def create_deferred_constraints(to_engine, from_table, to_table):
+    """
+    Add the primary key, foreign keys, and indexes of a table after its data
+    have been loaded. Building these once over a full table is much cheaper
+    than maintaining them row-by-row during the bulk load.
+
+    to_table is the full table definition, with constraints, while indexes
+    are taken from the reflected source table.
+    """
+    pk_columns = [c.name for c in to_table.primary_key.columns]
+
+    if to_engine.dialect.name == "sqlite":
+        # SQLite can't ALTER TABLE to add constraints, so we enforce the
+        # primary key with a unique index and skip the foreign keys.
+        if pk_columns:
+            sqlalchemy.Index(
+                f"pk_{to_table.name}",
+                *[to_table.c[c] for c in pk_columns],
+                unique=True,
+            ).create(bind=to_engine)
+    else:
+        if pk_columns:
+            to_engine.execute(sqlalchemy.schema.AddConstraint(to_table.primary_key))
+        for fk in to_table.foreign_key_constraints:
+            to_engine.execute(sqlalchemy.schema.AddConstraint(fk))
+
+    for index in from_table.indexes:
+        columns = [c.name for c in index.columns]
+        if columns == pk_columns:
+            continue
+        # Index names are per-table in Access, but per-schema elsewhere.
+        sqlalchemy.Index(
+            f"ix_{to_table.name}_{index.name}",
+            *[to_table.c[c] for c in columns],
+            unique=index.unique,
+        ).create(bind=to_engine)
+
+
+class IteratorFile(io.TextIOBase):
+    """
+    A read-only file object backed by an iterator of strings.
+
+    psycopg's copy_expert pulls data from a file object with read(size),
+    so wrapping a generator in this lets us stream rows into COPY
+    without ever building the whole table as one string.
+    """
+
+    def __init__(self, iterator):
+        self._iterator = iterator
+        self._buffer = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        buffered = len(self._buffer)
+        while size < 0 or buffered < size:
+            try:
+                chunk = next(self._iterator)
+            except StopIteration:
+                break
+            chunks.append(chunk)
+            buffered += len(chunk)
+        data = "".join(chunks)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def fetch_batches(from_engine, from_table, batch_size=BATCH_SIZE):
+    """
+    Yield the rows of a table from the source DB in lists of at most
+    batch_size rows, so that only one batch is held in memory at a time.
+    """
+    result = from_engine.execute(from_table.select())
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        result.close()
+
+
+def csv_batches(batches):
+    """
+    Render batches of rows as CSV text suitable for a PostgreSQL COPY.
+
+    The standard library CSV writer actually does a better job than
+    the pandas CSV writer, as nullable integers are handled correctly.
+    Furthermore, we strip NULL characters from strings, as PostreSQL
+    chokes on those.
+    """
+    for rows in batches:
+        fp = io.StringIO()
+        writer = csv.writer(fp)
+        writer.writerows(
+            [
+                [v.replace("\x00", "") if isinstance(v, str) else v for v in row]
+                for row in rows
+            ]
+        )
+        yield fp.getvalue()
+
+
+def copy_table(
+    from_engine,
+    from_table,
+    to_engine,
+    to_table,
+    schema=None,
+    batch_size=BATCH_SIZE,
+    hashes=None,
+    replace=False,
+):
+    """
+    Stream the data of one table from the source DB to the destination,
+    returning the number of rows copied.
+
+    If using postgres, use the native COPY FROM functionality of
+    CSV loading. This is faster and more stable. Otherwise, rows are
+    inserted with batched executemany calls.
+
+    If the pcts_row_hashes table is given, the hash of every row is recorded
+    as it is copied, so that a later incremental refresh only applies changes.
+    The rows and their hashes are committed together.
+
+    If replace is True, the existing rows of the table are deleted in the
+    same transaction, so that deferred foreign keys referencing them are
+    only checked against the new rows.
+    """
+    start = time.perf_counter()
+    nrows = 0
+
+    def counted(batches):
+        nonlocal nrows
+        for rows in batches:
+            nrows += len(rows)
+            yield rows
+
+    batches = counted(fetch_batches(from_engine, from_table, batch_size))
+
+    if to_engine.dialect.name == "postgresql":
+        hash_file = None
+        if hashes is not None:
+            # The COPY connection is busy reading the CSV, so the hashes are
+            # spooled to a temporary file as each batch goes by, and copied
+            # after the data, before anything is committed.
+            hash_file = tempfile.TemporaryFile("w+", newline="")
+            writer = csv.writer(hash_file)
+
+            def hashed(batches):
+                for rows in batches:
+                    writer.writerows(
+                        [h["table_name"], h["pk"], h["row_hash"]]
+                        for h in hash_rows(to_table.name, rows)
+                    )
+                    yield rows
+
+            batches = hashed(batches)
+
+        # Load the data using a raw psycopg cursor, which reads the CSV
+        # from the generator-backed file object as it goes.
+        dest = f'"{schema}"."{to_table.name}"' if schema else f'"{to_table.name}"'
+        connection = to_engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if replace:
+                cursor.execute(f"DELETE FROM {dest}")
+            cursor.copy_expert(
+                f"COPY {dest} FROM STDIN WITH (FORMAT CSV)",
+                IteratorFile(csv_batches(batches)),
+            )
+            if hash_file is not None:
+                hash_file.seek(0)
+                hash_dest = (
+                    f'"{schema}"."{hashes.name}"' if schema else f'"{hashes.name}"'
+                )
+                cursor.copy_expert(
+                    f"COPY {hash_dest} (table_name, pk, row_hash) "
+                    "FROM STDIN WITH (FORMAT CSV)",
+                    hash_file,
+                )
+            cursor.close()
+            connection.commit()
+        finally:
+            connection.close()
+            if hash_file is not None:
+                hash_file.close()
+
+    else:  # Otherwise use batched standard inserts in a single transaction.
+        with to_engine.begin() as connection:
+            if replace:
+                connection.execute(to_table.delete())
+            for rows in batches:
+                connection.execute(to_table.insert(), [dict(row) for row in rows])
+                if hashes is not None:
+                    connection.execute(
+                        hashes.insert(), hash_rows(to_table.name, rows)
+                    )
+
+    elapsed = time.perf_counter() - start
+    rate = nrows / elapsed if elapsed > 0 else float("nan")
+    print(f"Copied {nrows} rows to {to_table} in {elapsed:.1f}s ({rate:,.0f} rows/sec)")
+    return nrows
+
+
+def load_tables(
+    from_engine,
+    to_engine,
+    from_meta,
+    load_meta,
+    schema=None,
+    batch_size=BATCH_SIZE,
+    workers=1,
+    hashes=None,
+):
+    """
+    Copy all of the tables in from_meta to the matching tables in load_meta,
+    running up to `workers` copies at once, each on its own pair of
+    connections. A table is only started once every table it references
+    has finished loading, so independent tables load concurrently while
+    the foreign key order is still respected.
+
+    If the pcts_row_hashes table is given, the hashes of the rows of the
+    INCREMENTAL_TABLES are recorded with them.
+    """
+    tables = {
+        table.name: (table, get_table(load_meta, table.name))
+        for table in from_meta.sorted_tables
+    }
+    pending = {
+        name: deps & set(tables)
+        for name, deps in table_dependencies(from_meta).items()
+    }
+    done = set()
+    running = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            ready = [name for name, deps in pending.items() if deps <= done]
+            if not ready and not running:
+                # There is a reference cycle. Since the constraints are only
+                # added after the load, it is safe to just go ahead with them.
+                ready = list(pending)
+            for name in ready:
+                del pending[name]
+                from_table, to_table = tables[name]
+                print(f"Copying data from {from_table} to {to_table}")
+                future = executor.submit(
+                    copy_table,
+                    from_engine,
+                    from_table,
+                    to_engine,
+                    to_table,
+                    schema,
+                    batch_size,
+                    hashes if name in INCREMENTAL_TABLES else None,
+                )
+                running[future] = name
+
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                future.result()
+                done.add(running.pop(future))
+
+
+def full_load(
+    from_engine, to_engine, from_meta, schema=None, batch_size=BATCH_SIZE, workers=1
+):
+    """
+    Copy the structure and data of every table in from_meta to the destination.
+    The tables are first created without any keys or indexes, which are
+    added once all of the data are loaded.
+    """
+    supports_datetime = to_engine.dialect.name != "postgresql"
+    to_meta = sqlalchemy.MetaData(schema=schema)
+    load_meta = sqlalchemy.MetaData(schema=schema)
+    for table in from_meta.sorted_tables:
+        to_table = constrained_table(table, to_meta, supports_datetime)
+        sqlalchemy.Table(
+            table.name, load_meta, *[bare_column(c) for c in to_table.columns]
+        )
+    load_meta.create_all(bind=to_engine)
+
+    # Record the row hashes of the large tables as they are copied,
+    # so that the first incremental refresh only applies what changed.
+    bookkeeping, hashes, _, _ = refresh_tables(schema)
+    bookkeeping.create_all(bind=to_engine)
+    to_engine.execute(
+        hashes.delete().where(hashes.c.table_name.in_(list(INCREMENTAL_TABLES)))
+    )
+
+    # Copy the actual table data.
+    load_tables(
+        from_engine,
+        to_engine,
+        from_meta,
+        load_meta,
+        schema=schema,
+        batch_size=batch_size,
+        workers=workers,
+        hashes=hashes,
+    )
+
+    # Build the keys and indexes.
+    for from_table in from_meta.sorted_tables:
+        to_table = get_table(to_meta, from_table.name)
+        print(f"Creating keys and indexes for {to_table}")
+        create_deferred_constraints(to_engine, from_table, to_table)
+
+
+def refresh_tables(schema=None):
+    """
+    Define the bookkeeping tables for incremental refreshes:
+    the hash of every loaded row, a log of the rows that
+    changed in each refresh, and the keys seen so far by a
+    running refresh, which are used to find deleted rows.
+    """
+    meta = sqlalchemy.MetaData(schema=schema)
+    hashes = sqlalchemy.Table(
+        "pcts_row_hashes",
+        meta,
+        sqlalchemy.Column("table_name", sqlalchemy.String, nullable=False),
+        sqlalchemy.Column("pk", sqlalchemy.BigInteger, nullable=False),
+        sqlalchemy.Column("row_hash", sqlalchemy.String, nullable=False),
+        sqlalchemy.Index("ix_pcts_row_hashes", "table_name", "pk", unique=True),
+    )
+    changes = sqlalchemy.Table(
+        "pcts_changes",
+        meta,
+        sqlalchemy.Column("table_name", sqlalchemy.String, nullable=False),
+        sqlalchemy.Column("pk", sqlalchemy.BigInteger, nullable=False),
+        sqlalchemy.Column("aplc_id", sqlalchemy.BigInteger),
+        sqlalchemy.Column("refreshed_at", sqlalchemy.DateTime, nullable=False),
+        sqlalchemy.Index("ix_pcts_changes", "refreshed_at"),
+    )
+    seen = sqlalchemy.Table(
+        "pcts_refresh_keys",
+        meta,
+        sqlalchemy.Column("table_name", sqlalchemy.String, nullable=False),
+        sqlalchemy.Column("pk", sqlalchemy.BigInteger, nullable=False),
+        sqlalchemy.Index("ix_pcts_refresh_keys", "table_name", "pk", unique=True),
+    )
+    return meta, hashes, changes, seen
+
+
+def row_hash(row):
+    """
+    Hash the values of a row, so that changed rows can be detected
+    without keeping a copy of the previous load around.
+    """
+    return hashlib.md5(repr(tuple(row)).encode("utf-8")).hexdigest()
+
+
+def hash_rows(name, rows):
+    """
+    The pcts_row_hashes rows for a batch of rows of an incremental table.
+    """
+    pk = INCREMENTAL_TABLES[name]
+    return [
+        {"table_name": name, "pk": row[pk], "row_hash": row_hash(row)} for row in rows
+    ]
+
+
+def chunked(values, size=500):
+    """
+    Split a list into chunks, keeping IN clauses under the
+    bound parameter limits of SQLite.
+    """
+    for i in range(0, len(values), size):
+        yield values[i : i + size]
+
+
+def log_changes(connection, changes, name, rows, refreshed_at):
+    """
+    Record the key and application of some (pk, aplc_id) rows of a table
+    in the pcts_changes log.
+    """
+    log = [
+        {"table_name": name, "pk": k, "aplc_id": a, "refreshed_at": refreshed_at}
+        for k, a in rows
+    ]
+    if log:
+        connection.execute(changes.insert(), log)
+
+
+def refresh_table(
+    from_engine,
+    from_table,
+    to_engine,
+    to_table,
+    hashes,
+    changes,
+    seen,
+    refreshed_at,
+    batch_size=BATCH_SIZE,
+):
+    """
+    Apply the rows of a table that are new or changed since the last load,
+    as detected by primary key and row hash, returning their number.
+    Changed rows are updated in place, so that rows of other tables which
+    reference them keep satisfying their foreign keys.
+
+    The source is streamed in batches, and each batch is compared against
+    the stored hashes of its keys only and applied in its own transaction,
+    so memory is bounded by the batch size. The keys seen in the source are
+    recorded in pcts_refresh_keys, for delete_unseen_rows to find the rows
+    that were deleted. A table without stored hashes, e.g. one loaded before
+    they were recorded by the full load, has every row treated as changed.
+    """
+    start = time.perf_counter()
+    name = from_table.name
+    pk = INCREMENTAL_TABLES[name]
+    key = to_table.c[pk]
+    application = (
+        to_table.c[APPLICATION_KEY]
+        if APPLICATION_KEY in to_table.c
+        else sqlalchemy.null()
+    )
+    update = to_table.update().where(key == sqlalchemy.bindparam("_pk"))
+
+    # Clear out the keys of a refresh that didn't finish.
+    to_engine.execute(seen.delete().where(seen.c.table_name == name))
+
+    n_changed = 0
+    for rows in fetch_batches(from_engine, from_table, batch_size):
+        keys = [row[pk] for row in rows]
+        with to_engine.begin() as connection:
+            stored = {}
+            for chunk in chunked(keys):
+                stored.update(
+                    connection.execute(
+                        sqlalchemy.select([hashes.c.pk, hashes.c.row_hash]).where(
+                            (hashes.c.table_name == name) & hashes.c.pk.in_(chunk)
+                        )
+                    ).fetchall()
+                )
+            new_hashes = [
+                h
+                for h in hash_rows(name, rows)
+                if stored.get(h["pk"]) != h["row_hash"]
+            ]
+            if new_hashes:
+                changed = [h["pk"] for h in new_hashes]
+                changed_keys = set(changed)
+                upserts = [dict(row) for row in rows if row[pk] in changed_keys]
+
+                # Log the old versions of the rows which are already there,
+                # so that cases which lose a location are rebuilt too.
+                existing = {}
+                for chunk in chunked(changed):
+                    existing.update(
+                        connection.execute(
+                            sqlalchemy.select([key, application]).where(
+                                key.in_(chunk)
+                            )
+                        ).fetchall()
+                    )
+                log_changes(connection, changes, name, existing.items(), refreshed_at)
+
+                updates = [
+                    dict({k: v for k, v in row.items() if k != pk}, _pk=row[pk])
+                    for row in upserts
+                    if row[pk] in existing
+                ]
+                inserts = [row for row in upserts if row[pk] not in existing]
+                if updates:
+                    connection.execute(update, updates)
+                if inserts:
+                    connection.execute(to_table.insert(), inserts)
+                for chunk in chunked(changed):
+                    connection.execute(
+                        hashes.delete().where(
+                            (hashes.c.table_name == name) & hashes.c.pk.in_(chunk)
+                        )
+                    )
+                connection.execute(hashes.insert(), new_hashes)
+                log_changes(
+                    connection,
+                    changes,
+                    name,
+                    [(row[pk], row.get(APPLICATION_KEY)) for row in upserts],
+                    refreshed_at,
+                )
+                n_changed += len(upserts)
+            connection.execute(
+                seen.insert(), [{"table_name": name, "pk": k} for k in keys]
+            )
+
+    elapsed = time.perf_counter() - start
+    print(f"Refreshed {to_table} in {elapsed:.1f}s: {n_changed} new or changed rows")
+    return n_changed
+
+
+def delete_unseen_rows(
+    to_engine, to_table, hashes, changes, seen, refreshed_at, batch_size=BATCH_SIZE
+):
+    """
+    Delete the rows of a table which refresh_table didn't see in the source,
+    returning their number. Rows with a stored hash whose key wasn't seen
+    are found by anti-joining the stored hashes with the seen keys.
+
+    This should run after refresh_table has seen every table, starting with
+    the tables that reference others, so that the rows referencing a deleted
+    row are gone before it is.
+    """
+    name = to_table.name
+    key = to_table.c[INCREMENTAL_TABLES[name]]
+    application = (
+        to_table.c[APPLICATION_KEY]
+        if APPLICATION_KEY in to_table.c
+        else sqlalchemy.null()
+    )
+    unseen = (
+        sqlalchemy.select([hashes.c.pk])
+        .select_from(
+            hashes.outerjoin(
+                seen,
+                (seen.c.table_name == hashes.c.table_name)
+                & (seen.c.pk == hashes.c.pk),
+            )
+        )
+        .where((hashes.c.table_name == name) & seen.c.pk.is_(None))
+        .limit(batch_size)
+    )
+
+    # Removing the rows also removes their hashes, so each query
+    # finds the next batch.
+    n_deleted = 0
+    while True:
+        with to_engine.begin() as connection:
+            deleted = [k for k, in connection.execute(unseen)]
+            if not deleted:
+                break
+            for chunk in chunked(deleted):
+                # Log the deleted rows, so that their cases are rebuilt.
+                log_changes(
+                    connection,
+                    changes,
+                    name,
+                    connection.execute(
+                        sqlalchemy.select([key, application]).where(key.in_(chunk))
+                    ).fetchall(),
+                    refreshed_at,
+                )
+                connection.execute(to_table.delete().where(key.in_(chunk)))
+                connection.execute(
+                    hashes.delete().where(
+                        (hashes.c.table_name == name) & hashes.c.pk.in_(chunk)
+                    )
+                )
+            n_deleted += len(deleted)
+    to_engine.execute(seen.delete().where(seen.c.table_name == name))
+
+    print(f"Deleted {n_deleted} rows from {to_table}")
+    return n_deleted
+
+
+def refresh(from_engine, to_engine, from_meta, schema=None, batch_size=BATCH_SIZE):
+    """
+    Incrementally refresh a destination DB which has already been fully loaded.
+    The large tables in INCREMENTAL_TABLES only receive their deltas,
+    while the remaining (small) tables are reloaded in full, each within
+    a single transaction.
+
+    Tables are refreshed in foreign key order, and the rows deleted from
+    the large tables are only removed at the end, in reverse order.
+    """
+    refreshed_at = datetime.datetime.now()
+    to_meta = sqlalchemy.MetaData(schema=schema)
+    to_meta.reflect(bind=to_engine)
+    bookkeeping, hashes, changes, seen = refresh_tables(schema)
+    bookkeeping.create_all(bind=to_engine)
+
+    refreshed = []
+    for from_table in from_meta.sorted_tables:
+        try:
+            to_table = get_table(to_meta, from_table.name)
+        except KeyError:
+            raise ValueError(
+                f"{from_table.name} is missing from the destination, "
+                "run a full load before refreshing it incrementally"
+            )
+        if from_table.name in INCREMENTAL_TABLES:
+            refresh_table(
+                from_engine,
+                from_table,
+                to_engine,
+                to_table,
+                hashes,
+                changes,
+                seen,
+                refreshed_at,
+                batch_size,
+            )
+            refreshed.append(to_table)
+        else:
+            print(f"Reloading data from {from_table} to {to_table}")
+            copy_table(
+                from_engine,
+                from_table,
+                to_engine,
+                to_table,
+                schema,
+                batch_size,
+                replace=True,
+            )
+
+    for to_table in reversed(refreshed):
+        delete_unseen_rows(
+            to_engine, to_table, hashes, changes, seen, refreshed_at, batch_size
+        )
+
+
 if __name__ == "__main__":
     """
     Load data from a PCTS backup and transfer it to another database.
@@ -65,68 +780,59 @@ if __name__ == "__main__":
     To load to a PostgreSQL database with schema 'pcts', run
 
         python load_pcts.py PCTS.accdb $POSTGRES_URI pcts
+
+    The number of rows held in memory at once can be tuned with --batch-size,
+    and independent tables can be copied concurrently with --workers.
+
+    Once a destination has been fully loaded, it can be kept up to date with
+
+        python load_pcts.py PCTS.accdb sqlite:///PCTS.sqlite --incremental
+
+    which only applies the new, changed, and deleted rows of the large tables,
+    and logs them in the pcts_changes table for A5_create_pcts_master.
     """
-    if len(sys.argv) < 3:
-        print("Please provide an MS Access backup and a destination DB")
-        exit()
+    parser = argparse.ArgumentParser(
+        description="Load data from a PCTS backup and transfer it to another database."
+    )
+    parser.add_argument("source", help="PCTS backup or sqlalchemy connection string")
+    parser.add_argument("dest", help="sqlalchemy connection string of the destination")
+    parser.add_argument("schema", nargs="?", default=None, help="destination schema")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"rows fetched from the source at a time (default {BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of tables to copy concurrently (default 1)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only apply changes since the last load to an already loaded DB",
+    )
+    args = parser.parse_args()
 
     # Connect to source and destination DB
-    from_engine = ms_access_connect(sys.argv[1])
-    to_engine = sqlalchemy.create_engine(sys.argv[2])
-    supports_datetime = to_engine.dialect.name != "postgresql"
-    schema = None
-    if len(sys.argv) == 4:
-        schema = sys.argv[3]
+    from_engine = source_connect(args.source)
+    to_engine = sqlalchemy.create_engine(args.dest)
+    schema = args.schema
+    workers = args.workers
+    if to_engine.dialect.name == "sqlite" and workers > 1:
+        # SQLite only allows one writer at a time, so concurrent copies
+        # would just fail on a locked database.
+        print("SQLite does not support concurrent writes, using a single worker")
+        workers = 1
 
     # Get the table structure from the source
     from_meta = sqlalchemy.MetaData()
     from_meta.reflect(bind=from_engine)
 
-    # Copy the table structure from the source DB to the destination.
-    to_meta = sqlalchemy.MetaData(schema=schema)
-    for table in from_meta.sorted_tables:
-        sqlalchemy.Table(
-            table.name,
-            to_meta,
-            *[copy_column(c, supports_datetime) for c in table.columns],
-        )
-    to_meta.create_all(bind=to_engine)
-
-    # Copy the actual table data.
-    for from_table, to_table in zip(from_meta.sorted_tables, to_meta.sorted_tables):
-        print(f"Copying data from {from_table} to {to_table}")
-        table_data = from_engine.execute(from_table.select()).fetchall()
-        table_data = [dict(row) for row in table_data]
-
-        # If using postgres, use the native COPY FROM functionality of
-        # CSV loading. This is faster and more stable.
-        if to_engine.dialect.name == "postgresql":
-            # Prepare an in-memory CSV string of the data.
-            # The standard library CSV writer actually does a better job than
-            # the pandas CSV writer, as nullable integers are handled correctly.
-            # Furthermore, we strip NULL characters from strings, as PostreSQL
-            # chokes on those.
-            fp = io.StringIO()
-            writer = csv.DictWriter(fp, list(table_data[0].keys()))
-            writer.writerows(
-                [
-                    {
-                        k: v.replace("\x00", "") if isinstance(v, str) else v
-                        for k, v in row.items()
-                    }
-                    for row in table_data
-                ]
-            )
-            fp.seek(0)
-
-            # Load the data using a raw psycopg cursor
-            dest = f'"{schema}"."{to_table.name}"' if schema else f'"{to_table.name}"'
-            cursor = to_engine.raw_connection().cursor()
-            cursor.copy_expert(f"COPY {dest} FROM STDIN WITH (FORMAT CSV)", fp)
-
-            # Clean up.
-            cursor.connection.commit()
-            cursor.close()
+    if args.incremental:
+        refresh(from_engine, to_engine, from_meta, schema, args.batch_size)
+        exit()
 
-        else:  # Otherwise use a standard insert.
-            to_engine.execute(to_table.insert(table_data))
+    full_load(from_engine, to_engine, from_meta, schema, args.batch_size, workers)
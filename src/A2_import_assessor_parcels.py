@@ -4,87 +4,243 @@ Script to load parcel data from LA County and join it with Census tracts.
 We choose parcel data that combines rolls for the past ~10 years in order
 to get a more maximal view of AINs that have existed in the parcel.
 For parcels that exist in more than one year (most of them), we choose
-the most recent year.
+the most recent year. The history of every parcel is also kept, run-length
+encoded, so that the roll can be looked up as of any year.
 
 Relies on a locally downloaded version of the 14GB CSV here:
 https://data.lacounty.gov/Parcel-/Assessor-Parcels-Data-2006-thru-2019/9trm-uz8i
 """
-import dask.dataframe as dd
+import concurrent.futures
+import glob
+import io
+import os
+import shutil
+
 import intake_dcat
 import geopandas
+import laplan
 import pandas
 
 CHUNK = 1_000_000
 bucket_name = "city-planning-entitlements"
 
-def main(county_parcel_path):
-    # Normally we would paralellize using something like
-    # dask, or go out of core with something like vaex,
-    # but they both failed on the relevant CSV due to 
-    # line ending weirdness. Instead we iteratively build
-    # up the parcels file.
+# The columns of the assessor roll that we keep, and their dtypes.
+# Only these columns are parsed from the CSV. Add any other columns
+# needed downstream here. The coordinates are kept as float64, as
+# A3_store_parcel_work finds duplicate centroids at about 1 cm, and
+# float32 only resolves about half a meter here.
+PARCEL_SCHEMA = {
+    "AIN": "int64",
+    "RollYear": "int16",
+    "PropertyUseCode": "object",
+    "AdministrativeRegion": "object",
+    "ZIPcode5": "object",
+    "CENTER_LAT": "float64",
+    "CENTER_LON": "float64",
+}
+# Low-cardinality codes, which are stored as categoricals once the
+# partitions are combined (each chunk would get its own categories).
+CATEGORICAL_COLUMNS = ["PropertyUseCode", "AdministrativeRegion", "ZIPcode5"]
+# The columns of the slim parcel centroids file.
+CENTROID_COLUMNS = ["AIN", "GEOID", "CENTER_LAT", "CENTER_LON"]
+
+# Rows are spilled to disk in partitions, by a hash of the AIN.
+# Every roll year of a parcel lands in the same partition, so each partition
+# can be reduced on its own, and only has to fit in memory by itself.
+# The history is stored in the same partitions, see laplan.parcels.read_history.
+PARTITIONS = laplan.parcels.HISTORY_PARTITIONS
+SPILL_DIR = "parcel_partitions"
+HISTORY_PATH = f"{bucket_name}/data/source/assessor_parcel_history"
+
+
+class NormalizedNewlines(io.RawIOBase):
+    """
+    A read-only binary file wrapper which converts Windows (\\r\\n) and
+    old Mac (\\r) line endings to \\n as the file is streamed, so that the
+    CSV parser sees a single, consistent line ending.
+    """
+
+    def __init__(self, raw, blocksize=1 << 20):
+        self._raw = raw
+        self._blocksize = blocksize
+        self._pending_cr = False
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def _read_block(self):
+        while True:
+            block = self._raw.read(self._blocksize)
+            if not block:
+                # A trailing \r at the very end of the file is a line ending.
+                out = b"\n" if self._pending_cr else b""
+                self._pending_cr = False
+                return out
+            if self._pending_cr:
+                block = b"\r" + block
+            # Hold on to a trailing \r, in case the next block starts with \n.
+            self._pending_cr = block.endswith(b"\r")
+            if self._pending_cr:
+                block = block[:-1]
+            block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            if block:
+                return block
+
+    def readinto(self, b):
+        if not self._buffer:
+            self._buffer = self._read_block()
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
+def partition_of(ain):
+    """
+    The spill partition of each AIN.
+    """
+    return laplan.parcels.ain_partition(ain, PARTITIONS)
+
+
+def latest_roll_year(history):
+    """
+    Keep the most recent roll year of each parcel, from its history.
+    """
+    return (
+        history.drop_duplicates(subset="AIN", keep="last")
+        .assign(RollYear=lambda df: df.LastRollYear)
+        .drop(columns=["LastRollYear"])
+    )
+
+
+def spill_partitions(county_parcel_path):
+    """
+    Stream the county CSV in chunks, hash-partitioning the rows by AIN
+    into spill files, so that no more than one chunk is held in memory.
+    """
+    shutil.rmtree(SPILL_DIR, ignore_errors=True)
+    for p in range(PARTITIONS):
+        os.makedirs(os.path.join(SPILL_DIR, f"part_{p}"))
+
     reader = pandas.read_csv(
-        county_parcel_path,
-        iterator=True,
+        io.BufferedReader(NormalizedNewlines(open(county_parcel_path, "rb"))),
         chunksize=CHUNK,
-        dtype={
-            'PropertyUseCode': 'object',
-            'ZIPcode5': 'object',
-            'AdministrativeRegion': 'object',
-        },
+        usecols=list(PARCEL_SCHEMA),
+        dtype=PARCEL_SCHEMA,
     )
-    i = 0
-    for chunk in reader:
+    for i, chunk in enumerate(reader):
         print(f"Reading chunk {i}")
-        cols = [c for c in chunk.columns if c not in ["RollYear", "AIN"]]
-        agg = chunk.groupby("AIN").agg({
-            "RollYear": "max",
-            **{c: "first" for c in cols},
-        })
-        agg.to_parquet(f"parcels_{i}.parquet")
-        i = i + 1
-
-    # Use Dask to combine the resulting parcels subfiles
-    print("Combining sub-parquets")
-    ddf = dd.read_parquet("parcels_*.parquet", engine="pyarrow")
-    cols = [c for c in ddf.columns if c not in ["RollYear", "AIN"]]
-    agg = ddf.groupby("AIN").agg({
-        "RollYear": "max",
-        **{c: "first" for c in cols},
-    })
-    df = agg.compute()
-    df.to_parquet(f"s3://{bucket_name}/data/source/Assessor_Parcels_Data_2006_2019.parquet")
-    
-    # Load census tract data from the county
-    print("Downloading tract data")
+        # Every roll year is spilled, for the history. The years of a parcel
+        # can be spread over chunks, so runs can only be encoded once the
+        # whole partition is read.
+        for p, partition in chunk.groupby(partition_of(chunk.AIN)):
+            partition.to_parquet(
+                os.path.join(SPILL_DIR, f"part_{p}", f"chunk_{i}.parquet"),
+                index=False,
+            )
+
+
+def reduce_partition(p):
+    """
+    Run-length encode the history of the parcels in one spill partition,
+    uploading it, and reduce it to the latest roll year of each parcel.
+    """
+    files = sorted(glob.glob(os.path.join(SPILL_DIR, f"part_{p}", "*.parquet")))
+    if not files:
+        return None
+    history = laplan.parcels.encode_history(
+        pandas.concat([pandas.read_parquet(f) for f in files], ignore_index=True)
+    )
+    history.to_parquet(f"s3://{HISTORY_PATH}/part_{p}.parquet", index=False)
+    path = os.path.join(SPILL_DIR, f"reduced_{p}.parquet")
+    latest_roll_year(history).to_parquet(path, index=False)
+    return path
+
+
+def load_tracts():
+    """
+    Download the census tracts from the county open data portal.
+    """
     lacounty_data = intake_dcat.DCATCatalog("https://data.lacounty.gov/data.json")
     tracts = lacounty_data["https://data.lacounty.gov/api/views/ay2y-b9rg"].read()
+    return tracts.rename(columns={"geoid10": "GEOID"})[["GEOID", "geometry"]]
+
+
+def main(county_parcel_path):
+    # Normally we would paralellize using something like
+    # dask, or go out of core with something like vaex,
+    # but they both failed on the relevant CSV due to
+    # line ending weirdness. Instead we stream the CSV once,
+    # normalizing the line endings, and spill it into partitions
+    # by AIN. The partitions are then reduced in parallel.
+    spill_partitions(county_parcel_path)
+
+    print("Reducing partitions")
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        paths = [p for p in executor.map(reduce_partition, range(PARTITIONS)) if p]
+    df = (
+        pandas.concat([pandas.read_parquet(p) for p in paths], ignore_index=True)
+        .astype({c: "category" for c in CATEGORICAL_COLUMNS})
+        .set_index("AIN")
+        .sort_index()
+    )
+    shutil.rmtree(SPILL_DIR, ignore_errors=True)
+    df.to_parquet(f"s3://{bucket_name}/data/source/Assessor_Parcels_Data_2006_2019.parquet")
+    
+    # Load census tract data from the county. This is cached locally
+    # after the first run.
+    print("Loading tract data")
+    tracts = laplan.spatial.register_layer(
+        "tracts", laplan.spatial.cached_polygons("lacounty_tracts", load_tracts)
+    )
 
-    # Join the datasets
+    # Join the datasets. The tracts don't overlap, so each parcel
+    # gets the first (and only) tract that contains it.
     print("Joining to tract data")
-    gdf = geopandas.GeoDataFrame(
+    coords = laplan.spatial.project_points(df.CENTER_LON, df.CENTER_LAT)
+    point_idx, tract_idx = laplan.spatial.lookup("tracts", coords)
+    tract_idx = laplan.spatial.first_polygon(point_idx, tract_idx, len(df))
+    joined = geopandas.GeoDataFrame(
         df,
         geometry=geopandas.points_from_xy(df.CENTER_LON, df.CENTER_LAT),
         crs="EPSG:4326",
     )
-    joined = geopandas.sjoin(
-        gdf,
-        tracts.rename(columns={"geoid10": "GEOID"})[["GEOID", "geometry"]],
-        op="within",
-        how="left",
-    ).drop(columns=["index_right"])
+    joined["GEOID"] = pandas.Series(tracts.GEOID.values, dtype="object").reindex(
+        tract_idx
+    ).values
 
     print("Columns in final df")
     print(list(joined.columns))
-    return joined
+    return joined, coords
     
 
 if __name__ == "__main__":
     import sys
     import s3fs
     
-    df = main(sys.argv[1])
+    df, coords = main(sys.argv[1])
     print("Uploading file to s3")
     fs = s3fs.S3FileSystem()
     df.to_parquet(f"s3://{bucket_name}/gis/intermediate/lacounty_parcels.parquet", 
             filesystem=fs)
+
+    # Most consumers only need the location of each parcel,
+    # so also save a slim file without the geometry and attributes.
+    print("Uploading parcel centroids to s3")
+    pandas.DataFrame(df.reset_index()[CENTROID_COLUMNS]).to_parquet(
+        f"s3://{bucket_name}/gis/intermediate/lacounty_parcel_centroids.parquet",
+        index=False,
+        filesystem=fs,
+    )
+
+    # Save the centroids projected to the canonical CRS, in the same
+    # order as the parcel files, so later joins don't have to reproject them.
+    with fs.open(
+        f"s3://{bucket_name}/gis/intermediate/lacounty_parcel_coords.npy", "wb"
+    ) as f:
+        laplan.spatial.save_points(f, coords)
@@ -14,15 +14,12 @@ Included:
         tracts and what % of parcels are TOC-eligible
         clip crosswalk to City of LA
 """
-import boto3
 import geopandas as gpd
 import intake
+import laplan
 import numpy as np
-import os
 import pandas as pd
-import uuid
 
-s3 = boto3.client('s3')
 catalog = intake.open_catalog("./catalogs/*.yml")
 bucket_name = 'city-planning-entitlements'
 
@@ -31,69 +28,46 @@ bucket_name = 'city-planning-entitlements'
 ## Tag duplicate parcel geometries
 #------------------------------------------------------------------------#
 def tag_duplicate_parcels():
-    # Download geoparquet
-    file_name = "lacounty_parcels"
-    
-    s3.download_file(bucket_name, 
-                        f"gis/intermediate/{file_name}.parquet", 
-                        f'{file_name}.parquet')
-    
-    parcels = gpd.read_parquet(f'{file_name}.parquet')
-    os.remove(f'{file_name}.parquet')
-
-    # Keep columns needed for crosswalk
+    # Import the slim parcel centroids, which only has the 
+    # columns needed for crosswalk
     keep = ["AIN", "GEOID", "CENTER_LAT", "CENTER_LON"]
 
-    parcels = (parcels.reset_index()
-            [keep]
+    parcels = pd.read_parquet(
+        f"s3://{bucket_name}/gis/intermediate/lacounty_parcel_centroids.parquet", 
+        columns = keep)
+
+    parcels = (parcels
             .dropna(subset = ["CENTER_LAT", "CENTER_LON"])
             .reset_index(drop=True)
     )
 
-    # Assign the X, Y points as strings, so we correctly identify duplicates
-    parcels2 = parcels.assign(
-                x = parcels.CENTER_LON.round(decimals=7).astype("str"),
-                y = parcels.CENTER_LAT.round(decimals=7).astype("str"),
-    )
+    # Number the AINs that have same lat/lon for centroids,
+    # compared at laplan.parcels.COORD_SCALE
+    x, y, uuid = laplan.parcels.centroid_groups(
+        parcels.CENTER_LON.values, parcels.CENTER_LAT.values)
 
-    duplicate_geom = (parcels2.groupby(['x', 'y'])
-                    .agg({'AIN':'count'})
-                    .reset_index()
-                    .rename(columns = {'AIN':'num_AIN'})
+    parcels2 = parcels.assign(
+        x = x,
+        y = y,
+        num_AIN = np.bincount(uuid)[uuid],
+        uuid = uuid,
     )
 
-    # Create a uuid for all the AINs that have same lat/lon for centroids.
-    duplicate_geom['uuid'] = [str(uuid.uuid4()) for x in range(len(duplicate_geom.index))]
-
-
-    parcels3 = pd.merge(parcels2, duplicate_geom, 
-                    on = ['x', 'y'], how = 'left', validate = 'm:1')
-    
     # Count total number of parcels within tract
-    counts_by_tract = (parcels3.drop_duplicates(subset = ["uuid", "GEOID"], 
-                        keep = "first")
-                        .groupby("GEOID")
-                        .agg({"AIN":"count"})
-                        .reset_index()
-                        .rename(columns = {"AIN": "total_AIN"})
+    parcels3 = parcels2.assign(
+        total_AIN = parcels2.groupby("GEOID")["uuid"].transform("nunique")
     )
 
-    parcels4 = pd.merge(parcels3, counts_by_tract, on = "GEOID", 
-                how = "left", validate = "m:1")    
-    
     # Data type conversions
     integrify_me = ["num_AIN", "total_AIN"]
-    parcels4[integrify_me] = parcels4[integrify_me].astype("Int64")
+    parcels3[integrify_me] = parcels3[integrify_me].astype("Int64")
 
     stringme = ["AIN"]
-    parcels4[stringme] = parcels4[stringme].astype("str")
+    parcels3[stringme] = parcels3[stringme].astype("str")
 
-    back_to_floats = ["x", "y"]
-    parcels4[back_to_floats] = parcels4[back_to_floats].astype(float)
+    parcels3 = parcels3[parcels3.GEOID.notna()]
 
-    parcels4 = parcels4[parcels4.GEOID.notna()]
-
-    return parcels4
+    return parcels3
 
 
 #------------------------------------------------------------------------#
@@ -101,10 +75,9 @@ def tag_duplicate_parcels():
 #------------------------------------------------------------------------#
 def tag_toc_eligible_tracts(crosswalk_parcels_tracts):
     # Import full list of toc_parcels
-    toc_parcels = (gpd.read_file(
-        f'zip+s3://{bucket_name}/gis/intermediate/TOC_Parcels.zip')
-        [["AIN", "TOC_Tier"]]
-    )
+    toc_parcels = pd.read_parquet(
+        f's3://{bucket_name}/gis/intermediate/TOC_Parcels.parquet', 
+        columns = ["AIN", "TOC_Tier"])
 
     # Merge onto crosswalk
     crosswalk_parcels_tracts = pd.merge(crosswalk_parcels_tracts, 
@@ -128,47 +101,25 @@ def tag_toc_eligible_tracts(crosswalk_parcels_tracts):
         )
     
     # Tag if the parcel counts as in TOC tier or not
-    df = df.assign(
-        in_tier = df.apply(lambda x: 1 if x.TOC_Tier != 0 else 0, axis=1)
-    )
+    df = df.assign(in_tier = (df.TOC_Tier != 0).astype(int))
 
-    # Aggregate by in_tier 
-    df2 = (df.groupby(["GEOID", "total_AIN", "in_tier"])
-          .agg({"num_AIN": "count"})
-          .reset_index()
-         )
-    
-    # If GEOID has 2 observations, one in_tier==1 and other in_tier==0, 
-    # let's keep the in_tier==1
-    df2["obs"] = df2.groupby("GEOID").cumcount() + 1
-    df2["max_obs"] = df2.groupby("GEOID")["obs"].transform("max")
-    
-    df3 = (df2[(df2.max_obs == 1) | 
-             ((df2.in_tier == 1) & (df2.max_obs == 2))]
-          .drop(columns = ["obs", "max_obs"])
-         )
-        
-    # Calculate the % of AIN that falls within TOC tiers    
-    df3 = (df3.assign(
-            pct_toc_AIN = df3.apply(
-                lambda x: x.num_AIN / x.total_AIN if x.in_tier==1
-                else 0, axis=1)
-        ).sort_values("GEOID")
-        .reset_index(drop=True)
+    # Count the parcels within TOC tiers in each tract, in one pass
+    by_tract = df.groupby("GEOID").agg(
+        total_AIN = ("total_AIN", "first"),
+        in_tier_AIN = ("in_tier", "sum"),
     )
 
-    df4 = df3.assign(
-        toc_AIN = df3.apply(lambda x: 1 if (
-                            (x.in_tier == 1) and (x.pct_toc_AIN >= 0.5)
-                            ) 
-                            else 0, axis=1)
+    # Calculate the % of AIN that falls within TOC tiers,
+    # and tag tracts where at least half of the AIN are in TOC tiers
+    pct_toc_AIN = by_tract.in_tier_AIN / by_tract.total_AIN.astype(float)
+    toc_AIN = (pct_toc_AIN >= 0.5).astype(int)
+
+    # Broadcast these new TOC columns back onto original crosswalk
+    df5 = crosswalk_parcels_tracts.assign(
+        pct_toc_AIN = crosswalk_parcels_tracts.GEOID.map(pct_toc_AIN),
+        toc_AIN = crosswalk_parcels_tracts.GEOID.map(toc_AIN),
     )
-    
-    # Merge these new TOC columns back onto original crosswalk
-    df5 = pd.merge(crosswalk_parcels_tracts, 
-                df4[["GEOID", "pct_toc_AIN", "toc_AIN"]], 
-                on = "GEOID", how = "left", validate = "m:1")
-    
+
 
     keep_cols = ["uuid", "AIN",  "x", "y", "num_AIN", "TOC_Tier", 
                 "GEOID", "total_AIN", "pct_toc_AIN", "toc_AIN"]
@@ -6,6 +6,7 @@ Included: TOC Tiers
 import boto3
 import geopandas as gpd
 import intake
+import laplan
 import numpy as np
 import pandas as pd
 import utils
@@ -19,6 +20,8 @@ bucket_name = 'city-planning-entitlements'
 #------------------------------------------------------------------------#
 ## TOC Tiers shapefile
 #------------------------------------------------------------------------#
+time0 = datetime.now()
+
 gdf = catalog.toc_tiers.read()
 
 gdf = gdf.drop(columns = ['Shape_Leng', 'Shape_Area'])
@@ -37,8 +40,18 @@ print(f'Upload TOC Tiers shapefile to S3: {time1 - time0}')
 # Upload City Planning's version of TOC parcels
 parcels = catalog.parcels2014.read().to_crs("EPSG:2229")
 
+# Explode the tier multipolygons into single polygons, so that each
+# piece gets its own bounding box in the spatial index. 
+# Register the tiers with laplan.spatial, which projects them to the 
+# same CRS as the parcels (EPSG:2229) and builds the spatial index once
 tiers = gpd.read_file(f's3://{bucket_name}/gis/raw/TOC_Tiers.geojson')
 
+tiers = laplan.spatial.register_layer("toc_tiers", 
+        tiers.assign(TOC_Tier = tiers.TOC_Tier.fillna(0).astype(int))
+            [["TOC_Tier", "geometry"]]
+            .explode()
+)
+
 toc_parcels = catalog.toc_parcels_raw.read()
 
 toc_parcels = (toc_parcels[toc_parcels.BPP != ""][['BPP']]
@@ -52,27 +65,27 @@ toc_parcels = pd.merge(parcels, toc_parcels, how = 'inner', validate = '1:1')
 # Doing a spatial join between parcels and TOC tiers is consuming, 
 # because TOC tiers are multipolygons.
 # Let's use the centroid of the parcel instead and do a spatial join on that.
-toc_parcels = (toc_parcels.assign(
-        centroid = toc_parcels.geometry.centroid
-    ).set_geometry('centroid')
-)
+centroids = toc_parcels.geometry.centroid
+coords = np.column_stack([centroids.x.values, centroids.y.values])
+
+# Spatial join with tiers, in one bulk query of the tiers' spatial index
+point_idx, tier_idx = laplan.spatial.lookup("toc_tiers", coords, 
+                        predicate = "intersects")
 
-# Spatial join with tiers
-toc_parcels2 = gpd.sjoin(toc_parcels, tiers, how = 'left', op = 'intersects')
+# Parcels outside of the tiers are tier 0. 
+# If a centroid falls in more than one tier, keep the highest.
+toc_tier = np.zeros(len(toc_parcels), dtype = int)
+np.maximum.at(toc_tier, point_idx, tiers.TOC_Tier.values[tier_idx])
 
 keep = ['AIN', 'TOC_Tier', 'geometry']
-toc_parcels2 = (toc_parcels2.set_geometry('geometry')
-    .assign(
-        TOC_Tier = toc_parcels2.TOC_Tier.fillna(0).astype(int)
-    )[keep]
+toc_parcels2 = (toc_parcels.assign(TOC_Tier = toc_tier)
+    [keep]
+    .reset_index(drop=True)
 )
 
-# Zip the shapefile and upload to S3
-file_name = "TOC_Parcels"
-
-utils.make_zipped_shapefile(toc_parcels2, f'./gis/intermediate/{file_name}')
-s3.upload_file(f'./gis/intermediate/{file_name}.zip', 
-                bucket_name, f'gis/intermediate/{file_name}.zip')
+# Upload geoparquet to S3
+utils.upload_geoparquet(toc_parcels2, file_name = "TOC_Parcels.parquet", 
+                        S3_path = "gis/intermediate/")
 
 time2 = datetime.now()
 print(f'Upload TOC eligible parcels to S3: {time2 - time1}')
@@ -1,23 +1,70 @@
 """
 Make a master PCTS file.
+
+By default the master file is rebuilt from the whole PCTS backup.
+With --incremental, only the cases touched by the changes logged by
+`A1_load_pcts.py --incremental` since the last build are rebuilt, and
+merged into the partitioned PCTS dataset.
+
+The index of the master file by prefix, suffix and file date, and the
+entitlement cube, which counts the entitlements of each case by tract
+and year, are rebuilt or updated along with the dataset.
 """ 
+import argparse
+import contextlib
+import json
 import os
 
 import intake
+import laplan
 import pandas
+import pyarrow
+import pyarrow.parquet
+import s3fs
 import sqlalchemy
 
 catalog = intake.open_catalog("../catalogs/*.yml")
 bucket = 'city-planning-entitlements'
 
-# Download the PCTS sqlite backup from S3, since
-# SQlite doesn't support reading directly from cloud storage.
-# Eventually to be replaced with a live copy.
-if not os.path.exists("PCTS.sqlite"):
-    import s3fs
-    fs = s3fs.S3FileSystem()
-    fs.download("s3://city-planning-entitlements/PCTS.sqlite", "PCTS.sqlite")
-engine = sqlalchemy.create_engine("sqlite:///PCTS.sqlite")
+# The master PCTS file, and the same data as a dataset partitioned by the
+# year of FILE_DATE, which can be updated one year at a time.
+MASTER_PATH = f"{bucket}/data/final/pcts.parquet"
+DATASET_PATH = f"{bucket}/data/final/pcts"
+PARTITION_COL = "FILE_YEAR"
+# Indexes of the rows of the master file by prefix, suffix and file date,
+# and by the words of their project descriptions.
+INDEX_PATH = f"{bucket}/data/final/pcts_index.npz"
+DESCRIPTION_INDEX_PATH = f"{bucket}/data/final/pcts_description_index.npz"
+# Entitlements of each case by tract and year, see laplan.pcts.entitlement_counts.
+CUBE_PATH = f"{bucket}/data/final/pcts_entitlement_cube.parquet"
+# The time of the last change in pcts_changes included in the dataset.
+STATE_PATH = f"{bucket}/data/final/pcts_refresh_state.json"
+
+# Number of rows of the master query to hold in memory at a time.
+CHUNK = 250_000
+
+# Maximum rows per parquet row group. The rows are sorted by FILE_DATE,
+# so smaller row groups have tighter date statistics, which lets readers
+# skip the row groups outside of the date range they filter on.
+ROW_GROUP_SIZE = 50_000
+
+# Final dtypes of the master PCTS data.
+DTYPES = {
+    "CASE_ID": "Int64",
+    "FILE_DATE": "datetime64[ns]",
+    "APPLICATION_ID": "Int64",
+    "CASE_SEQUENCE_NUMBER": "Int64",
+    "CASE_YEAR_NUMBER": "Int64",
+    "PARENT_CASE_ID": "Int64",
+    "CASE_ACTION_ID": "Int64",
+    "PLAN_AREA": "Int64",
+    "APPEAL_HEARING_DATE": "datetime64[ns]",
+    "APPEAL_DECISION_DATE": "datetime64[ns]",
+    "UNITS": "Int64",
+}
+# The parquet types of the dtypes above. The other columns of the master
+# query are all text in PCTS, and are stored as strings.
+ARROW_TYPES = {"Int64": pyarrow.int64(), "datetime64[ns]": pyarrow.timestamp("ns")}
 
 # Here we use a query derived from one used by the PCTS reporting module.
 # That query joins a number of tables which we don't have in our backup,
@@ -26,8 +73,9 @@ engine = sqlalchemy.create_engine("sqlite:///PCTS.sqlite")
 # We adapt by doing the following:
 #    1. Only join application, location, and la_prop tables. We don't join with
 #       GEO_INFO, as it seems to be missing important rows.
-#    2. Replace the outer joins with the appeals table by one done with pandas,
-#       since SQLite doesn't support outer joins.
+#    2. Replace the outer joins with the appeals table by a left join,
+#       since SQLite doesn't support full outer joins. The original query
+#       only keeps rows with a case number, so this is equivalent.
 #    3. Include some more location data, such as AIN, council district,
 #       plan area number, etc. Notably, we don't include census tract, since we
 #       derive census tract via our own means.
@@ -58,45 +106,350 @@ FROM tCASE CC
         INNER JOIN tLOC LL ON LC.APLC_ID=LL.APLC_ID
         INNER JOIN tLA_PROP PP on LL.LOC_ID=PP.PROP_ID
 """
-pcts = pandas.read_sql(sql, engine)
-
-# The original query makes an outer join with the appeals table.
-# Our current backup uses sqlite, which doesn't support full outer joins.
-# Instead, we read the table into pandas and make the outer join there.
-# We also drop null CASE_NUMBERs after the join, effectively making it
-# a left join, but we are endeavoring to keep close to the original query.
-appeals = pandas.read_sql_table("tAPEL_CASE", engine)
-pcts = pandas.merge(
-    pcts,
-    appeals[["CASE_ID", "BZA_PUBLC_HEAR_DT", "BZA_DECISN_DT"]].rename(
-        columns={"BZA_PUBLC_HEAR_DT": "APPEAL_HEARING_DATE", "BZA_DECISN_DT": "APPEAL_DECISION_DATE"}
-    ),
-    on="CASE_ID",
-    how="outer",
-).dropna(subset=["CASE_NUMBER"])
-
-# Merge in census tract data
-parcel_to_tract = catalog.crosswalk_parcels_tracts.read()[["GEOID", "AIN"]]
-pcts = pandas.merge(
-    pcts,
-    parcel_to_tract,
-    on="AIN",
-    how="inner",
-    validate="m:1",
-)
-    
-# Fix up some dtypes, sort, and reset the index
-# in preparation for export to parquet.
-pcts = pcts.astype({
-    "CASE_ID": "Int64",
-    "FILE_DATE": "datetime64[ns]",
-    "APPLICATION_ID": "Int64",
-    "CASE_SEQUENCE_NUMBER": "Int64",
-    "CASE_YEAR_NUMBER": "Int64",
-    "PARENT_CASE_ID": "Int64",
-    "CASE_ACTION_ID": "Int64",
-    "PLAN_AREA": "Int64",
-}).sort_values(["FILE_DATE", "CASE_ID", "AIN"]).reset_index(drop=True)
 
-# Upload to s3.
-pcts.to_parquet(f"s3://{bucket}/data/final/pcts.parquet")
\ No newline at end of file
+# Join the appeals and the census tract of each parcel onto the cases.
+# The parcel to tract crosswalk is staged in the DB by stage_crosswalk.
+master_sql = f"""
+SELECT
+        PCTS.*,
+        AP.BZA_PUBLC_HEAR_DT AS APPEAL_HEARING_DATE,
+        AP.BZA_DECISN_DT AS APPEAL_DECISION_DATE,
+        XW.GEOID AS GEOID
+FROM ({sql}) PCTS
+        LEFT JOIN tAPEL_CASE AP ON PCTS.CASE_ID=AP.CASE_ID
+        INNER JOIN pcts_crosswalk_parcels_tracts XW ON PCTS.AIN=XW.AIN
+WHERE PCTS.CASE_NUMBER IS NOT NULL
+"""
+master_order = """
+ORDER BY PCTS.FILE_DATE IS NULL, PCTS.FILE_DATE, PCTS.CASE_ID, PCTS.AIN
+"""
+
+# The cases touched by the changes logged since a given time. Changes to cases
+# and applications (and the locations they lost or gained) carry the application
+# ID, while changed properties are traced back through their locations.
+changed_cases_sql = """
+SELECT pk AS CASE_ID FROM pcts_changes
+    WHERE table_name = 'tCASE' AND refreshed_at > :since
+UNION
+SELECT CC.CASE_ID FROM tCASE CC
+    WHERE CC.APLC_ID IN (
+        SELECT aplc_id FROM pcts_changes
+            WHERE aplc_id IS NOT NULL AND refreshed_at > :since
+        UNION
+        SELECT LL.APLC_ID FROM pcts_changes CH
+            INNER JOIN tLOC LL ON CH.pk=LL.LOC_ID
+            WHERE CH.table_name = 'tLA_PROP' AND CH.refreshed_at > :since
+    )
+"""
+
+
+def stage_crosswalk(engine):
+    """
+    Load the parcel to census tract crosswalk into a staging table,
+    so that it can be joined in the master query. The unique index
+    makes sure each parcel belongs to a single tract.
+    """
+    parcel_to_tract = catalog.crosswalk_parcels_tracts(columns=["GEOID", "AIN"]).read()
+    parcel_to_tract.to_sql(
+        "pcts_crosswalk_parcels_tracts", engine, if_exists="replace", index=False
+    )
+    engine.execute(
+        "CREATE UNIQUE INDEX ix_pcts_crosswalk_parcels_tracts "
+        "ON pcts_crosswalk_parcels_tracts (AIN)"
+    )
+
+
+def master_chunks(engine, case_ids=None, chunksize=CHUNK):
+    """
+    Run the master PCTS query, yielding the results in chunks with their
+    final dtypes, sorted by FILE_DATE, CASE_ID, and AIN.
+    stage_crosswalk must have been run first.
+
+    Parameters
+    ==========
+
+    engine: sqlalchemy.engine.Engine
+        The PCTS database.
+
+    case_ids: list of ints
+        Optionally restrict the build to these cases.
+
+    chunksize: int
+        The number of rows per chunk.
+    """
+    query = master_sql
+    if case_ids is not None:
+        # Stage the requested cases in the DB rather than
+        # sending a giant IN clause.
+        pandas.DataFrame({"CASE_ID": case_ids}).to_sql(
+            "pcts_refresh_cases", engine, if_exists="replace", index=False
+        )
+        query += "AND PCTS.CASE_ID IN (SELECT CASE_ID FROM pcts_refresh_cases)"
+
+    empty = True
+    for chunk in pandas.read_sql(query + master_order, engine, chunksize=chunksize):
+        empty = False
+        yield with_units(chunk).astype(DTYPES)
+    if empty:
+        # Still yield an empty frame, so the columns are known.
+        yield with_units(pandas.read_sql(query + "LIMIT 0", engine)).astype(DTYPES)
+
+
+def with_units(pcts):
+    """
+    Add the number of units given in the project description of each case.
+    """
+    return pcts.assign(
+        UNITS=laplan.pcts.extract_units(pcts.PROJECT_DESCRIPTION.astype("object"))
+    )
+
+
+def arrow_schema(chunk):
+    """
+    The parquet schema of the master file, with the columns of a chunk.
+    The types come from DTYPES rather than from the data, in which a column
+    could be entirely null in the first chunk. The pandas metadata is kept,
+    so that the nullable integers are read back as such.
+    """
+    fields = [
+        pyarrow.field(c, ARROW_TYPES[DTYPES[c]] if c in DTYPES else pyarrow.string())
+        for c in chunk.columns
+    ]
+    metadata = pyarrow.Schema.from_pandas(chunk.head(0), preserve_index=False).metadata
+    return pyarrow.schema(fields, metadata=metadata)
+
+
+def to_arrow(df, schema):
+    return pyarrow.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+@contextlib.contextmanager
+def parquet_writer(fs, path, schema):
+    """
+    Open a parquet writer on S3, to which tables can be appended
+    one row group at a time.
+    """
+    with fs.open(path, "wb") as f:
+        writer = pyarrow.parquet.ParquetWriter(f, schema)
+        try:
+            yield writer
+        finally:
+            writer.close()
+
+
+def file_years(pcts):
+    """
+    The partition of each row. Cases without a file date go in year 0.
+    """
+    return pcts.FILE_DATE.dt.year.fillna(0).astype(int)
+
+
+def partition_path(year):
+    return f"{DATASET_PATH}/{PARTITION_COL}={year}"
+
+
+def write_master(fs, chunks, dataset=True):
+    """
+    Stream chunks of master PCTS data into the master file and, optionally,
+    the partitioned dataset, returning the number of rows written.
+
+    The rows arrive sorted by FILE_DATE, so the year partitions are written
+    one after another, and only one chunk is held in memory at a time.
+    """
+    if dataset and fs.exists(DATASET_PATH):
+        fs.rm(DATASET_PATH, recursive=True)
+
+    nrows = 0
+    schema = None
+    year = None
+    with contextlib.ExitStack() as stack, contextlib.ExitStack() as partition_stack:
+        for chunk in chunks:
+            if schema is None:
+                schema = arrow_schema(chunk)
+                master = stack.enter_context(parquet_writer(fs, MASTER_PATH, schema))
+            master.write_table(to_arrow(chunk, schema), ROW_GROUP_SIZE)
+            nrows += len(chunk)
+            if not dataset:
+                continue
+
+            years = file_years(chunk)
+            for chunk_year in years.unique():
+                if chunk_year != year:
+                    # Close out the previous year and start the next one.
+                    partition_stack.close()
+                    year = chunk_year
+                    partition = partition_stack.enter_context(
+                        parquet_writer(
+                            fs, f"{partition_path(year)}/part-0.parquet", schema
+                        )
+                    )
+                partition.write_table(
+                    to_arrow(chunk[years == year], schema), ROW_GROUP_SIZE
+                )
+
+    print(f"Wrote {nrows} rows of master PCTS data")
+    return nrows
+
+
+def write_partition(fs, pcts, year, schema):
+    """
+    Replace one year of the partitioned PCTS dataset.
+    """
+    path = partition_path(year)
+    if fs.exists(path):
+        fs.rm(path, recursive=True)
+    if len(pcts):
+        with parquet_writer(fs, f"{path}/part-0.parquet", schema) as writer:
+            writer.write_table(to_arrow(pcts, schema), ROW_GROUP_SIZE)
+
+
+def read_partitions(fs):
+    """
+    Read the partitioned dataset back one year at a time, in the
+    same order as the master file.
+    """
+    years = sorted(
+        int(os.path.basename(p).split("=")[1])
+        for p in fs.ls(DATASET_PATH)
+        if os.path.basename(p).startswith(f"{PARTITION_COL}=")
+    )
+    for year in [y for y in years if y != 0] + [y for y in years if y == 0]:
+        yield pandas.read_parquet(f"s3://{partition_path(year)}/part-0.parquet")
+
+
+def merge_into_dataset(fs, pcts, case_ids):
+    """
+    Merge rebuilt cases into the partitioned PCTS dataset. Every partition
+    which holds an old version of one of the cases, or receives a new one,
+    is rewritten.
+
+    Parameters
+    ==========
+
+    pcts: pandas.DataFrame
+        The rebuilt master PCTS data for the changed cases.
+
+    case_ids: list of ints
+        All of the changed cases, including deleted ones.
+    """
+    with fs.open(MASTER_PATH, "rb") as f:
+        schema = pyarrow.parquet.ParquetFile(f).schema_arrow
+    case_years = pandas.read_parquet(
+        f"s3://{DATASET_PATH}", columns=["CASE_ID", PARTITION_COL]
+    )
+    old_years = case_years[case_years.CASE_ID.isin(case_ids)][PARTITION_COL]
+    new_years = file_years(pcts)
+    for year in sorted(set(old_years.astype(int)) | set(new_years)):
+        path = f"{partition_path(year)}/part-0.parquet"
+        old = pandas.read_parquet(f"s3://{path}") if fs.exists(path) else pcts.iloc[:0]
+        partition = (
+            pandas.concat(
+                [old[~old.CASE_ID.isin(case_ids)], pcts[new_years == year]],
+                ignore_index=True,
+            )
+            .sort_values(["FILE_DATE", "CASE_ID", "AIN"])
+            .reset_index(drop=True)
+        )
+        print(f"Rewriting {PARTITION_COL}={year} with {len(partition)} rows")
+        write_partition(fs, partition, year, schema)
+
+
+def write_index(fs):
+    """
+    Index the master file, whose rows the indexes refer to by position.
+    """
+    pcts = pandas.read_parquet(
+        f"s3://{MASTER_PATH}",
+        columns=["CASE_NUMBER", "FILE_DATE", "PROJECT_DESCRIPTION"],
+    )
+    with fs.open(INDEX_PATH, "wb") as f:
+        laplan.pcts.PCTSIndex.build(pcts).save(f)
+    with fs.open(DESCRIPTION_INDEX_PATH, "wb") as f:
+        laplan.pcts.DescriptionIndex.build(pcts.PROJECT_DESCRIPTION).save(f)
+
+
+def build_cube(fs):
+    """
+    Build the entitlement cube from the partitioned dataset, one year at a time.
+    Each case is filed in a single year, so the years are independent.
+    """
+    return pandas.concat(
+        [laplan.pcts.build_entitlement_cube(pcts) for pcts in read_partitions(fs)],
+        ignore_index=True,
+    )
+
+
+def write_cube(fs, cube):
+    with fs.open(CUBE_PATH, "wb") as f:
+        cube.to_parquet(f, engine="pyarrow", index=False)
+    print(f"Wrote {len(cube)} rows of the entitlement cube")
+
+
+def last_change(engine):
+    """
+    The time of the most recent change logged by an incremental PCTS load,
+    or None if the DB has never been incrementally refreshed.
+    """
+    if not engine.has_table("pcts_changes"):
+        return None
+    return engine.execute("SELECT MAX(refreshed_at) FROM pcts_changes").scalar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make a master PCTS file.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only rebuild the cases which changed since the last build",
+    )
+    args = parser.parse_args()
+
+    # Download the PCTS sqlite backup from S3, since
+    # SQlite doesn't support reading directly from cloud storage.
+    # Eventually to be replaced with a live copy.
+    fs = s3fs.S3FileSystem()
+    if not os.path.exists("PCTS.sqlite"):
+        fs.download("s3://city-planning-entitlements/PCTS.sqlite", "PCTS.sqlite")
+    engine = sqlalchemy.create_engine("sqlite:///PCTS.sqlite")
+    stage_crosswalk(engine)
+
+    if args.incremental and fs.exists(STATE_PATH):
+        with fs.open(STATE_PATH, "r") as f:
+            since = json.load(f)["refreshed_at"]
+        changed_cases = sqlalchemy.text(changed_cases_sql).bindparams(
+            sqlalchemy.bindparam("since", type_=sqlalchemy.DateTime)
+        )
+        case_ids = [
+            r.CASE_ID
+            for r in engine.execute(
+                changed_cases, since=pandas.to_datetime(since).to_pydatetime()
+            )
+        ]
+        print(f"Rebuilding {len(case_ids)} changed cases")
+        if case_ids:
+            pcts = pandas.concat(master_chunks(engine, case_ids), ignore_index=True)
+            merge_into_dataset(fs, pcts, case_ids)
+
+            # Keep the master file in sync with the dataset.
+            write_master(fs, read_partitions(fs), dataset=False)
+            write_index(fs)
+
+            if fs.exists(CUBE_PATH):
+                cube = laplan.pcts.update_entitlement_cube(
+                    pandas.read_parquet(f"s3://{CUBE_PATH}"), pcts, case_ids
+                )
+            else:
+                cube = build_cube(fs)
+            write_cube(fs, cube)
+    else:
+        if args.incremental:
+            print("No previous build of the PCTS dataset found, rebuilding it")
+        write_master(fs, master_chunks(engine))
+        write_index(fs)
+        write_cube(fs, build_cube(fs))
+
+    # Record how far into the change log this build goes.
+    refreshed_at = last_change(engine)
+    if refreshed_at is not None:
+        with fs.open(STATE_PATH, "w") as f:
+            json.dump({"refreshed_at": pandas.Timestamp(refreshed_at).isoformat()}, f)
@@ -4,11 +4,19 @@ Included:
         crosswalks for zoning and PCTS parsers,
         crosswalk for parcels to tracts,
         crosswalk for parcels that are RSO units,
-        crosswalk for tracts and % of AIN that belong to each zone_class
+        crosswalk for tracts and % of AIN that belong to each zone_class,
+        parcel store of the parcel attributes used by later stages
 """
+import argparse
 import boto3
 import geopandas as gpd
+import laplan
+import numpy as np
+import os
 import pandas as pd
+import s3fs
+import scipy.sparse
+import tempfile
 import utils
 
 from datetime import datetime
@@ -16,6 +24,24 @@ from datetime import datetime
 s3 = boto3.client('s3')
 bucket_name = 'city-planning-entitlements'
 
+# Width of the tiles the zone_class coverage is cut into, 
+# in the units of laplan.spatial.CANONICAL_CRS (feet)
+ZONE_TILE_SIZE = 5280
+# Parcels closer than this (in feet) to an edge of the coverage are
+# checked against the raw zoning instead, because dissolving and tiling
+# can move edges by a tiny amount.
+ZONE_TOLERANCE = 0.01
+
+# The laplan.parcels.ParcelStore of parcel attributes
+PARCEL_STORE_PATH = f"{bucket_name}/gis/intermediate/parcel_store"
+
+parser = argparse.ArgumentParser(description = "Create and store crosswalk files.")
+parser.add_argument("--verify", action = "store_true",
+    help = "Check the parcel to zone_class join against the raw zoning, and time both.")
+parser.add_argument("--refresh-zoning", action = "store_true",
+    help = "Rebuild the cached zone_class coverage.")
+args = parser.parse_args()
+
 #------------------------------------------------------------------------#
 ## Zoning Parser
 #------------------------------------------------------------------------#
@@ -77,13 +103,109 @@ df[keep_cols].to_parquet(f's3://{bucket_name}/data/crosswalk_parcels_rso.parquet
 #------------------------------------------------------------------------#
 ## APNs with zone class
 #------------------------------------------------------------------------#
-def join_parcels_to_zones():
+def read_zoning():
+    zoning = gpd.read_file(f"zip+s3://{bucket_name}/gis/raw/parsed_zoning.zip")
+    return zoning[["zone_class", "geometry"]].to_crs(laplan.spatial.CANONICAL_CRS)
+
+
+def zoning_fragments(refresh = False):
+    """
+    The raw zoning polygons, cached locally after the first run.
+    """
+    return laplan.spatial.cached_polygons("zoning_fragments", read_zoning, 
+                                            refresh = refresh)
+
+
+def zone_class_coverage(tile_size = ZONE_TILE_SIZE, simplify = None, refresh = False):
+    """
+    Dissolve zoning by zone_class and cut it into square tiles.
+    The raw zoning has many thousands of small fragments, so the
+    coverage has a much smaller spatial index with fewer candidates per parcel.
+    It is cached locally after the first run.
+
+    Parameters
+    ==========
+
+    tile_size: float, width of the tiles in feet.
+    simplify: float, tolerance in feet to simplify the coverage with. 
+            Defaults to None, which keeps the exact geometry, so the 
+            join gives the same results as the raw zoning.
+    refresh: bool, rebuild the coverage, e.g. after parsed_zoning changes.
+    """
+    def make_coverage():
+        zoning = zoning_fragments(refresh = refresh)
+        # Dissolve on a string key, so that a missing zone_class 
+        # keeps its own polygons
+        coverage = (zoning.assign(key = zoning.zone_class.astype(str))
+                    .dissolve(by = "key", aggfunc = "first")
+                    .reset_index(drop=True)
+        )
+        if simplify:
+            coverage = coverage.assign(
+                geometry = coverage.geometry.simplify(simplify))
+        return laplan.spatial.tile_polygons(coverage, tile_size)
+    
+    name = f"zone_class_coverage_{tile_size}"
+    if simplify:
+        name = f"{name}_simplify_{simplify}"
+    
+    return laplan.spatial.cached_polygons(name, make_coverage, refresh = refresh)
+
+
+def join_zone_class(parcel_geom, coords, layer_name, fallback_name = None):
+    """
+    Join parcel centroids to a registered zone_class layer,
+    keeping one row for each parcel and zone_class it intersects.
+
+    If fallback_name is given, parcels within ZONE_TOLERANCE of an edge
+    of the layer's polygons are joined to the fallback layer instead.
+    The edges must be registered as f"{layer_name}_edges".
+    """
+    layer_zone_class = laplan.spatial.get_layer(layer_name).zone_class.values
+    parcel_idx, zone_idx = laplan.spatial.lookup(layer_name, coords, 
+                            predicate = "intersects")
+    zone_class = layer_zone_class[zone_idx]
+
+    if fallback_name is not None:
+        near_edge = np.zeros(len(coords), dtype = bool)
+        edge_idx, _ = laplan.spatial.lookup(f"{layer_name}_edges", coords, 
+                        predicate = "intersects", tolerance = ZONE_TOLERANCE)
+        near_edge[edge_idx] = True
+
+        # Parcels near an edge are checked against the fallback
+        settled = ~near_edge[parcel_idx]
+        unsettled = np.flatnonzero(near_edge)
+        fallback_idx, fallback_zone = laplan.spatial.lookup(fallback_name, 
+                        coords[unsettled], predicate = "intersects")
+        fallback_zone_class = laplan.spatial.get_layer(fallback_name).zone_class.values
+
+        parcel_idx = np.concatenate([parcel_idx[settled], unsettled[fallback_idx]])
+        zone_class = np.concatenate([zone_class[settled], 
+                                    fallback_zone_class[fallback_zone]])
+
+    pairs = (pd.DataFrame({"parcel": parcel_idx, "zone_class": zone_class})
+            .drop_duplicates()
+            .sort_values(["parcel", "zone_class"], kind = "mergesort")
+    )
+
+    return (parcel_geom.iloc[pairs.parcel.values]
+            .assign(zone_class = pairs.zone_class.values)
+    )
+
+
+def join_parcels_to_zones(verify = False, refresh_zoning = False):
     # (1) Import zoning, dissolve by zone_class (which is more specific than zone_summary)
     time0 = datetime.now()
     print("Start join_parcels_to_zones")
 
-    zoning = gpd.read_file(f"zip+s3://{bucket_name}/gis/raw/parsed_zoning.zip")
-    zone_class = zoning[["zone_class", "geometry"]]
+    # Register the coverage and raw zoning with laplan.spatial, 
+    # which builds the spatial indexes once
+    coverage = laplan.spatial.register_layer("zone_class", 
+                    zone_class_coverage(refresh = refresh_zoning))
+    laplan.spatial.register_layer("zone_class_edges", 
+                    coverage.assign(geometry = coverage.boundary), crs = None)
+    fragments = laplan.spatial.register_layer("zone_class_fragments", 
+                    zoning_fragments())
 
     time1 = datetime.now()
     print(f'Read in zoning and dissolve: {time1 - time0}')
@@ -101,13 +223,23 @@ def join_parcels_to_zones():
     time2 = datetime.now()
     print(f'Read in parcels and grab centroids: {time2 - time1}')
 
-    # (3) Spatial join between parcel centroids and zone_class 
-    gdf = gpd.sjoin(parcel_geom.to_crs("EPSG:4326"), 
-                    zone_class.to_crs("EPSG:4326"), 
-                    how = "inner", op = "intersects").drop(columns = "index_right")
+    # (3) Spatial join between parcel centroids and zone_class,
+    # in the same CRS as the registered zone_class layer
+    coords = laplan.spatial.project_points(parcel_geom.x, parcel_geom.y)
+    gdf = join_zone_class(parcel_geom, coords, "zone_class", "zone_class_fragments")
 
     time3 = datetime.now()
-    print(f'Spatial join: {time3 - time2}')
+    print(f'Spatial join: {time3 - time2} ({len(coverage)} polygons)')
+
+    # Optionally, check the join against the raw zoning fragments, and time both
+    if verify:
+        verify0 = datetime.now()
+        expected = join_zone_class(parcel_geom, coords, "zone_class_fragments")
+        verify1 = datetime.now()
+        print(f'Spatial join on raw zoning: {verify1 - verify0} ({len(fragments)} polygons)')
+        pd.testing.assert_frame_equal(gdf, expected)
+        print('Joins on the coverage and raw zoning are identical')
+        time3 = datetime.now()
 
     # (4) Drop duplicate parcels
     gdf = (gdf.drop_duplicates(subset = ["uuid", "zone_class"])
@@ -129,65 +261,134 @@ def join_parcels_to_zones():
 
 
 # (5) Aggregate to tract
+def tract_zone_counts(gdf, by_tier = False, sparse = False):
+    """
+    Count parcels by tract and zone_class in one pass.
+
+    Parameters
+    ==========
+
+    gdf: pd.DataFrame, parcels joined to zone_class, from join_parcels_to_zones.
+    by_tier: bool, also keep the TOC tier dimension. 
+            The counts are a 3-D array of (GEOID, TOC_Tier, zone_class).
+    sparse: bool, return the counts as a scipy.sparse CSR matrix. 
+            Only for the 2-D (GEOID, zone_class) counts.
+
+    Returns
+    =======
+
+    counts: the counts array or matrix.
+    total_AIN: np.array, the total_AIN of each GEOID.
+    labels: list of the GEOID, (TOC_Tier,) and zone_class values 
+            along each dimension, sorted.
+    """
+    cols = ["GEOID", "TOC_Tier", "zone_class"] if by_tier else ["GEOID", "zone_class"]
+    
+    # Drop parcels with a missing key, like groupby does
+    df = gdf.dropna(subset = cols + ["total_AIN"])
+    codes, labels = zip(*[pd.factorize(df[c], sort = True) for c in cols])
+    shape = tuple(len(u) for u in labels)
+
+    total_AIN = np.zeros(shape[0])
+    total_AIN[codes[0]] = df.total_AIN.values
+
+    if sparse:
+        if by_tier:
+            raise ValueError("sparse counts are only available without by_tier")
+        counts = scipy.sparse.coo_matrix(
+            (np.ones(len(df)), codes), shape = shape).tocsr()
+    else:
+        flat = np.ravel_multi_index(codes, shape)
+        counts = np.bincount(flat, minlength = np.prod(shape)).reshape(shape)
+    
+    return counts, total_AIN, list(labels)
+
+
+def tract_zone_shares(gdf, by_tier = False, sparse = False):
+    """
+    The share of each tract's AIN that belong to each zone_class, 
+    optionally by TOC tier, as an array or sparse matrix.
+    Takes the same parameters and returns the same labels as tract_zone_counts.
+    """
+    counts, total_AIN, labels = tract_zone_counts(gdf, by_tier = by_tier, 
+                                                    sparse = sparse)
+    if sparse:
+        shares = scipy.sparse.diags(1 / total_AIN) @ counts
+    else:
+        shares = counts / total_AIN.reshape((-1,) + (1,) * (counts.ndim - 1))
+    
+    return shares, total_AIN, labels
+
+
 def make_tract_level(gdf):
     time0 = datetime.now()
     print(f'Start make_tract_level: {time0}')
 
-    # Aggregate to tract-tier-zone_class
-    tract_zone_cols = ["GEOID", "TOC_Tier", "total_AIN", "zone_class"]
-    by_zone_tract = (gdf.groupby(tract_zone_cols)
-                    .agg({"uuid": "count"})
-                    .reset_index()
-                    )
+    # Crosstab tract by zone_class, and divide by total_AIN in one go
+    # Ignore the fact that parcels can fall into different tiers within same tract
+    shares, total_AIN, (geoids, zone_classes) = tract_zone_shares(gdf)
 
     time1 = datetime.now()
-    print(f'1st aggregation: {time1 - time0}')
-
-    # Make wide
-    tract_tier_cols = ["GEOID", "TOC_Tier", "total_AIN"]
-    by_tract_tier = (by_zone_tract.pivot(
-                        index = tract_tier_cols, 
-                        columns = "zone_class", values = "uuid"
-                        )
-                .reset_index()
-                )
-
-    by_tract_tier.columns.name = None
-
-    time2 = datetime.now()
-    print(f'2nd aggregation: {time2 - time1}')
-
-    # Aggregate to tract
-    # Ignore the fact that parcels can fall into different tiers within same tract
-    tract_cols = ["GEOID", "total_AIN"]
-    by_tract = (by_tract_tier.drop(columns = "TOC_Tier")
-                .pivot_table(index = tract_cols, aggfunc = "sum")
-                .sort_values("GEOID")
-                .reset_index()
-            )
-    
-    time3 = datetime.now()
-    print(f'3rd aggregation: {time3 - time2}')
+    print(f'Crosstab: {time1 - time0}')
 
     # Create columns that tell us what % AIN belong to each zone_class
-    remove_me = ["GEOID", "total_AIN"]
-    zone_cols = [x for x in list(by_tract.columns) if x not in remove_me]
-
-    for c in zone_cols:
-        by_tract[c] = by_tract[c] / by_tract["total_AIN"]
-    
-    by_tract = (by_tract.sort_values("GEOID")
-                .reset_index(drop=True)
+    by_tract = pd.concat([
+        pd.DataFrame({"GEOID": geoids, "total_AIN": total_AIN}), 
+        pd.DataFrame(shares, columns = zone_classes)
+        ], axis = 1
     )
+    by_tract["total_AIN"] = by_tract.total_AIN.astype(gdf.total_AIN.dtype)
     
     # Export to S3
     by_tract.to_parquet(f"s3://{bucket_name}/data/crosswalk_tracts_zone_class.parquet")
     
-    time4 = datetime.now()
-    print(f'Finish and export: {time4 - time3}')
-    print(f'Total time for make_tract_level: {time4 - time0}')
+    time2 = datetime.now()
+    print(f'Finish and export: {time2 - time1}')
+    print(f'Total time for make_tract_level: {time2 - time0}')
    
     return by_tract
 
-gdf = join_parcels_to_zones()
-final = make_tract_level(gdf)
\ No newline at end of file
+
+#------------------------------------------------------------------------#
+## Parcel store
+#------------------------------------------------------------------------#
+def make_parcel_store(gdf):
+    """
+    Collect the parcel attributes used by later stages into a 
+    laplan.parcels.ParcelStore: the county crosswalk from A3 
+    (which has the TOC tiers from A4), and the zone_class from 
+    join_parcels_to_zones, which only covers the City of LA.
+    Where a parcel falls in more than one zone_class, the first is kept.
+    """
+    time0 = datetime.now()
+
+    parcels = pd.read_parquet(
+        f"s3://{bucket_name}/data/crosswalk_parcels_tracts_lacounty.parquet",
+        columns = ["AIN", "x", "y", "GEOID", "TOC_Tier", "uuid"])
+
+    # Store the centroids in the CRS the spatial joins are done in
+    coords = laplan.spatial.project_points(parcels.x, parcels.y)
+    zone_class = (gdf.sort_values(["uuid", "zone_class"])
+        .drop_duplicates(subset = "uuid")
+        .set_index("uuid").zone_class
+    )
+    parcels = parcels.assign(
+        x = coords[:, 0],
+        y = coords[:, 1],
+        zone_class = parcels.uuid.map(zone_class),
+    )[laplan.parcels.PARCEL_COLUMNS]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "parcel_store")
+        laplan.parcels.ParcelStore.write(parcels, path)
+        fs = s3fs.S3FileSystem()
+        if fs.exists(PARCEL_STORE_PATH):
+            fs.rm(PARCEL_STORE_PATH, recursive = True)
+        fs.put(path, PARCEL_STORE_PATH, recursive = True)
+
+    print(f'Write parcel store: {datetime.now() - time0}')
+
+
+gdf = join_parcels_to_zones(verify = args.verify, refresh_zoning = args.refresh_zoning)
+final = make_tract_level(gdf)
+make_parcel_store(gdf)
\ No newline at end of file
@@ -1,10 +1,15 @@
 # Utils for src folder
 import boto3
+import concurrent.futures
 import geopandas as gpd
+import numpy as np
 import os
 import pandas as pd
 import shapely
 import shutil
+import tempfile
+import time
+import zipfile
 
 from shapely.geometry import Point
 
@@ -33,9 +38,58 @@ def make_gdf(df, x_col, y_col, initial_CRS="EPSG:4326", projected_CRS="EPSG:2229
     return gdf
 
 
+# Shapefile components (.shp and .dbf) can't be larger than 2GB
+SHAPEFILE_MAX_BYTES = 2 ** 31
+
+
+def estimate_shapefile_bytes(df):
+    """
+    Estimate the size of the largest component (.shp or .dbf)
+    of a GeoDataFrame written as a shapefile.
+    """
+    if hasattr(shapely, "get_num_coordinates"):
+        # shapely>=2 counts the points of all the geometries at once.
+        # Each point takes 16 bytes, and each record a header of about 60.
+        n_points = shapely.get_num_coordinates(np.asarray(df.geometry.array)).sum()
+        shp_bytes = 16 * int(n_points) + 60 * len(df)
+    else:
+        shp_bytes = df.geometry.apply(
+            lambda g: len(g.wkb) if g is not None else 0
+        ).sum()
+    row_bytes = 1
+    for c in df.columns.drop(df.geometry.name):
+        if df[c].dtype == object:
+            # Text fields are as wide as the longest value, up to 254 characters
+            row_bytes += min(df[c].astype(str).str.len().max() or 1, 254)
+        else:
+            row_bytes += 24
+    return max(shp_bytes, row_bytes * len(df))
+
+
+def write_zipped_shapefile(df, path, compresslevel=6):
+    """
+    Write a GeoDataFrame as a shapefile, and stream its
+    components into a zip file. Returns the size of the zip file.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        df.to_file(driver="ESRI Shapefile", filename=os.path.join(tmpdir, f"{name}.shp"))
+        with zipfile.ZipFile(
+            path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel
+        ) as z:
+            for component in sorted(os.listdir(tmpdir)):
+                with open(os.path.join(tmpdir, component), "rb") as src, z.open(
+                    component, "w", force_zip64=True
+                ) as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+    return os.path.getsize(path)
+
+
 # Make zipped shapefile
 # Remember: shapefiles can only take 10-char column names
-def make_zipped_shapefile(df, path):
+def make_zipped_shapefile(
+    df, path, compresslevel=6, max_part_bytes=SHAPEFILE_MAX_BYTES, workers=None
+):
     """
     Make a zipped shapefile and save locally
 
@@ -46,25 +100,42 @@ def make_zipped_shapefile(df, path):
     path: str, local path to where the zipped shapefile is saved.
             Ex: "folder_name/census_tracts" 
                 "folder_name/census_tracts.zip"
-    """
+    compresslevel: int, zip compression level, from 0 (fastest) to 9 (smallest).
+    max_part_bytes: int, if the shapefile would be larger than this,
+            it is split into parts, each saved as its own zipped shapefile,
+            "folder_name/census_tracts_1.zip", "folder_name/census_tracts_2.zip", ...
+            Defaults to the 2GB shapefile limit.
+    workers: int, number of parts to write at the same time.
 
+    Returns
+    =======
+
+    The list of paths of the zipped shapefiles.
+    """
+    start = time.time()
     # Grab first element of path (can input filename.zip or filename)
     dirname = os.path.splitext(path)[0]
-    print(f'Path name: {path}')
-    print(f'Dirname (1st element of path): {dirname}')
-    # Make sure there's no folder with the same name
-    shutil.rmtree(dirname, ignore_errors = True)
-    # Make folder
-    os.mkdir(dirname)
-    shapefile_name = f'{os.path.basename(dirname)}.shp'
-    print(f'Shapefile name: {shapefile_name}')
-    # Export shapefile into its own folder with the same name 
-    df.to_file(driver = 'ESRI Shapefile', filename = f'{dirname}/{shapefile_name}')
-    print(f'Shapefile component parts folder: {dirname}/{shapefile_name}')
-    # Zip it up
-    shutil.make_archive(dirname, 'zip', dirname)
-    # Remove the unzipped folder
-    shutil.rmtree(dirname, ignore_errors = True)
+    print(f"Path name: {path}")
+
+    # Leave some headroom, since the size is an estimate
+    n_parts = int(np.ceil(estimate_shapefile_bytes(df) / (0.9 * max_part_bytes))) or 1
+    if n_parts == 1:
+        paths = [f"{dirname}.zip"]
+        parts = [df]
+    else:
+        paths = [f"{dirname}_{i + 1}.zip" for i in range(n_parts)]
+        bounds = np.linspace(0, len(df), n_parts + 1).astype(int)
+        parts = [df.iloc[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    print(f"Shapefile parts: {n_parts}")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        sizes = list(executor.map(
+            lambda args: write_zipped_shapefile(*args, compresslevel=compresslevel),
+            zip(parts, paths),
+        ))
+
+    print(f"Wrote {sum(sizes):,} bytes in {time.time() - start:.1f}s")
+    return paths
 
 
 # Upload S3 geoparquet
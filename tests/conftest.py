@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Make laplan importable without installing it, and the pipeline scripts
+# in src/, which aren't a package. The notebook helpers come last, so that
+# src/utils.py is found before notebooks/utils.py.
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.append(os.path.join(ROOT, "notebooks"))
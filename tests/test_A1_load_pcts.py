@@ -0,0 +1,250 @@
+import datetime
+
+import pytest
+import sqlalchemy
+
+import A1_load_pcts
+
+BATCH_SIZE = 7
+N_APLC = 20
+N_CASES = 50
+N_STATUS = 3
+
+
+@pytest.fixture
+def source(tmp_path):
+    """
+    A small SQLite DB shaped like PCTS: a lookup table, applications
+    referencing it, and cases referencing those, with more rows than
+    a batch and some NULLs.
+    """
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'source.sqlite'}")
+    meta = sqlalchemy.MetaData()
+    status = sqlalchemy.Table(
+        "LUP_STATUS",
+        meta,
+        sqlalchemy.Column("STATUS_ID", sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column("STATUS_DESC", sqlalchemy.String),
+    )
+    aplc = sqlalchemy.Table(
+        "tAPLC",
+        meta,
+        sqlalchemy.Column("APLC_ID", sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column("PROJ_DESC_TXT", sqlalchemy.String),
+        sqlalchemy.Column(
+            "STATUS_ID",
+            sqlalchemy.Integer,
+            sqlalchemy.ForeignKey("LUP_STATUS.STATUS_ID"),
+        ),
+    )
+    case = sqlalchemy.Table(
+        "tCASE",
+        meta,
+        sqlalchemy.Column("CASE_ID", sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column("CASE_NBR", sqlalchemy.String, index=True),
+        sqlalchemy.Column("CASE_FILE_DATE", sqlalchemy.DateTime),
+        sqlalchemy.Column(
+            "APLC_ID", sqlalchemy.Integer, sqlalchemy.ForeignKey("tAPLC.APLC_ID")
+        ),
+    )
+    meta.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(
+            status.insert(),
+            [{"STATUS_ID": i, "STATUS_DESC": f"STATUS {i}"} for i in range(N_STATUS)],
+        )
+        connection.execute(
+            aplc.insert(),
+            [
+                {
+                    "APLC_ID": i,
+                    "PROJ_DESC_TXT": None if i % 5 == 0 else f"{i} UNITS\x00",
+                    "STATUS_ID": i % N_STATUS,
+                }
+                for i in range(N_APLC)
+            ],
+        )
+        connection.execute(
+            case.insert(),
+            [
+                {
+                    "CASE_ID": i,
+                    "CASE_NBR": f"ZA-2010-{i}-CUB",
+                    "CASE_FILE_DATE": None
+                    if i % 4 == 0
+                    else datetime.datetime(2010, 1, 1) + datetime.timedelta(days=i),
+                    "APLC_ID": None if i % 3 == 0 else i % N_APLC,
+                }
+                for i in range(N_CASES)
+            ],
+        )
+    return engine
+
+
+def read_table(engine, name):
+    meta = sqlalchemy.MetaData()
+    table = sqlalchemy.Table(name, meta, autoload_with=engine)
+    with engine.connect() as connection:
+        rows = connection.execute(table.select()).fetchall()
+    return sorted(tuple(row) for row in rows)
+
+
+def test_full_load_sqlite_to_sqlite(source, tmp_path):
+    dest = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'dest.sqlite'}")
+    from_meta = sqlalchemy.MetaData()
+    from_meta.reflect(bind=source)
+
+    A1_load_pcts.full_load(source, dest, from_meta, batch_size=BATCH_SIZE)
+
+    for name, nrows in [("tAPLC", N_APLC), ("tCASE", N_CASES)]:
+        copied = read_table(dest, name)
+        assert len(copied) == nrows
+        assert copied == read_table(source, name)
+
+    # NULLs survive the copy.
+    cases = read_table(dest, "tCASE")
+    assert sum(row[2] is None for row in cases) == N_CASES // 4 + 1
+    assert sum(row[3] is None for row in cases) == N_CASES // 3 + 1
+
+    # The primary keys are enforced with deferred unique indexes,
+    # and the other source indexes are rebuilt.
+    inspector = sqlalchemy.inspect(dest)
+    indexes = {ix["name"]: ix for ix in inspector.get_indexes("tCASE")}
+    assert indexes["pk_tCASE"]["unique"]
+    assert indexes["pk_tCASE"]["column_names"] == ["CASE_ID"]
+    assert any(ix["column_names"] == ["CASE_NBR"] for ix in indexes.values())
+    assert inspector.get_indexes("tAPLC")[0]["name"] == "pk_tAPLC"
+    with dest.connect() as connection, pytest.raises(sqlalchemy.exc.IntegrityError):
+        connection.execute(
+            sqlalchemy.text('INSERT INTO "tCASE" ("CASE_ID") VALUES (1)')
+        )
+
+
+def test_copy_table_batches(source, tmp_path):
+    dest = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'dest.sqlite'}")
+    from_meta = sqlalchemy.MetaData()
+    from_meta.reflect(bind=source)
+    from_table = from_meta.tables["tCASE"]
+    to_meta = sqlalchemy.MetaData()
+    to_table = sqlalchemy.Table(
+        "tCASE", to_meta, *[A1_load_pcts.bare_column(c) for c in from_table.columns]
+    )
+    to_meta.create_all(bind=dest)
+
+    nrows = A1_load_pcts.copy_table(
+        source, from_table, dest, to_table, batch_size=BATCH_SIZE
+    )
+
+    assert nrows == N_CASES
+    assert read_table(dest, "tCASE") == read_table(source, "tCASE")
+
+
+def count(engine, name, **where):
+    clause = " AND ".join(f"{k} = :{k}" for k in where) or "1 = 1"
+    with engine.connect() as connection:
+        return connection.execute(
+            sqlalchemy.text(f'SELECT COUNT(*) FROM "{name}" WHERE {clause}'), where
+        ).scalar()
+
+
+def test_incremental_refresh(source, tmp_path):
+    dest = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'dest.sqlite'}")
+    from_meta = sqlalchemy.MetaData()
+    from_meta.reflect(bind=source)
+    A1_load_pcts.full_load(source, dest, from_meta, batch_size=BATCH_SIZE)
+
+    # The full load records the hashes, so a refresh right after it is a no-op.
+    assert count(dest, "pcts_row_hashes") == N_APLC + N_CASES
+    A1_load_pcts.refresh(source, dest, from_meta, batch_size=BATCH_SIZE)
+    assert count(dest, "pcts_changes") == 0
+
+    with source.begin() as connection:
+        connection.execute(
+            sqlalchemy.text(
+                'UPDATE "tCASE" SET "CASE_NBR" = \'ZA-2020-1-TOC\' '
+                'WHERE "CASE_ID" IN (1, 10, 40)'
+            )
+        )
+        connection.execute(
+            sqlalchemy.text('DELETE FROM "tCASE" WHERE "CASE_ID" IN (2, 31)')
+        )
+        connection.execute(
+            sqlalchemy.text(
+                'INSERT INTO "tCASE" ("CASE_ID", "CASE_NBR", "APLC_ID") '
+                "VALUES (100, 'DIR-2020-100-TOC', 1), (101, NULL, NULL)"
+            )
+        )
+
+    A1_load_pcts.refresh(source, dest, from_meta, batch_size=BATCH_SIZE)
+
+    for name in ["tAPLC", "tCASE"]:
+        assert read_table(dest, name) == read_table(source, name)
+    # The old versions of the 3 changed and 2 deleted cases,
+    # and the new versions of the 3 changed and 2 inserted cases.
+    assert count(dest, "pcts_changes", table_name="tCASE") == 10
+    assert count(dest, "pcts_changes", table_name="tAPLC") == 0
+    assert count(dest, "pcts_row_hashes", table_name="tCASE") == N_CASES
+    assert count(dest, "pcts_refresh_keys") == 0
+
+
+def test_refresh_with_foreign_keys(source, tmp_path):
+    dest = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'dest.sqlite'}")
+
+    @sqlalchemy.event.listens_for(dest, "connect")
+    def enforce_foreign_keys(connection, record):
+        connection.execute("PRAGMA foreign_keys = ON")
+
+    # SQLite can't add the keys after a load, so the tables are created
+    # with them, deferrable as create_deferred_constraints makes them.
+    # The key between the large tables is checked immediately, like those
+    # of a DB loaded before they were deferrable.
+    from_meta = sqlalchemy.MetaData()
+    from_meta.reflect(bind=source)
+    to_meta = sqlalchemy.MetaData()
+    for table in from_meta.sorted_tables:
+        A1_load_pcts.constrained_table(table, to_meta)
+    for fk in to_meta.tables["tCASE"].foreign_key_constraints:
+        fk.deferrable = fk.initially = None
+    assert len(to_meta.tables["tAPLC"].foreign_key_constraints) == 1
+    to_meta.create_all(bind=dest)
+    bookkeeping, hashes, _, _ = A1_load_pcts.refresh_tables()
+    bookkeeping.create_all(bind=dest)
+    A1_load_pcts.load_tables(
+        source, dest, from_meta, to_meta, batch_size=BATCH_SIZE, hashes=hashes
+    )
+
+    with source.begin() as connection:
+        # A changed application which cases reference.
+        connection.execute(
+            sqlalchemy.text(
+                'UPDATE "tAPLC" SET "PROJ_DESC_TXT" = \'10 UNITS\' '
+                'WHERE "APLC_ID" = 1'
+            )
+        )
+        # A deleted application, along with its only case.
+        connection.execute(sqlalchemy.text('DELETE FROM "tCASE" WHERE "CASE_ID" = 19'))
+        connection.execute(sqlalchemy.text('DELETE FROM "tAPLC" WHERE "APLC_ID" = 19'))
+        # A changed and a new status, the latter with a new application.
+        connection.execute(
+            sqlalchemy.text(
+                'UPDATE "LUP_STATUS" SET "STATUS_DESC" = \'CLOSED\' '
+                'WHERE "STATUS_ID" = 0'
+            )
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO \"LUP_STATUS\" VALUES (9, 'NEW')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO \"tAPLC\" VALUES (100, '5 UNITS', 9)")
+        )
+
+    A1_load_pcts.refresh(source, dest, from_meta, batch_size=BATCH_SIZE)
+
+    for name in ["LUP_STATUS", "tAPLC", "tCASE"]:
+        assert read_table(dest, name) == read_table(source, name)
+    # The old and new versions of the changed application,
+    # the deleted application and case, and the new application.
+    assert count(dest, "pcts_changes", table_name="tAPLC") == 4
+    assert count(dest, "pcts_changes", table_name="tCASE") == 1
+    with dest.connect() as connection:
+        assert connection.execute("PRAGMA foreign_key_check").fetchall() == []
@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+
+import numpy
+import pandas
+
+import laplan
+
+
+def test_centroid_groups_keeps_nearby_parcels_apart():
+    # Two parcels about 10 cm apart, and two condos sharing a centroid.
+    lon = numpy.array([-118.2437, -118.243701, -118.25, -118.25])
+    lat = numpy.array([34.1, 34.1, 34.05, 34.05])
+
+    x, y, uuid = laplan.parcels.centroid_groups(lon, lat)
+
+    assert uuid[0] != uuid[1]
+    assert uuid[2] == uuid[3]
+    assert len(set(uuid)) == 3
+    # The rounded coordinates are the float64 ones, not float32 artefacts.
+    assert y[0] == 34.1
+    assert x[1] == -118.243701
+
+
+def roll_history():
+    roll = pandas.DataFrame(
+        {
+            "AIN": [1000, 1000, 1000, 1000, 1001, 1001],
+            "RollYear": numpy.array([2008, 2009, 2010, 2012, 2010, 2011], "int16"),
+            "PropertyUseCode": ["0100", "0100", "0500", "0500", "1100", "1100"],
+        }
+    )
+    return laplan.parcels.encode_history(roll)
+
+
+def test_as_of():
+    history = roll_history()
+
+    rolls = laplan.parcels.as_of(
+        history, [1000, 1000, 1000, 1001, 1001], [2009, 2010, 2011, 2011, 2012]
+    )
+
+    assert rolls.AIN.tolist() == [1000, 1000, 1000, 1001, 1001]
+    assert rolls.year.tolist() == [2009, 2010, 2011, 2011, 2012]
+    # 2011 is within a run of 1000, while 1001 left the roll after 2011.
+    assert rolls.PropertyUseCode.tolist() == ["0100", "0500", "0500", "1100", None]
+
+
+def test_as_of_missing_years():
+    history = roll_history()
+
+    rolls = laplan.parcels.as_of(
+        history, [1000, 1001, 1000], pandas.Series([2010.0, numpy.nan, None])
+    )
+
+    assert rolls.year.isna().tolist() == [False, True, True]
+    assert rolls.PropertyUseCode.tolist()[0] == "0500"
+    assert rolls.PropertyUseCode.isna().tolist() == [False, True, True]
+
+
+def test_ain_array():
+    assert laplan.parcels.ain_array([1, 2]).tolist() == [1, 2]
+    assert laplan.parcels.ain_array(["1", "x", None]).tolist() == [1, -1, -1]
+
+
+def test_parcel_store_unknown_ains(tmp_path):
+    df = pandas.DataFrame(
+        {
+            "AIN": ["3000", "1000", "2000"],
+            "x": [3.0, 1.0, 2.0],
+            "GEOID": [30, 10, 20],
+            "zone_class": ["R1", "C2", None],
+        }
+    )
+    store = laplan.parcels.ParcelStore.write(df, str(tmp_path / "store"))
+
+    rows = store.positions([2000, 4000, "1000", "x"])
+    assert rows.tolist() == [1, -1, 0, -1]
+    assert numpy.isnan(store.get("x", rows)).tolist() == [False, True, False, True]
+    assert store.get("x", rows)[[0, 2]].tolist() == [2.0, 1.0]
+    assert store.get("GEOID", rows).tolist() == [20, -1, 10, -1]
+    zone_class = store.get("zone_class", rows)
+    assert list(zone_class.isna()) == [True, True, False, True]
+    assert zone_class[2] == "C2"
+
+    frame = store.to_frame(ains=[4000, 3000])
+    assert frame.AIN.tolist() == [3000]
+    assert frame.zone_class.tolist() == ["R1"]
+
+
+def test_import_without_geopandas():
+    # Only laplan.spatial needs geopandas, and it is imported on first use.
+    code = (
+        "import sys, laplan, laplan.parcels\n"
+        "assert 'geopandas' not in sys.modules\n"
+        "assert laplan.spatial.CACHE_DIR == laplan.parcels.CACHE_DIR\n"
+        "assert 'geopandas' in sys.modules\n"
+    )
+    root = os.path.dirname(os.path.dirname(laplan.__file__))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=root)
@@ -0,0 +1,224 @@
+import numpy
+import pandas
+import pytest
+
+import laplan
+
+PREFIXES = ["ZA", "CPC", "DIR", "ENV", "TT", "CUB"]
+SUFFIXES = ["CUB", "ZC", "GPA", "SPR", "DB", "TOC"]
+
+
+@pytest.fixture
+def pcts():
+    """
+    A small synthetic master PCTS extract: cases on one or more parcels,
+    some of them children of others, with a mix of well-formed, yearless
+    and unparseable case numbers, missing file dates, and duplicate rows.
+    """
+    rng = numpy.random.default_rng(0)
+    rows = []
+    for case_id in range(1, 301):
+        prefix = rng.choice(PREFIXES)
+        year = int(rng.integers(2008, 2021))
+        suffixes = "".join(
+            f"-{s}" for s in rng.choice(SUFFIXES, rng.integers(0, 4), replace=False)
+        )
+        if case_id % 50 == 0:
+            case_number = "GARBAGE"
+        elif case_id % 20 == 0:
+            case_number = f"{prefix}-{case_id}{suffixes}"
+        else:
+            case_number = f"{prefix}-{year}-{case_id}{suffixes}"
+        file_date = pandas.Timestamp(f"{year}-01-01") + pandas.Timedelta(
+            days=int(rng.integers(0, 360))
+        )
+        parent = int(rng.integers(1, case_id)) if rng.random() < 0.3 else None
+        geoid = f"06037{rng.integers(0, 10):06d}"
+        for _ in range(int(rng.choice([1, 2, 3, 25]))):
+            rows.append(
+                {
+                    "CASE_ID": case_id,
+                    "CASE_NUMBER": case_number,
+                    "FILE_DATE": None if case_id % 30 == 0 else file_date,
+                    "CASE_YEAR_NUMBER": year,
+                    "PARENT_CASE_ID": parent,
+                    "AIN": int(rng.integers(1e9, 2e9)),
+                    "GEOID": geoid,
+                }
+            )
+    pcts = pandas.DataFrame(rows).astype(
+        {
+            "CASE_ID": "Int64",
+            "PARENT_CASE_ID": "Int64",
+            "CASE_YEAR_NUMBER": "Int64",
+            "FILE_DATE": "datetime64[ns]",
+        }
+    )
+    return pandas.concat([pcts, pcts.iloc[:20]], ignore_index=True)
+
+
+QUERIES = [
+    {},
+    {"start_date": "2012-01-01", "end_date": "2015-12-31"},
+    {"prefix_list": ["ZA", "CPC"]},
+    {"suffix_list": ["ZC", "GPA"]},
+    {"start_date": "2011-06-01", "prefix_list": ["DIR"], "suffix_list": ["TOC"]},
+    {"suffix_list": ["NOPE"]},
+]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_pcts_index_matches_subset_pcts(pcts, query, tmp_path):
+    index = laplan.pcts.PCTSIndex.build(pcts)
+    expected = laplan.pcts.subset_pcts(pcts, **query)
+
+    # The index selects exactly the rows which subset_pcts keeps.
+    rows = index.query(**query)
+    assert (numpy.diff(rows) > 0).all()
+    pandas.testing.assert_frame_equal(
+        laplan.pcts.subset_pcts(pcts.iloc[rows], **query), expected
+    )
+    assert len(pcts.iloc[rows].drop_duplicates()) == len(expected)
+    pandas.testing.assert_frame_equal(
+        laplan.pcts.subset_pcts(pcts, index=index, **query), expected
+    )
+
+    index.save(tmp_path / "pcts_index.npz")
+    loaded = laplan.pcts.PCTSIndex.load(tmp_path / "pcts_index.npz")
+    numpy.testing.assert_array_equal(loaded.query(**query), rows)
+
+
+def test_pcts_index_of_another_extract(pcts):
+    index = laplan.pcts.PCTSIndex.build(pcts.iloc[1:])
+    with pytest.raises(ValueError):
+        laplan.pcts.subset_pcts(pcts, index=index)
+
+
+DESCRIPTIONS = pandas.Series(
+    [
+        "New Accessory Dwelling Unit (ADU) in rear yard",
+        "Demolition of an accessory building",
+        "Convert garage to accessory dwelling-unit",
+        None,
+        "Dwelling accessory unit",
+        "ADU",
+    ],
+    index=[10, 11, 12, 13, 14, 15],
+)
+
+
+def test_description_index_phrases(tmp_path):
+    index = laplan.pcts.DescriptionIndex.build(DESCRIPTIONS)
+
+    # Row ids are positions, whatever the index of the series.
+    assert index.phrase("accessory dwelling unit").tolist() == [0, 2]
+    assert index.phrase("Dwelling Accessory").tolist() == [4]
+    assert index.phrase("accessory").tolist() == [0, 1, 2, 4]
+    assert index.phrase("accessory garage").tolist() == []
+    assert index.phrase("no such words").tolist() == []
+
+    def search(**kwargs):
+        return index.search(**kwargs).tolist()
+
+    assert search(any_of=["adu", "accessory dwelling unit"]) == [0, 2, 5]
+    assert search(all_of=["accessory"], none_of=["demolition"]) == [0, 2, 4]
+    assert search(all_of=["accessory", "unit"], any_of=["adu", "garage"]) == [0, 2]
+    assert search() == list(range(len(DESCRIPTIONS)))
+
+    index.save(tmp_path / "pcts_description_index.npz")
+    loaded = laplan.pcts.DescriptionIndex.load(tmp_path / "pcts_description_index.npz")
+    assert loaded.phrase("accessory dwelling unit").tolist() == [0, 2]
+    assert loaded.search(any_of=["adu"], none_of=["rear"]).tolist() == [5]
+
+
+def test_extract_units():
+    descriptions = pandas.Series(
+        [
+            "(N) 24 new residential units",
+            "Two new units over garage",
+            "twenty-four units, 3 affordable units",
+            "10-12 units",
+            "10 to 12 units",
+            "1,200 units",
+            "a 5-unit building",
+            "phase one of 40 units",
+            "single family dwelling",
+            None,
+        ],
+        index=list("abcdefghij"),
+    )
+    units = laplan.pcts.extract_units(descriptions)
+    assert str(units.dtype) == "Int64"
+    assert units.index.equals(descriptions.index)
+    assert units.tolist() == [24, 2, 24, 12, 12, 1200, 5, 40, pandas.NA, pandas.NA]
+
+
+def test_update_entitlement_cube_matches_rebuild(pcts):
+    cube = laplan.pcts.build_entitlement_cube(pcts)
+
+    # Cases 5 and 11 move to another tract, 10 is deleted, 150 loses its
+    # suffixes, and 301 is new.
+    changed = [5, 10, 11, 150, 301]
+    rebuilt = pcts[pcts.CASE_ID.isin([5, 11, 150])].assign(GEOID="06037999999")
+    rebuilt.loc[rebuilt.CASE_ID == 150, "CASE_NUMBER"] = "ZA-2015-150"
+    new = pcts[pcts.CASE_ID == 1].assign(CASE_ID=301, CASE_NUMBER="DIR-2019-301-TOC")
+    rebuilt = pandas.concat([rebuilt, new], ignore_index=True)
+
+    updated = laplan.pcts.update_entitlement_cube(cube, rebuilt, changed)
+    full = pandas.concat([pcts[~pcts.CASE_ID.isin(changed)], rebuilt])
+    pandas.testing.assert_frame_equal(
+        updated, laplan.pcts.build_entitlement_cube(full)
+    )
+    assert not updated.CASE_ID.isin([10]).any()
+    assert updated.CASE_ID.isin([301]).any()
+
+
+def test_entitlement_counts():
+    cases = [
+        # CASE_ID, CASE_NUMBER, FILE_DATE, PARENT_CASE_ID, GEOID, parcels
+        (1, "ZA-2015-1-ZC-GPA", "2015-03-01", None, "A", 1),
+        (2, "CPC-2015-2-ZC", "2015-06-01", None, "A", 2),
+        # A child of case 2, whose entitlement is counted with its parent.
+        (3, "DIR-2016-3-GPA", "2016-02-01", 2, "B", 1),
+        # A big case.
+        (4, "ZA-2016-4-ZC", "2016-05-01", None, "B", 30),
+        (5, "ZA-2016-5-CUB", "2016-07-01", None, "B", 1),
+        # Filed before the default start date.
+        (6, "ZA-2009-6-ZC", "2009-07-01", None, "B", 1),
+    ]
+    pcts = pandas.DataFrame(
+        [
+            {
+                "CASE_ID": case_id,
+                "CASE_NUMBER": case_number,
+                "FILE_DATE": pandas.Timestamp(file_date),
+                "CASE_YEAR_NUMBER": int(file_date[:4]),
+                "PARENT_CASE_ID": parent,
+                "AIN": 100 * case_id + i,
+                "GEOID": geoid,
+            }
+            for case_id, case_number, file_date, parent, geoid, n in cases
+            for i in range(n)
+        ]
+    ).astype({"CASE_ID": "Int64", "PARENT_CASE_ID": "Int64"})
+    cube = laplan.pcts.build_entitlement_cube(pcts)
+
+    counts, big_cases = laplan.pcts.entitlement_counts(
+        cube, suffix_list=["ZC", "GPA"], return_big_cases=True
+    )
+    expected = pandas.DataFrame(
+        {"year": [2015], "ZC": [2], "GPA": [2]},
+        index=pandas.Index(["A"], name="GEOID"),
+    )
+    pandas.testing.assert_frame_equal(counts, expected)
+    assert list(big_cases) == [4]
+
+    counts = laplan.pcts.entitlement_counts(cube, big_case_threshold=None)
+    assert counts.loc["B", "ZC"] == 1
+    counts = laplan.pcts.entitlement_counts(
+        cube, prefix_list=["ZA"], suffix_list=["ZC", "CUB"], aggregate_years=True
+    )
+    assert counts.to_dict("index") == {
+        "A": {"ZC": 1, "CUB": 0},
+        "B": {"ZC": 0, "CUB": 1},
+    }
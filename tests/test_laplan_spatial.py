@@ -0,0 +1,122 @@
+import geopandas
+import numpy
+import pytest
+import shapely.geometry
+
+import laplan.spatial
+
+
+@pytest.fixture
+def polygons():
+    """
+    A grid of squares, 10 feet wide with gaps between them, and a circle
+    overlapping many of them.
+    """
+    squares = [
+        shapely.geometry.box(x, y, x + 10, y + 10)
+        for x in range(0, 200, 12)
+        for y in range(0, 200, 12)
+    ]
+    circle = shapely.geometry.Point(100, 100).buffer(40)
+    return geopandas.GeoDataFrame(
+        {"name": range(len(squares) + 1)},
+        geometry=squares + [circle],
+        crs=laplan.spatial.CANONICAL_CRS,
+    )
+
+
+@pytest.fixture
+def points():
+    """
+    Random points, points on the edges and corners of the squares,
+    and points with missing coordinates.
+    """
+    rng = numpy.random.default_rng(0)
+    x = numpy.concatenate([rng.uniform(-10, 210, 5000), [0, 10, 12, 5, numpy.nan, 3]])
+    y = numpy.concatenate([rng.uniform(-10, 210, 5000), [5, 10, 0, 0, 7, numpy.nan]])
+    return x, y
+
+
+def sjoin_pairs(x, y, polygons, predicate):
+    points = geopandas.GeoDataFrame(
+        geometry=geopandas.points_from_xy(x, y), crs=polygons.crs
+    )
+    joined = geopandas.sjoin(points, polygons, predicate=predicate)
+    pairs = numpy.column_stack([joined.index, joined.index_right])
+    return pairs[numpy.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+@pytest.mark.parametrize("predicate", ["within", "intersects"])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_points_in_polygons_matches_sjoin(points, polygons, predicate, workers):
+    x, y = points
+    point_idx, polygon_idx = laplan.spatial.points_in_polygons(
+        x, y, polygons, predicate=predicate, chunksize=700, workers=workers
+    )
+    numpy.testing.assert_array_equal(
+        numpy.column_stack([point_idx, polygon_idx]),
+        sjoin_pairs(x, y, polygons, predicate),
+    )
+
+
+def test_first_polygon_and_join_index(points, polygons):
+    x, y = points
+    point_idx, polygon_idx = laplan.spatial.points_in_polygons(x, y, polygons)
+
+    first = laplan.spatial.first_polygon(point_idx, polygon_idx, len(x))
+    assert len(first) == len(x)
+    assert (first[numpy.setdiff1d(numpy.arange(len(x)), point_idx)] == -1).all()
+    for i in numpy.unique(point_idx)[:100]:
+        assert first[i] == polygon_idx[point_idx == i].min()
+
+    rows, polys = laplan.spatial.join_index(point_idx, polygon_idx, len(x), "left")
+    assert numpy.array_equal(numpy.unique(rows), numpy.arange(len(x)))
+    assert (numpy.diff(rows) >= 0).all()
+    assert numpy.array_equal(rows[polys >= 0], point_idx)
+    with pytest.raises(ValueError):
+        laplan.spatial.join_index(point_idx, polygon_idx, len(x), "right")
+
+
+def test_lookup(points, polygons):
+    x, y = points
+    layer = laplan.spatial.register_layer(
+        "test_squares", polygons.set_index("name").to_crs("EPSG:4326")
+    )
+    assert layer.crs == laplan.spatial.CANONICAL_CRS
+    assert layer.index.equals(polygons.index)
+
+    coords = numpy.column_stack([x, y])
+    point_idx, polygon_idx = laplan.spatial.lookup("test_squares", coords, workers=1)
+    pairs = sjoin_pairs(x, y, layer, "within")
+    numpy.testing.assert_array_equal(point_idx, pairs[:, 0])
+    numpy.testing.assert_array_equal(polygon_idx, pairs[:, 1])
+
+    with pytest.raises(KeyError):
+        laplan.spatial.get_layer("no_such_layer")
+
+
+def test_cached_polygons(polygons, tmp_path):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return polygons.set_index("name")
+
+    first = laplan.spatial.cached_polygons("squares", loader, cache_dir=tmp_path)
+    cached = laplan.spatial.cached_polygons("squares", loader, cache_dir=tmp_path)
+    assert len(calls) == 1
+    assert (tmp_path / "squares.parquet").exists()
+    assert cached.geom_equals(first).all()
+    assert cached.crs == polygons.crs
+
+    laplan.spatial.cached_polygons("squares", loader, cache_dir=tmp_path, refresh=True)
+    assert len(calls) == 2
+
+
+def test_tile_polygons(polygons):
+    tiles = laplan.spatial.tile_polygons(polygons, tile_size=25)
+    assert tiles.geom_type.isin(["Polygon", "MultiPolygon"]).all()
+    assert tiles.bounds.eval("maxx - minx").max() <= 25 + 1e-9
+    # The pieces of each polygon add back up to it.
+    areas = tiles.area.groupby(tiles.name).sum()
+    numpy.testing.assert_allclose(areas.to_numpy(), polygons.area.to_numpy())
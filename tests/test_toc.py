@@ -0,0 +1,232 @@
+import geopandas
+import numpy
+import pytest
+import shapely.geometry
+
+import laplan
+
+# toc needs partridge, to read GTFS feeds.
+toc = pytest.importorskip("toc")
+
+
+@pytest.fixture
+def sites():
+    """
+    TOC sites of every class, in EPSG:2229, with the headway
+    at which each of them qualifies.
+    """
+    rng = numpy.random.default_rng(0)
+    classes = list(toc.TOC_TIER_DISTANCES)
+    n = 60
+    x = 6.48e6 + rng.uniform(0, 30000, n)
+    y = 1.84e6 + rng.uniform(0, 30000, n)
+    return geopandas.GeoDataFrame(
+        {
+            "site": numpy.arange(n),
+            "site_class": [classes[i % len(classes)] for i in range(n)],
+            "mode": "bus",
+            "headway": rng.choice([0.0, 10.0, 15.0, 20.0], n),
+        },
+        geometry=geopandas.points_from_xy(x, y),
+        crs=f"EPSG:{toc.SOCAL_FEET}",
+    )
+
+
+@pytest.fixture
+def coords():
+    """
+    Parcel centroids around and among the sites, and one without coordinates.
+    """
+    rng = numpy.random.default_rng(1)
+    coords = numpy.column_stack(
+        [
+            6.48e6 + rng.uniform(-5000, 35000, 3000),
+            1.84e6 + rng.uniform(-5000, 35000, 3000),
+        ]
+    )
+    return numpy.vstack([coords, [numpy.nan, numpy.nan]])
+
+
+def brute_force_tiers(sites, coords, cushion):
+    site_xy = numpy.column_stack([sites.geometry.x, sites.geometry.y])
+    distances = numpy.hypot(
+        coords[:, None, 0] - site_xy[None, :, 0],
+        coords[:, None, 1] - site_xy[None, :, 1],
+    )
+    tier = numpy.zeros(len(coords), dtype="int8")
+    for site_class, thresholds in toc.TOC_TIER_DISTANCES.items():
+        d = distances[:, sites.site_class.to_numpy() == site_class]
+        for t, threshold in thresholds.items():
+            within = (d <= threshold * cushion).any(axis=1)
+            tier = numpy.maximum(tier, numpy.where(within, t, 0))
+    return tier
+
+
+@pytest.mark.parametrize("cushion", [1.0, toc.DEFAULT_CUSHION])
+def test_toc_distances_tiers(sites, coords, cushion):
+    distances = toc.TOCDistances(sites)
+    tiers = distances.tier_of(coords, cushion)
+    numpy.testing.assert_array_equal(tiers, brute_force_tiers(sites, coords, cushion))
+    assert tiers[-1] == 0
+    assert set(tiers) >= {0, 1, 2, 3, 4}
+
+
+def test_toc_distances_nearest(sites, coords):
+    distances, nearest = toc.TOCDistances(sites).nearest(
+        coords, max_distance=2000.0, return_sites=True
+    )
+    assert list(distances.columns) == list(toc.TOC_TIER_DISTANCES)
+    assert numpy.isinf(distances.iloc[-1]).all()
+    assert (nearest.iloc[-1] == -1).all()
+
+    # The nearest sites are of the right class, and as far as reported.
+    for site_class in distances.columns:
+        found = nearest[site_class].to_numpy() >= 0
+        assert (numpy.isinf(distances[site_class]) == ~found).all()
+        assert (distances[site_class][found] <= 2000.0).all()
+        matched = sites.iloc[nearest[site_class][found]]
+        assert (matched.site_class == site_class).all()
+        numpy.testing.assert_allclose(
+            numpy.hypot(
+                coords[found, 0] - matched.geometry.x.to_numpy(),
+                coords[found, 1] - matched.geometry.y.to_numpy(),
+            ),
+            distances[site_class][found],
+        )
+
+
+def test_toc_distances_without_a_class(sites, coords):
+    sites = sites[sites.site_class != "metro_intersection"]
+    tiers = toc.TOCDistances(sites).tier_of(coords)
+    numpy.testing.assert_array_equal(
+        tiers, brute_force_tiers(sites, coords, toc.DEFAULT_CUSHION)
+    )
+    assert (tiers < 4).all()
+
+
+def test_toc_tier_sweep(sites, coords):
+    rng = numpy.random.default_rng(2)
+    entitlements = rng.integers(0, 4, len(coords))
+    cushions = [1.0, 1.2, 1.5]
+    cutoffs = [0.0, 10.0, 20.0]
+
+    sweep = toc.toc_tier_sweep(sites, coords, cushions, cutoffs, entitlements)
+
+    assert len(sweep) == len(cushions) * len(cutoffs) * 5
+    for (cushion, cutoff), counts in sweep.groupby(["cushion", "cutoff"]):
+        tiers = toc.TOCDistances(sites[sites.headway <= cutoff]).tier_of(
+            coords, cushion
+        )
+        assert counts.tier.tolist() == [0, 1, 2, 3, 4]
+        numpy.testing.assert_array_equal(
+            counts.parcels, numpy.bincount(tiers, minlength=5)
+        )
+        numpy.testing.assert_array_equal(
+            counts.entitlements,
+            numpy.bincount(tiers, weights=entitlements, minlength=5),
+        )
+    # More sites qualify with a longer cutoff headway, and the tiers reach
+    # further with a bigger cushion.
+    toc_parcels = sweep[sweep.tier > 0].groupby(["cushion", "cutoff"]).parcels.sum()
+    assert (toc_parcels.unstack().diff(axis=1).iloc[:, 1:] >= 0).all().all()
+    assert (toc_parcels.unstack().diff(axis=0).iloc[1:] >= 0).all().all()
+
+
+@pytest.fixture
+def toc_tiers(sites):
+    """
+    The tier buffers of the sites, in WGS 84, as from the
+    compute_toc_tiers_* functions.
+    """
+    empty = shapely.geometry.GeometryCollection()
+    columns = {}
+    for tier in (1, 2, 3, 4):
+        buffers = [
+            point.buffer(toc.TOC_TIER_DISTANCES[site_class][tier])
+            if tier in toc.TOC_TIER_DISTANCES[site_class]
+            else empty
+            for point, site_class in zip(sites.geometry, sites.site_class)
+        ]
+        columns[f"tier_{tier}"] = geopandas.GeoSeries(buffers, crs=sites.crs).to_crs(
+            f"EPSG:{toc.WGS84}"
+        ).values
+    return geopandas.GeoDataFrame(
+        {"mode": sites["mode"], **columns},
+        geometry=sites.geometry.to_crs(f"EPSG:{toc.WGS84}").values,
+    )
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(laplan.spatial, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_coverage_tiers_matches_buffer_join(toc_tiers, coords, cache_dir):
+    coverage, contributors = toc.cached_toc_tier_coverage(
+        toc_tiers, name="test_coverage", tile_size=5000.0
+    )
+    tiers = toc.coverage_tiers(coords, name="test_coverage")
+
+    # The highest tier of the buffers each point falls in.
+    points = geopandas.GeoDataFrame(
+        geometry=geopandas.points_from_xy(coords[:, 0], coords[:, 1]),
+        crs=f"EPSG:{toc.SOCAL_FEET}",
+    )
+    expected = numpy.zeros(len(coords), dtype="int8")
+    for tier in (1, 2, 3, 4):
+        buffers = geopandas.GeoDataFrame(
+            geometry=geopandas.GeoSeries(
+                toc_tiers[f"tier_{tier}"], crs=f"EPSG:{toc.WGS84}"
+            ).to_crs(f"EPSG:{toc.SOCAL_FEET}")
+        )
+        buffers = buffers[~buffers.is_empty]
+        joined = geopandas.sjoin(points, buffers, predicate="intersects")
+        expected[joined.index.unique()] = tier
+    numpy.testing.assert_array_equal(tiers, expected)
+    assert set(tiers) >= {0, 1, 2, 3, 4}
+
+    # Each polygon of the coverage has the sites whose buffers overlap it.
+    assert set(coverage.polygon) == set(contributors.polygon)
+    assert contributors.site.between(0, len(toc_tiers) - 1).all()
+    assert (contributors["mode"] == "bus").all()
+
+
+def test_cached_toc_tier_coverage_key(toc_tiers, cache_dir, monkeypatch):
+    builds = []
+    build = toc.toc_tier_coverage
+    monkeypatch.setattr(
+        toc,
+        "toc_tier_coverage",
+        lambda *args: builds.append(args) or build(*args),
+    )
+
+    def cached(tiers, **kwargs):
+        coverage, _ = toc.cached_toc_tier_coverage(tiers, name="test", **kwargs)
+        # Older entries are removed, so there is only ever one.
+        assert len(list(cache_dir.iterdir())) == 2
+        return coverage
+
+    cached(toc_tiers)
+    cached(toc_tiers.copy())
+    assert len(builds) == 1
+
+    coarse = cached(toc_tiers, tile_size=10000.0)
+    assert len(builds) == 2
+    assert coarse.bounds.eval("maxx - minx").max() > 2640.0
+
+    # Changed tiers are rebuilt, even though they have the same name.
+    fewer = cached(toc_tiers.iloc[:30])
+    assert len(builds) == 3
+    assert fewer.area.sum() < coarse.area.sum()
+    cached(toc_tiers.iloc[:30])
+    assert len(builds) == 3
+
+    cached(toc_tiers.iloc[:30], refresh=True)
+    assert len(builds) == 4
+
+    key = toc._toc_tier_coverage_key(toc_tiers, 2640.0)
+    assert key == toc._toc_tier_coverage_key(toc_tiers.copy(), 2640.0)
+    assert key != toc._toc_tier_coverage_key(toc_tiers, 5280.0)
+    assert key != toc._toc_tier_coverage_key(toc_tiers.assign(mode="rail"), 2640.0)
+    assert key != toc._toc_tier_coverage_key(toc_tiers.iloc[::-1], 2640.0)